@@ -0,0 +1,261 @@
+from decimal import Decimal
+from typing import Dict, List, Optional, Tuple
+from sqlalchemy import case, delete, func, insert
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlmodel import Session, select
+from .dinero import CERO
+from .models import LimiteMensual, ResumenMensual, SaldoCuenta, Transaccion
+from . import busqueda, cambios, facturas
+
+# Todos los montos son Decimal exactos (centavos enteros en la base, ver app/dinero.py):
+# saldos y resúmenes se comparan sin tolerancia y las sumas se hacen en SQL
+
+
+# ---------- Saldos por cuenta ----------
+def delta_saldo(tx: Transaccion) -> Decimal:
+    # Los ingresos suman al saldo; gastos y deudas restan
+    return tx.monto if tx.tipo == "ingreso" else -tx.monto
+
+def _upsert(session: Session, modelo, claves: list, valores: dict, sumar: list):
+    # INSERT ... ON CONFLICT DO UPDATE SET col = col + excluded.col (SQLite ≥ 3.24 y
+    # PostgreSQL): dos primeras escrituras concurrentes del mismo saldo o grupo no
+    # chocan con la clave primaria como pasaba con "UPDATE y si no había fila, INSERT"
+    insertar = postgresql.insert if session.get_bind().dialect.name == "postgresql" else sqlite.insert
+    stmt = insertar(modelo).values(**valores)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=claves,
+        set_={c: getattr(modelo, c) + getattr(stmt.excluded, c) for c in sumar},
+    )
+    session.execute(stmt)
+
+def _sumar_saldo(session: Session, cuenta_id: int, usuario_id: int, delta: Decimal):
+    _upsert(session, SaldoCuenta, ["cuenta_id"], {"cuenta_id": cuenta_id, "usuario_id": usuario_id, "saldo": delta}, ["saldo"])
+
+def registrar_transaccion(session: Session, tx: Transaccion):
+    # Llamar antes de session.commit() para que saldo, resumen e índice de búsqueda queden en el mismo commit
+    _sumar_saldo(session, tx.cuenta_id, tx.usuario_id, delta_saldo(tx))
+    _sumar_resumen(session, tx, 1)
+    busqueda.indexar(session, tx)
+    cambios.marcar(session, tx.usuario_id)
+
+def registrar_lote(session: Session, txs: List[Transaccion]):
+    # Como registrar_transaccion para muchas filas ya insertadas (importación): los
+    # deltas se juntan por cuenta y por grupo del resumen y se aplican una vez cada uno
+    saldos: Dict[Tuple[int, int], Decimal] = {}
+    grupos: Dict[tuple, list] = {}
+    for tx in txs:
+        clave_saldo = (tx.cuenta_id, tx.usuario_id)
+        saldos[clave_saldo] = saldos.get(clave_saldo, CERO) + delta_saldo(tx)
+        grupo = grupos.setdefault((tx.usuario_id, tx.mes, tx.tipo, tx.categoria, tx.subcategoria or ""), [CERO, 0])
+        grupo[0] += tx.monto
+        grupo[1] += 1
+    aplicar_totales(session, saldos, grupos, 1)
+    busqueda.indexar_lote(session, txs)
+    cambios.registrar(session, "transaccion", "insert", [(tx.usuario_id, tx.id) for tx in txs])
+    cambios.marcar(session, *{tx.usuario_id for tx in txs})
+
+def insertar_lote(session: Session, usuario_id: int, filas: Dict[str, dict]) -> List[str]:
+    # filas: huella → columnas de Transaccion. Inserta con executemany las que no
+    # existen todavía (índice único usuario_id + huella) y las registra; devuelve sus huellas
+    existentes = set(session.exec(
+        select(Transaccion.huella)
+        .where(Transaccion.usuario_id == usuario_id)
+        .where(Transaccion.huella.in_(list(filas)))
+    ).all())
+    nuevas = [fila for h, fila in filas.items() if h not in existentes]
+    if not nuevas:
+        return []
+    session.execute(insert(Transaccion), nuevas)
+    # Releer las filas con su id para saldos, resumen, índice de búsqueda y registro de cambios
+    txs = session.exec(
+        select(Transaccion)
+        .where(Transaccion.usuario_id == usuario_id)
+        .where(Transaccion.huella.in_([f["huella"] for f in nuevas]))
+    ).all()
+    registrar_lote(session, txs)
+    # flush antes de soltar los objetos: los grupos nuevos del resumen siguen pendientes
+    session.flush()
+    session.expunge_all()
+    return [f["huella"] for f in nuevas]
+
+def totales_filtro(session: Session, condicion, saldos: bool = True, resumen: bool = True):
+    # Lo que aportan a saldos y resumen las filas de Transaccion que cumplen `condicion`,
+    # agrupado en SQL (sin cargar las filas): ({(cuenta_id, usuario_id): delta}, {clave: [total, cantidad]})
+    por_cuenta: Dict[Tuple[int, int], Decimal] = {}
+    grupos: Dict[tuple, list] = {}
+    if saldos:
+        delta = func.sum(case((Transaccion.tipo == "ingreso", Transaccion.monto), else_=-Transaccion.monto))
+        for cuenta_id, usuario_id, total in session.exec(
+            select(Transaccion.cuenta_id, Transaccion.usuario_id, delta)
+            .where(condicion)
+            .group_by(Transaccion.cuenta_id, Transaccion.usuario_id)
+        ):
+            por_cuenta[(cuenta_id, usuario_id)] = total
+    if resumen:
+        subcategoria = func.coalesce(Transaccion.subcategoria, "")
+        columnas = (Transaccion.usuario_id, Transaccion.mes, Transaccion.tipo, Transaccion.categoria, subcategoria)
+        for fila in session.exec(
+            select(*columnas, func.sum(Transaccion.monto), func.count()).where(condicion).group_by(*columnas)
+        ):
+            grupos[tuple(fila[:5])] = [fila[5], fila[6]]
+    return por_cuenta, grupos
+
+def aplicar_totales(session: Session, saldos: Dict[Tuple[int, int], Decimal], grupos: Dict[tuple, list], signo: int):
+    # Suma (signo=1) o resta (signo=-1) los totales: una sentencia por cuenta y por grupo
+    for (cuenta_id, usuario_id), delta in saldos.items():
+        _sumar_saldo(session, cuenta_id, usuario_id, signo * delta)
+    for clave, (total, cantidad) in grupos.items():
+        _sumar_grupo(session, clave, signo * total, signo * cantidad)
+
+def anular_transaccion(session: Session, tx: Transaccion):
+    # Incluye liberar la referencia a su factura
+    _sumar_saldo(session, tx.cuenta_id, tx.usuario_id, -delta_saldo(tx))
+    _sumar_resumen(session, tx, -1)
+    busqueda.desindexar(session, tx.id)
+    facturas.liberar(session, tx)
+    cambios.marcar(session, tx.usuario_id)
+
+def _saldos_calculados(usuario_id: Optional[int] = None):
+    stmt = (
+        select(
+            Transaccion.cuenta_id,
+            func.min(Transaccion.usuario_id),
+            func.sum(case((Transaccion.tipo == "ingreso", Transaccion.monto), else_=-Transaccion.monto)),
+        )
+        .group_by(Transaccion.cuenta_id)
+    )
+    if usuario_id is not None:
+        stmt = stmt.where(Transaccion.usuario_id == usuario_id)
+    return stmt
+
+def reconstruir_saldos(session: Session, usuario_id: Optional[int] = None) -> int:
+    # Recalcula la tabla de saldos desde Transaccion (todo o un solo usuario)
+    borrar = delete(SaldoCuenta)
+    if usuario_id is not None:
+        borrar = borrar.where(SaldoCuenta.usuario_id == usuario_id)
+    session.execute(borrar)
+    result = session.execute(
+        insert(SaldoCuenta).from_select(
+            ["cuenta_id", "usuario_id", "saldo"], _saldos_calculados(usuario_id)
+        )
+    )
+    session.commit()
+    return result.rowcount
+
+def verificar_saldos(session: Session, usuario_id: Optional[int] = None) -> List[Tuple[int, Decimal, Decimal]]:
+    # Devuelve (cuenta_id, saldo_guardado, saldo_calculado) para cada cuenta descuadrada
+    calculados = {cuenta_id: total or CERO for cuenta_id, _, total in session.exec(_saldos_calculados(usuario_id))}
+    stmt = select(SaldoCuenta)
+    if usuario_id is not None:
+        stmt = stmt.where(SaldoCuenta.usuario_id == usuario_id)
+    guardados = {s.cuenta_id: s.saldo for s in session.exec(stmt)}
+
+    diferencias = []
+    for cuenta_id in sorted(set(calculados) | set(guardados)):
+        guardado = guardados.get(cuenta_id, CERO)
+        calculado = calculados.get(cuenta_id, CERO)
+        if guardado != calculado:
+            diferencias.append((cuenta_id, guardado, calculado))
+    return diferencias
+
+
+# ---------- Resumen mensual ----------
+def _clave_resumen(clave: tuple):
+    usuario_id, mes, tipo, categoria, subcategoria = clave
+    return (
+        ResumenMensual.usuario_id == usuario_id,
+        ResumenMensual.mes == mes,
+        ResumenMensual.tipo == tipo,
+        ResumenMensual.categoria == categoria,
+        ResumenMensual.subcategoria == subcategoria,
+    )
+
+def _sumar_grupo(session: Session, clave: tuple, total: Decimal, cantidad: int):
+    # clave = (usuario_id, mes, tipo, categoria, subcategoria or "")
+    usuario_id, mes, tipo, categoria, subcategoria = clave
+    _upsert(
+        session, ResumenMensual, ["usuario_id", "mes", "tipo", "categoria", "subcategoria"],
+        {
+            "usuario_id": usuario_id, "mes": mes, "tipo": tipo, "categoria": categoria,
+            "subcategoria": subcategoria, "total": total, "cantidad": cantidad,
+        },
+        ["total", "cantidad"],
+    )
+    if cantidad < 0:
+        # No dejar filas vacías cuando se elimina la última transacción del grupo
+        session.execute(delete(ResumenMensual).where(*_clave_resumen(clave), ResumenMensual.cantidad <= 0))
+
+def _sumar_resumen(session: Session, tx: Transaccion, signo: int):
+    clave = (tx.usuario_id, tx.mes, tx.tipo, tx.categoria, tx.subcategoria or "")
+    _sumar_grupo(session, clave, signo * tx.monto, signo)
+
+def _resumenes_calculados(usuario_id: Optional[int] = None):
+    subcategoria = func.coalesce(Transaccion.subcategoria, "")
+    stmt = (
+        select(
+            Transaccion.usuario_id, Transaccion.mes, Transaccion.tipo, Transaccion.categoria, subcategoria,
+            func.sum(Transaccion.monto), func.count(),
+        )
+        .group_by(Transaccion.usuario_id, Transaccion.mes, Transaccion.tipo, Transaccion.categoria, subcategoria)
+    )
+    if usuario_id is not None:
+        stmt = stmt.where(Transaccion.usuario_id == usuario_id)
+    return stmt
+
+def reconstruir_resumenes(session: Session, usuario_id: Optional[int] = None) -> int:
+    borrar = delete(ResumenMensual)
+    if usuario_id is not None:
+        borrar = borrar.where(ResumenMensual.usuario_id == usuario_id)
+    session.execute(borrar)
+    result = session.execute(
+        insert(ResumenMensual).from_select(
+            ["usuario_id", "mes", "tipo", "categoria", "subcategoria", "total", "cantidad"],
+            _resumenes_calculados(usuario_id),
+        )
+    )
+    session.commit()
+    return result.rowcount
+
+def verificar_resumenes(session: Session, usuario_id: Optional[int] = None) -> List[Tuple[tuple, tuple, tuple]]:
+    # Devuelve (clave, (total, cantidad) guardado, (total, cantidad) calculado) para cada grupo descuadrado
+    calculados = {tuple(fila[:5]): (fila[5], fila[6]) for fila in session.exec(_resumenes_calculados(usuario_id))}
+    stmt = select(ResumenMensual)
+    if usuario_id is not None:
+        stmt = stmt.where(ResumenMensual.usuario_id == usuario_id)
+    guardados = {
+        (r.usuario_id, r.mes, r.tipo, r.categoria, r.subcategoria): (r.total, r.cantidad)
+        for r in session.exec(stmt)
+    }
+
+    diferencias = []
+    for clave in sorted(set(calculados) | set(guardados)):
+        guardado = guardados.get(clave, (CERO, 0))
+        calculado = calculados.get(clave, (CERO, 0))
+        if guardado != calculado:
+            diferencias.append((clave, guardado, calculado))
+    return diferencias
+
+def totales_mes(session: Session, usuario_id: int, mes: str) -> Dict[str, Decimal]:
+    # KPIs del mes (ingresos, gastos y límite) en una sola consulta sobre el resumen
+    limite = (
+        select(LimiteMensual.monto_limite)
+        .where(LimiteMensual.usuario_id == usuario_id)
+        .where(LimiteMensual.mes == mes)
+        .limit(1)
+        .scalar_subquery()
+    )
+    ingresos, gastos, monto_limite = session.exec(
+        select(
+            func.coalesce(func.sum(case((ResumenMensual.tipo == "ingreso", ResumenMensual.total), else_=0)), 0),
+            func.coalesce(func.sum(case((ResumenMensual.tipo.in_(("gasto", "deuda")), ResumenMensual.total), else_=0)), 0),
+            limite,
+        )
+        .select_from(ResumenMensual)
+        .where(ResumenMensual.usuario_id == usuario_id)
+        .where(ResumenMensual.mes == mes)
+    ).one()
+    return {
+        "total_ingresos": ingresos,
+        "total_gastos": gastos,
+        "monto_limite": monto_limite if monto_limite is not None else CERO,
+    }
@@ -0,0 +1,153 @@
+import os
+import shutil
+import threading
+from abc import ABC, abstractmethod
+from typing import Iterable
+from .metricas import medir_almacenamiento
+
+# Dónde se guardan las facturas. FACTURAS_BACKEND=supabase (por defecto) usa el
+# bucket de Supabase Storage; FACTURAS_BACKEND=local las guarda en disco y las sirve
+# la propia app en /facturas-locales (útil en desarrollo y para probar sin Supabase).
+FACTURAS_BACKEND = os.getenv("FACTURAS_BACKEND", "supabase")
+FACTURAS_BUCKET = os.getenv("FACTURAS_BUCKET", "facturas")
+FACTURAS_DIR = os.getenv("FACTURAS_DIR", "facturas_locales")
+FACTURAS_URL_LOCAL = "/facturas-locales"
+
+
+class Almacenamiento(ABC):
+    # Todas las operaciones son bloqueantes: llamarlas desde el threadpool en rutas async
+
+    @abstractmethod
+    def subir(self, ruta: str, datos: bytes, content_type: str) -> None:
+        ...
+
+    @abstractmethod
+    def subir_archivo(self, ruta: str, archivo: str, content_type: str) -> None:
+        # Sube desde un archivo en disco sin cargarlo entero en memoria
+        ...
+
+    @abstractmethod
+    def url_publica(self, ruta: str) -> str:
+        ...
+
+    @abstractmethod
+    def borrar(self, rutas: Iterable[str]) -> None:
+        ...
+
+
+# El SDK de Supabase es pesado de importar y de construir: el cliente se crea con la
+# primera factura que se sube, borra o consulta, y se comparte en todo el proceso
+_cliente_supabase = None
+_lock_cliente = threading.Lock()
+
+def _credenciales_supabase():
+    url = os.getenv("SUPABASE_URL")
+    key = os.getenv("SUPABASE_KEY")
+    if not url or not key:
+        raise ValueError("Faltan variables de entorno SUPABASE_URL o SUPABASE_KEY")
+    return url, key
+
+def cliente_supabase():
+    global _cliente_supabase
+    if _cliente_supabase is None:
+        with _lock_cliente:
+            if _cliente_supabase is None:
+                from supabase import create_client
+
+                _cliente_supabase = create_client(*_credenciales_supabase())
+    return _cliente_supabase
+
+
+class AlmacenamientoSupabase(Almacenamiento):
+    def __init__(self, client=None, bucket: str = FACTURAS_BUCKET):
+        # client=None: el compartido del proceso, creado al primer uso
+        self._client = client
+        self.bucket = bucket
+
+    @property
+    def client(self):
+        return self._client or cliente_supabase()
+
+    def _opciones(self, content_type: str) -> dict:
+        # La ruta depende solo del contenido: volver a subir (reintento, subida que llegó
+        # pero el cliente cortó por timeout, factura en error) reescribe el mismo objeto.
+        # Sin upsert Supabase responde 409 Duplicate y la factura nunca sale de error
+        return {"content-type": content_type, "upsert": "true"}
+
+    def subir(self, ruta: str, datos: bytes, content_type: str) -> None:
+        self.client.storage.from_(self.bucket).upload(ruta, datos, file_options=self._opciones(content_type))
+
+    def subir_archivo(self, ruta: str, archivo: str, content_type: str) -> None:
+        # storage3 abre la ruta y la envía por streaming en el multipart
+        self.client.storage.from_(self.bucket).upload(ruta, archivo, file_options=self._opciones(content_type))
+
+    def url_publica(self, ruta: str) -> str:
+        return self.client.storage.from_(self.bucket).get_public_url(ruta)
+
+    def borrar(self, rutas: Iterable[str]) -> None:
+        rutas = list(rutas)
+        if rutas:
+            self.client.storage.from_(self.bucket).remove(rutas)
+
+
+class AlmacenamientoLocal(Almacenamiento):
+    def __init__(self, directorio: str = FACTURAS_DIR, url_base: str = FACTURAS_URL_LOCAL):
+        self.directorio = directorio
+        self.url_base = url_base
+        os.makedirs(directorio, exist_ok=True)
+
+    def _ruta(self, ruta: str) -> str:
+        destino = os.path.realpath(os.path.join(self.directorio, ruta))
+        if not destino.startswith(os.path.realpath(self.directorio) + os.sep):
+            raise ValueError(f"Ruta fuera del directorio de facturas: {ruta}")
+        return destino
+
+    def subir(self, ruta: str, datos: bytes, content_type: str) -> None:
+        destino = self._ruta(ruta)
+        os.makedirs(os.path.dirname(destino), exist_ok=True)
+        temporal = destino + ".part"
+        with open(temporal, "wb") as f:
+            f.write(datos)
+        os.replace(temporal, destino)
+
+    def subir_archivo(self, ruta: str, archivo: str, content_type: str) -> None:
+        destino = self._ruta(ruta)
+        os.makedirs(os.path.dirname(destino), exist_ok=True)
+        temporal = destino + ".part"
+        shutil.copyfile(archivo, temporal)
+        os.replace(temporal, destino)
+
+    def url_publica(self, ruta: str) -> str:
+        return f"{self.url_base}/{ruta}"
+
+    def borrar(self, rutas: Iterable[str]) -> None:
+        for ruta in rutas:
+            try:
+                os.remove(self._ruta(ruta))
+            except FileNotFoundError:
+                pass
+
+
+class AlmacenamientoMedido(Almacenamiento):
+    # Envuelve otro almacenamiento y registra la duración de cada llamada en /metrics
+    def __init__(self, interno: Almacenamiento):
+        self.interno = interno
+
+    def subir(self, ruta: str, datos: bytes, content_type: str) -> None:
+        medir_almacenamiento("subir", self.interno.subir, ruta, datos, content_type)
+
+    def subir_archivo(self, ruta: str, archivo: str, content_type: str) -> None:
+        medir_almacenamiento("subir_archivo", self.interno.subir_archivo, ruta, archivo, content_type)
+
+    def url_publica(self, ruta: str) -> str:
+        return self.interno.url_publica(ruta)
+
+    def borrar(self, rutas: Iterable[str]) -> None:
+        medir_almacenamiento("borrar", self.interno.borrar, rutas)
+
+
+def crear_almacenamiento() -> Almacenamiento:
+    if FACTURAS_BACKEND == "local":
+        return AlmacenamientoMedido(AlmacenamientoLocal())
+    _credenciales_supabase()  # sin credenciales falla al arrancar, no con la primera factura
+    return AlmacenamientoMedido(AlmacenamientoSupabase())
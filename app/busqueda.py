@@ -0,0 +1,178 @@
+import re
+from datetime import date, datetime, timedelta
+from decimal import Decimal, InvalidOperation
+from types import SimpleNamespace
+from typing import Optional
+from sqlalchemy import column, delete, or_, select as sa_select, table, text
+from sqlmodel import Session, select
+from .dinero import MONTO_MAXIMO, a_decimal
+from .models import Transaccion
+
+# Índice de texto completo (SQLite FTS5) sobre las transacciones.
+# rowid de la tabla virtual = Transaccion.id; el texto junta tipo, categoría,
+# subcategoría, monto formateado y fecha para que el buscador encuentre cualquiera de ellos.
+FTS_TABLA = "transaccion_fts"
+_fts = table(FTS_TABLA, column("rowid"), column("texto"))
+_TERMINOS = re.compile(r"[^\s\"]+")
+
+
+def usa_fts(bind) -> bool:
+    # bind puede ser Session/AsyncSession, Engine o Connection
+    if hasattr(bind, "get_bind"):
+        bind = bind.get_bind()
+    return bind.dialect.name == "sqlite"
+
+def crear_indice_busqueda(conn):
+    if usa_fts(conn):
+        conn.execute(text(
+            f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLA} "
+            "USING fts5(texto, tokenize = 'unicode61 remove_diacritics 2')"
+        ))
+
+def texto_busqueda(tx: Transaccion) -> str:
+    partes = [
+        tx.tipo,
+        tx.categoria,
+        tx.subcategoria or "",
+        f"{tx.monto:.2f}",                          # sin formato: 150000.00
+        f"{tx.monto:,.0f}".replace(",", "."),       # como se muestra en las listas: 150.000
+        tx.fecha.strftime("%Y-%m-%d"),
+    ]
+    return " ".join(p for p in partes if p)
+
+
+# ---------- Sincronización ----------
+def indexar(session: Session, tx: Transaccion):
+    if not usa_fts(session):
+        return
+    if tx.id is None:
+        session.flush()
+    session.execute(text(f"DELETE FROM {FTS_TABLA} WHERE rowid = :id"), {"id": tx.id})
+    session.execute(
+        text(f"INSERT INTO {FTS_TABLA}(rowid, texto) VALUES (:id, :texto)"),
+        {"id": tx.id, "texto": texto_busqueda(tx)},
+    )
+
+def indexar_lote(session: Session, txs):
+    # Filas recién insertadas (importación): no hace falta borrar entradas previas
+    if not usa_fts(session) or not txs:
+        return
+    session.execute(
+        text(f"INSERT INTO {FTS_TABLA}(rowid, texto) VALUES (:id, :texto)"),
+        [{"id": tx.id, "texto": texto_busqueda(tx)} for tx in txs],
+    )
+
+def desindexar(session: Session, tx_id: int):
+    if not usa_fts(session):
+        return
+    session.execute(text(f"DELETE FROM {FTS_TABLA} WHERE rowid = :id"), {"id": tx_id})
+
+def desindexar_filtro(session: Session, condicion):
+    # Todas las transacciones que cumplen `condicion`, en una sentencia
+    if not usa_fts(session):
+        return
+    session.execute(delete(_fts).where(_fts.c.rowid.in_(sa_select(Transaccion.id).where(condicion))))
+
+def reindexar_filtro(session: Session, condicion, **valores):
+    # Antes de un UPDATE masivo: reescribe el texto de las filas de `condicion` con los
+    # valores nuevos (ej. categoria="fijo") ya aplicados
+    if not usa_fts(session):
+        return
+    txs = session.exec(
+        select(
+            Transaccion.id, Transaccion.tipo, Transaccion.categoria,
+            Transaccion.subcategoria, Transaccion.monto, Transaccion.fecha,
+        ).where(condicion)
+    ).all()
+    if not txs:
+        return
+    desindexar_filtro(session, condicion)
+    session.execute(
+        text(f"INSERT INTO {FTS_TABLA}(rowid, texto) VALUES (:id, :texto)"),
+        [{"id": tx.id, "texto": texto_busqueda(SimpleNamespace(**{**tx._asdict(), **valores}))} for tx in txs],
+    )
+
+def reconstruir_indice(session: Session, lote: int = 1000) -> int:
+    if not usa_fts(session):
+        return 0
+    session.execute(text(f"DELETE FROM {FTS_TABLA}"))
+    total = 0
+    ultimo_id = 0
+    while True:
+        # Solo las columnas del texto: la migración 3 corre antes de que existan las columnas nuevas
+        txs = session.exec(
+            select(
+                Transaccion.id, Transaccion.tipo, Transaccion.categoria,
+                Transaccion.subcategoria, Transaccion.monto, Transaccion.fecha,
+            )
+            .where(Transaccion.id > ultimo_id).order_by(Transaccion.id).limit(lote)
+        ).all()
+        if not txs:
+            break
+        session.execute(
+            text(f"INSERT INTO {FTS_TABLA}(rowid, texto) VALUES (:id, :texto)"),
+            [{"id": tx.id, "texto": texto_busqueda(tx)} for tx in txs],
+        )
+        total += len(txs)
+        ultimo_id = txs[-1].id
+    session.commit()
+    return total
+
+
+# ---------- Consultas ----------
+def fecha_o_none(valor: Optional[str]) -> Optional[date]:
+    # Los formularios mandan "" cuando el campo queda vacío
+    try:
+        return date.fromisoformat(valor) if valor else None
+    except ValueError:
+        return None
+
+def numero_o_none(valor: Optional[str]) -> Optional[Decimal]:
+    # Decimal exacto como los montos (nunca float); fuera de rango se lleva al tope
+    try:
+        numero = Decimal(valor.strip()) if valor not in (None, "") else None
+    except InvalidOperation:
+        return None
+    if numero is None or not numero.is_finite():
+        return None
+    return a_decimal(max(-MONTO_MAXIMO, min(numero, MONTO_MAXIMO)))
+
+def consulta_fts(q: str) -> Optional[str]:
+    # Cada palabra se busca como prefijo ("lu" encuentra "luz"); todas deben aparecer
+    terminos = _TERMINOS.findall(q or "")
+    if not terminos:
+        return None
+    return " ".join(f'"{t}"*' for t in terminos)
+
+def filtrar(
+    stmt,
+    session: Session,
+    q: Optional[str] = None,
+    desde: Optional[date] = None,
+    hasta: Optional[date] = None,
+    monto_min: Optional[Decimal] = None,
+    monto_max: Optional[Decimal] = None,
+):
+    # Agrega al SELECT de Transaccion el texto buscado y los rangos de fecha/monto
+    consulta = consulta_fts(q)
+    if consulta:
+        if usa_fts(session):
+            ids = sa_select(_fts.c.rowid).where(_fts.c.texto.op("MATCH")(consulta))
+            stmt = stmt.where(Transaccion.id.in_(ids))
+        else:
+            for termino in _TERMINOS.findall(q):
+                patron = f"%{termino}%"
+                stmt = stmt.where(or_(
+                    Transaccion.tipo.ilike(patron),
+                    Transaccion.categoria.ilike(patron),
+                    Transaccion.subcategoria.ilike(patron),
+                ))
+    if desde:
+        stmt = stmt.where(Transaccion.fecha >= datetime.combine(desde, datetime.min.time()))
+    if hasta:
+        stmt = stmt.where(Transaccion.fecha < datetime.combine(hasta + timedelta(days=1), datetime.min.time()))
+    if monto_min is not None:
+        stmt = stmt.where(Transaccion.monto >= monto_min)
+    if monto_max is not None:
+        stmt = stmt.where(Transaccion.monto <= monto_max)
+    return stmt
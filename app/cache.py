@@ -0,0 +1,88 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Optional, Set, Tuple
+
+# Caché en memoria del proceso, acotada (LRU) y con vencimiento, donde cada entrada
+# pertenece a un usuario para poder invalidar todo lo suyo de una vez. La usan la
+# sesión (token → usuario) y las series de /api/series. Thread-safe: también la
+# usan rutas sync y el threadpool.
+
+
+class CachePorUsuario:
+    def __init__(self, tamano: int, ttl: float):
+        self.tamano = tamano
+        self.ttl = ttl
+        self._datos: "OrderedDict[Hashable, Tuple[int, Any, float]]" = OrderedDict()
+        self._por_usuario: Dict[int, Set[Hashable]] = {}
+        # Sube con cada invalidar_usuario: quien leyó algo de la base antes de una
+        # invalidación no lo guarda después (ver guardar(generacion=...))
+        self._generaciones: Dict[int, int] = {}
+        self._lock = threading.Lock()
+        self.aciertos = 0
+        self.fallos = 0
+
+    def obtener(self, clave: Hashable) -> Optional[Any]:
+        with self._lock:
+            entrada = self._datos.get(clave)
+            if entrada is None or entrada[2] <= time.monotonic():
+                if entrada is not None:
+                    self._quitar(clave)
+                self.fallos += 1
+                return None
+            self._datos.move_to_end(clave)
+            self.aciertos += 1
+            return entrada[1]
+
+    def generacion(self, usuario_id: int) -> int:
+        with self._lock:
+            return self._generaciones.get(usuario_id, 0)
+
+    def guardar(self, clave: Hashable, usuario_id: int, valor: Any, ttl: Optional[float] = None, generacion: Optional[int] = None):
+        # ttl: para entradas que deben vencer antes que el resto (ej. el token expira antes).
+        # generacion: la de generacion() antes de leer el valor; si el usuario se invalidó
+        # entre medio el valor puede ser viejo y no se guarda
+        vence = time.monotonic() + (self.ttl if ttl is None else min(ttl, self.ttl))
+        with self._lock:
+            if generacion is not None and self._generaciones.get(usuario_id, 0) != generacion:
+                return
+            self._quitar(clave)
+            self._datos[clave] = (usuario_id, valor, vence)
+            self._por_usuario.setdefault(usuario_id, set()).add(clave)
+            while len(self._datos) > self.tamano:
+                self._quitar(next(iter(self._datos)))
+
+    def invalidar(self, clave: Hashable):
+        with self._lock:
+            self._quitar(clave)
+
+    def invalidar_usuario(self, usuario_id: int):
+        with self._lock:
+            self._generaciones[usuario_id] = self._generaciones.get(usuario_id, 0) + 1
+            for clave in list(self._por_usuario.get(usuario_id, ())):
+                self._quitar(clave)
+
+    def limpiar(self):
+        with self._lock:
+            self._datos.clear()
+            self._por_usuario.clear()
+
+    def __len__(self) -> int:
+        return len(self._datos)
+
+    def _quitar(self, clave: Hashable):
+        entrada = self._datos.pop(clave, None)
+        if entrada:
+            claves = self._por_usuario.get(entrada[0])
+            if claves:
+                claves.discard(clave)
+                if not claves:
+                    del self._por_usuario[entrada[0]]
+
+
+def etag_coincide(if_none_match: Optional[str], etag: str) -> bool:
+    # If-None-Match puede traer varias etiquetas, débiles (W/"...") o "*"
+    if not if_none_match:
+        return False
+    etiquetas = [e.strip().removeprefix("W/") for e in if_none_match.split(",")]
+    return "*" in etiquetas or etag.removeprefix("W/") in etiquetas
@@ -0,0 +1,88 @@
+from datetime import datetime
+from typing import Callable, Iterable, List, Set, Tuple
+from sqlalchemy import event, insert, literal, select, update
+from sqlalchemy.orm import Session
+from .models import Cambio, Cuenta, LimiteMensual, Transaccion, Usuario
+
+# Versión de los datos de cada usuario. Las rutas y helpers que escriben llaman a
+# marcar() antes del commit: sube Usuario.version_datos en la misma transacción (una
+# vez por usuario y commit) y, cuando el commit se confirma, avisa a cada suscriptor
+# (las cachés) con los usuarios tocados. Invalidar después del commit evita que otra
+# petición vuelva a cachear datos viejos entre medio.
+#
+# Además cada alta, modificación o baja de Transaccion, Cuenta y LimiteMensual queda
+# en la tabla cambio (registro para /api/sync). Lo que pasa por el ORM se registra solo
+# en after_flush; las escrituras masivas con Core llaman a registrar() o registrar_consulta().
+_CLAVE = "usuarios_modificados"
+_suscriptores: List[Callable[[Set[int]], None]] = []
+_ENTIDADES = {Transaccion: "transaccion", Cuenta: "cuenta", LimiteMensual: "limitemensual"}
+
+
+def suscribir(fn: Callable[[Set[int]], None]):
+    _suscriptores.append(fn)
+    return fn
+
+def marcar(session: Session, *usuario_ids: int):
+    # Session síncrona; desde rutas async: await session.run_sync(cambios.marcar, user.id)
+    modificados = session.info.setdefault(_CLAVE, set())
+    nuevos = set(usuario_ids) - modificados
+    if not nuevos:
+        return
+    modificados |= nuevos
+    session.execute(
+        update(Usuario)
+        .where(Usuario.id.in_(nuevos))
+        .values(version_datos=Usuario.version_datos + 1)
+        .execution_options(synchronize_session=False)
+    )
+
+def registrar(session: Session, entidad: str, operacion: str, filas: Iterable[Tuple[int, int]]):
+    # filas: (usuario_id, entidad_id)
+    ahora = datetime.utcnow()
+    valores = [
+        {"usuario_id": u, "entidad": entidad, "entidad_id": i, "operacion": operacion, "creado": ahora}
+        for u, i in filas
+    ]
+    if valores:
+        session.execute(insert(Cambio), valores)
+
+def registrar_consulta(session: Session, entidad: str, operacion: str, filas):
+    # Como registrar() pero con un SELECT (usuario_id, entidad_id): INSERT ... SELECT
+    # en la base, sin traer las filas (operaciones masivas por filtro)
+    consulta = filas.subquery()
+    usuario_id, entidad_id = consulta.c
+    session.execute(insert(Cambio).from_select(
+        ["usuario_id", "entidad", "entidad_id", "operacion", "creado"],
+        select(usuario_id, literal(entidad), entidad_id, literal(operacion), literal(datetime.utcnow())),
+    ))
+
+@event.listens_for(Session, "after_flush")
+def _registrar_flush(session, contexto):
+    ahora = datetime.utcnow()
+    valores = []
+    for objetos, operacion in (
+        (session.new, "insert"),
+        ((o for o in session.dirty if session.is_modified(o, include_collections=False)), "update"),
+        (session.deleted, "delete"),
+    ):
+        for obj in objetos:
+            entidad = _ENTIDADES.get(type(obj))
+            if entidad:
+                valores.append({
+                    "usuario_id": obj.usuario_id, "entidad": entidad, "entidad_id": obj.id,
+                    "operacion": operacion, "creado": ahora,
+                })
+    if valores:
+        # Dentro del flush: directo sobre la conexión, sin pasar por la sesión
+        session.connection().execute(insert(Cambio), valores)
+
+@event.listens_for(Session, "after_commit")
+def _al_confirmar(session):
+    usuarios = session.info.pop(_CLAVE, None)
+    if usuarios:
+        for fn in _suscriptores:
+            fn(usuarios)
+
+@event.listens_for(Session, "after_rollback")
+def _al_deshacer(session):
+    session.info.pop(_CLAVE, None)
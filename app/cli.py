@@ -0,0 +1,135 @@
+import argparse
+import sys
+from datetime import timedelta
+from sqlmodel import Session
+from .database import crear_db, engine
+from . import agregados, busqueda, facturas, importacion, migraciones
+from .almacenamiento import crear_almacenamiento
+
+# Uso: python -m app.cli migrar
+#      python -m app.cli planes
+#      python -m app.cli saldos reconstruir [--usuario ID]
+#      python -m app.cli resumenes verificar [--usuario ID]
+#      python -m app.cli busqueda reconstruir
+#      python -m app.cli facturas gc [--gracia-horas N] [--lote N]
+#      python -m app.cli importar extracto.csv --usuario ID --cuenta ID [--columna monto=Valor]
+
+
+def cmd_migrar(args) -> int:
+    # crear_db() ya aplicó las migraciones pendientes antes de llegar aquí
+    print(f"Esquema en la versión {migraciones.version_actual(engine)}")
+    return 0
+
+
+def cmd_planes(args) -> int:
+    fallos = 0
+    for nombre, plan, ok in migraciones.verificar_planes(engine):
+        print(f"[{'OK' if ok else 'FALLA'}] {nombre}: {plan}")
+        fallos += not ok
+    return 1 if fallos else 0
+
+
+def cmd_saldos(args) -> int:
+    with Session(engine) as session:
+        if args.accion == "reconstruir":
+            n = agregados.reconstruir_saldos(session, args.usuario)
+            print(f"Saldos reconstruidos: {n} cuentas")
+            return 0
+        diferencias = agregados.verificar_saldos(session, args.usuario)
+        for cuenta_id, guardado, calculado in diferencias:
+            print(f"Cuenta {cuenta_id}: guardado={guardado:.2f} calculado={calculado:.2f}")
+        print("Saldos correctos" if not diferencias else f"{len(diferencias)} cuentas descuadradas")
+        return 1 if diferencias else 0
+
+
+def cmd_resumenes(args) -> int:
+    with Session(engine) as session:
+        if args.accion == "reconstruir":
+            n = agregados.reconstruir_resumenes(session, args.usuario)
+            print(f"Resúmenes reconstruidos: {n} grupos")
+            return 0
+        diferencias = agregados.verificar_resumenes(session, args.usuario)
+        for clave, guardado, calculado in diferencias:
+            print(f"{clave}: guardado={guardado} calculado={calculado}")
+        print("Resúmenes correctos" if not diferencias else f"{len(diferencias)} grupos descuadrados")
+        return 1 if diferencias else 0
+
+
+def cmd_busqueda(args) -> int:
+    with Session(engine) as session:
+        n = busqueda.reconstruir_indice(session)
+    print(f"Índice de búsqueda reconstruido: {n} transacciones")
+    return 0
+
+
+def cmd_facturas(args) -> int:
+    gracia = timedelta(hours=args.gracia_horas) if args.gracia_horas is not None else facturas.FACTURAS_GRACIA_GC
+    with Session(engine) as session:
+        n = facturas.recolectar_huerfanas(session, crear_almacenamiento(), gracia, args.lote)
+    print(f"Facturas huérfanas borradas: {n}")
+    return 0
+
+
+def cmd_importar(args) -> int:
+    mapeo = dict(c.split("=", 1) for c in args.columna)
+
+    def progreso(avance):
+        print(f"Lote {avance['lote']}: {avance['insertadas']} nuevas, {avance['duplicadas']} ya importadas")
+
+    try:
+        with open(args.archivo, "rb") as archivo, Session(engine) as session:
+            filas = importacion.leer_extracto(archivo, args.archivo, mapeo)
+            resultado = importacion.importar(session, args.usuario, args.cuenta, filas, args.lote, progreso)
+    except importacion.ImportacionInvalida as e:
+        print(f"Error: {e}")
+        return 1
+    print(f"{resultado.leidas} filas leídas: {resultado.insertadas} importadas, {resultado.duplicadas} duplicadas")
+    return 0
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m app.cli", description="Tareas de mantenimiento de Finanzas")
+    sub = parser.add_subparsers(dest="comando", required=True)
+
+    p_migrar = sub.add_parser("migrar", help="Aplicar las migraciones pendientes del esquema")
+    p_migrar.set_defaults(func=cmd_migrar)
+
+    p_planes = sub.add_parser("planes", help="Comprobar con EXPLAIN QUERY PLAN que las consultas usan sus índices")
+    p_planes.set_defaults(func=cmd_planes)
+
+    p_saldos = sub.add_parser("saldos", help="Reconstruir o verificar los saldos por cuenta")
+    p_saldos.add_argument("accion", choices=["reconstruir", "verificar"])
+    p_saldos.add_argument("--usuario", type=int, default=None, help="Limitar a un usuario")
+    p_saldos.set_defaults(func=cmd_saldos)
+
+    p_resumenes = sub.add_parser("resumenes", help="Reconstruir o verificar el resumen mensual por categoría")
+    p_resumenes.add_argument("accion", choices=["reconstruir", "verificar"])
+    p_resumenes.add_argument("--usuario", type=int, default=None, help="Limitar a un usuario")
+    p_resumenes.set_defaults(func=cmd_resumenes)
+
+    p_busqueda = sub.add_parser("busqueda", help="Reconstruir el índice de texto completo de transacciones")
+    p_busqueda.add_argument("accion", choices=["reconstruir"])
+    p_busqueda.set_defaults(func=cmd_busqueda)
+
+    p_facturas = sub.add_parser("facturas", help="Borrar las facturas que ninguna transacción usa")
+    p_facturas.add_argument("accion", choices=["gc"])
+    p_facturas.add_argument("--gracia-horas", type=int, default=None, help="Horas sin referencias antes de borrar")
+    p_facturas.add_argument("--lote", type=int, default=100, help="Facturas borradas por lote")
+    p_facturas.set_defaults(func=cmd_facturas)
+
+    p_importar = sub.add_parser("importar", help="Importar un extracto bancario CSV u OFX")
+    p_importar.add_argument("archivo")
+    p_importar.add_argument("--usuario", type=int, required=True)
+    p_importar.add_argument("--cuenta", type=int, required=True)
+    p_importar.add_argument("--lote", type=int, default=importacion.LOTE_IMPORTACION, help="Filas por lote")
+    p_importar.add_argument("--columna", action="append", default=[], metavar="CAMPO=NOMBRE",
+                            help="Nombre de la columna del CSV para un campo (fecha, monto, debito, credito, descripcion...)")
+    p_importar.set_defaults(func=cmd_importar)
+
+    args = parser.parse_args(argv)
+    crear_db()
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,167 @@
+import asyncio
+import logging
+import os
+from dataclasses import dataclass
+from typing import List, Optional
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import update
+from sqlmodel import select
+from sqlmodel.ext.asyncio.session import AsyncSession
+from . import cambios
+from .almacenamiento import Almacenamiento
+from .facturas import descartar, generar_miniatura, pendientes_vencidas, ruta_miniatura, ESTADO_ERROR, ESTADO_SUBIDA
+from .database import async_engine
+from .models import Factura, Transaccion
+
+# Subida de facturas en segundo plano. La ruta guarda la transacción con
+# factura_estado="pendiente" y encola el temporal en disco; los trabajadores lo suben
+# al almacenamiento con reintentos, generan la miniatura una sola vez y completan la
+# Factura y todas las transacciones que la usan cuando terminan.
+FACTURAS_COLA_TAMANO = int(os.getenv("FACTURAS_COLA_TAMANO", "100"))
+FACTURAS_TRABAJADORES = int(os.getenv("FACTURAS_TRABAJADORES", "2"))
+FACTURAS_MAX_INTENTOS = int(os.getenv("FACTURAS_MAX_INTENTOS", "5"))
+FACTURAS_ESPERA_BASE = float(os.getenv("FACTURAS_ESPERA_BASE", "0.5"))  # segundos, se duplica en cada reintento
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class TrabajoFactura:
+    sha256: str
+    ruta: str
+    archivo: str  # temporal en disco (ver facturas.leer_factura); se borra al terminar
+    content_type: str
+
+
+async def subir_con_reintentos(
+    almacenamiento: Almacenamiento,
+    ruta: str,
+    datos,
+    content_type: str,
+    intentos: int = FACTURAS_MAX_INTENTOS,
+    espera_base: float = FACTURAS_ESPERA_BASE,
+) -> str:
+    # Sube fuera del event loop con backoff exponencial; devuelve la URL pública.
+    # datos puede ser bytes o la ruta de un archivo en disco
+    subir = almacenamiento.subir_archivo if isinstance(datos, str) else almacenamiento.subir
+    for intento in range(1, intentos + 1):
+        try:
+            await run_in_threadpool(subir, ruta, datos, content_type)
+            return almacenamiento.url_publica(ruta)
+        except Exception:
+            if intento == intentos:
+                raise
+            espera = espera_base * 2 ** (intento - 1)
+            logger.warning("Fallo al subir %s (intento %d/%d), reintento en %.1fs", ruta, intento, intentos, espera)
+            await asyncio.sleep(espera)
+
+
+class ColaFacturas:
+    def __init__(
+        self,
+        almacenamiento: Almacenamiento,
+        tamano: int = FACTURAS_COLA_TAMANO,
+        trabajadores: int = FACTURAS_TRABAJADORES,
+    ):
+        self.almacenamiento = almacenamiento
+        self.tamano = tamano
+        self.num_trabajadores = trabajadores
+        self._cola: Optional[asyncio.Queue] = None
+        self._tareas: List[asyncio.Task] = []
+
+    @property
+    def pendientes(self) -> int:
+        return self._cola.qsize() if self._cola else 0
+
+    async def iniciar(self):
+        self._cola = asyncio.Queue(maxsize=self.tamano)
+        self._tareas = [asyncio.create_task(self._trabajador()) for _ in range(self.num_trabajadores)]
+        await self.recuperar_vencidas()
+
+    async def recuperar_vencidas(self) -> int:
+        # La cola vive en memoria: si un proceso murió con trabajos sin terminar, sus
+        # facturas quedan en pendiente. Pasado FACTURAS_PENDIENTE_MINUTOS se marcan como
+        # error (se ve en las listas y la próxima vez que se adjunten se suben de nuevo)
+        async with AsyncSession(async_engine) as session:
+            vencidas = (await session.exec(pendientes_vencidas())).all()
+        for sha256 in vencidas:
+            logger.warning("Factura %s pendiente sin subir; se marca como error", sha256)
+            await self._marcar(sha256, ESTADO_ERROR)
+        return len(vencidas)
+
+    async def detener(self, timeout: float = 10.0):
+        # Intentar vaciar la cola antes de apagar; lo que quede se marca como error
+        if self._cola is None:
+            return
+        try:
+            await asyncio.wait_for(self._cola.join(), timeout)
+        except asyncio.TimeoutError:
+            logger.warning("Apagando con %d facturas sin subir", self._cola.qsize())
+        for tarea in self._tareas:
+            tarea.cancel()
+        await asyncio.gather(*self._tareas, return_exceptions=True)
+        while not self._cola.empty():
+            trabajo = self._cola.get_nowait()
+            descartar(trabajo.archivo)
+            await self._marcar(trabajo.sha256, ESTADO_ERROR)
+        self._tareas = []
+
+    async def encolar(self, trabajo: TrabajoFactura):
+        # Si la cola está llena la petición espera (backpressure) en vez de acumular memoria
+        await self._cola.put(trabajo)
+
+    async def _trabajador(self):
+        while True:
+            trabajo = await self._cola.get()
+            try:
+                await self._procesar(trabajo)
+            except Exception:
+                logger.exception("Error procesando la factura %s", trabajo.ruta)
+            finally:
+                descartar(trabajo.archivo)
+                self._cola.task_done()
+
+    async def _procesar(self, trabajo: TrabajoFactura):
+        try:
+            url = await subir_con_reintentos(self.almacenamiento, trabajo.ruta, trabajo.archivo, trabajo.content_type)
+        except Exception:
+            logger.exception("No se pudo subir la factura %s", trabajo.ruta)
+            await self._marcar(trabajo.sha256, ESTADO_ERROR)
+            return
+        url_miniatura = await self._miniatura(trabajo)
+        # Si las transacciones se eliminaron mientras subía, la factura ya quedó
+        # huérfana y la borra el gc; aquí no hace falta nada más
+        await self._marcar(trabajo.sha256, ESTADO_SUBIDA, url, url_miniatura)
+
+    async def _miniatura(self, trabajo: TrabajoFactura) -> Optional[str]:
+        # Derivado para las listas; si falla la factura sigue siendo válida sin miniatura
+        try:
+            datos = await run_in_threadpool(generar_miniatura, trabajo.archivo, trabajo.content_type)
+            if datos is None:
+                return None
+            return await subir_con_reintentos(self.almacenamiento, ruta_miniatura(trabajo.ruta), datos, "image/jpeg")
+        except Exception:
+            logger.exception("No se pudo generar la miniatura de %s", trabajo.ruta)
+            return None
+
+    async def _marcar(self, sha256: str, estado: str, url: Optional[str] = None, url_miniatura: Optional[str] = None):
+        async with AsyncSession(async_engine) as session:
+            await session.execute(
+                update(Factura)
+                .where(Factura.sha256 == sha256)
+                .values(estado=estado, url=url, miniatura_url=url_miniatura)
+            )
+            await session.execute(
+                update(Transaccion)
+                .where(Transaccion.factura_hash == sha256)
+                .values(factura_estado=estado, factura_url=url, factura_miniatura_url=url_miniatura)
+            )
+            # Las páginas de esos usuarios muestran el estado de la factura, y los
+            # clientes sincronizados tienen que recibir la URL nueva
+            afectadas = (await session.exec(
+                select(Transaccion.usuario_id, Transaccion.id).where(Transaccion.factura_hash == sha256)
+            )).all()
+            if afectadas:
+                await session.run_sync(cambios.registrar, "transaccion", "update", afectadas)
+                await session.run_sync(cambios.marcar, *{u for u, _ in afectadas})
+            await session.commit()
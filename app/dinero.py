@@ -0,0 +1,49 @@
+import os
+from decimal import ROUND_HALF_UP, Decimal
+from sqlalchemy.types import BigInteger, TypeDecorator
+
+# Montos exactos. En la base cada monto es un entero en centavos (unidad menor) y en
+# Python un Decimal con dos decimales, así las sumas se hacen en SQL sobre enteros
+# (SUM exacto, sin cargar objetos) y nunca pasan por float. La moneda va en su propia
+# columna; por ahora todo es COP y los agregados (saldos, resumen) suman sin separar
+# por moneda.
+MONEDA_DEFECTO = os.getenv("MONEDA", "COP")
+CENTAVOS = 100  # unidades menores por unidad (ISO 4217: COP tiene 2 decimales)
+CERO = Decimal("0.00")
+# Tope de cualquier monto que entra (formularios, API, importación, filtros): muy por
+# debajo del máximo de BIGINT en centavos (~9,2e16 unidades), que de otro modo da 500
+MONTO_MAXIMO = Decimal("999999999999.99")
+_UN_CENTAVO = Decimal("0.01")
+
+
+def a_decimal(valor) -> Decimal:
+    # float pasa por str para tomar el valor que se escribió (0.1 → 0.1, no 0.1000000000000000055...)
+    if not isinstance(valor, Decimal):
+        valor = Decimal(str(valor)) if isinstance(valor, float) else Decimal(valor)
+    return valor.quantize(_UN_CENTAVO, rounding=ROUND_HALF_UP)
+
+def a_centavos(valor) -> int:
+    return int(a_decimal(valor) * CENTAVOS)
+
+def de_centavos(centavos) -> Decimal:
+    # SQLite devuelve int (o float en columnas viejas); PostgreSQL, Decimal para SUM(bigint)
+    if isinstance(centavos, float):
+        centavos = round(centavos)
+    return Decimal(int(centavos)).scaleb(-2)
+
+
+class Dinero(TypeDecorator):
+    # Columna BIGINT en centavos que se lee y escribe como Decimal. También aplica a
+    # los valores comparados o sumados contra la columna (Transaccion.monto >= 1000,
+    # saldo + delta): el literal se convierte a centavos al enviarlo
+    impl = BigInteger
+    cache_ok = True
+
+    def process_bind_param(self, valor, dialect):
+        return None if valor is None else a_centavos(valor)
+
+    def process_result_value(self, valor, dialect):
+        return None if valor is None else de_centavos(valor)
+
+    def coerce_compared_value(self, op, valor):
+        return self
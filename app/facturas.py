@@ -0,0 +1,254 @@
+import hashlib
+import io
+import os
+import tempfile
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Optional
+from fastapi import UploadFile
+from sqlalchemy import case, delete, func, update
+from sqlmodel import Session, select
+from .models import Factura, Transaccion
+
+# Lectura de facturas subidas por trozos: nunca se carga el archivo entero en memoria.
+# Cada trozo se hashea y se escribe a un temporal en disco; si se pasa del tamaño
+# máximo se corta ahí. El tipo se decide por los primeros bytes, no por lo que diga el navegador.
+FACTURAS_MAX_BYTES = int(os.getenv("FACTURAS_MAX_BYTES", str(10 * 1024 * 1024)))  # 10 MB
+FACTURAS_TMP_DIR = os.getenv("FACTURAS_TMP_DIR") or None  # None = directorio temporal del sistema
+TAMANO_TROZO = 64 * 1024
+
+# Miniaturas para las listas
+MINIATURA_LADO = int(os.getenv("FACTURAS_MINIATURA_LADO", "320"))
+MINIATURA_CALIDAD = 70
+
+FIRMAS = [
+    (b"\x89PNG\r\n\x1a\n", "image/png"),
+    (b"\xff\xd8\xff", "image/jpeg"),
+    (b"%PDF-", "application/pdf"),
+]
+EXTENSIONES = {"image/png": "png", "image/jpeg": "jpg", "application/pdf": "pdf"}
+
+ESTADO_PENDIENTE = "pendiente"
+ESTADO_SUBIDA = "subida"
+ESTADO_ERROR = "error"
+
+# Una factura que lleva más que esto en "pendiente" se da por fallida: el proceso que
+# la subía murió (reinicio, worker reciclado) y la cola en memoria se perdió con él
+FACTURAS_PENDIENTE_VENCE = timedelta(minutes=int(os.getenv("FACTURAS_PENDIENTE_MINUTOS", "15")))
+
+# Tiempo que una factura sin referencias espera antes de que el gc la borre
+FACTURAS_GRACIA_GC = timedelta(hours=int(os.getenv("FACTURAS_GRACIA_GC_HORAS", "24")))
+
+
+class FacturaInvalida(ValueError):
+    pass
+
+class FacturaDemasiadoGrande(FacturaInvalida):
+    pass
+
+
+@dataclass
+class FacturaLeida:
+    archivo: str        # ruta del temporal en disco; quien la recibe la borra
+    content_type: str
+    sha256: str
+    tamano: int
+
+    @property
+    def extension(self) -> str:
+        return EXTENSIONES[self.content_type]
+
+    @property
+    def ruta(self) -> str:
+        # Ruta en el almacenamiento derivada del contenido: mismos bytes, mismo objeto
+        return f"{self.sha256[:2]}/{self.sha256}.{self.extension}"
+
+
+def detectar_tipo(cabecera: bytes) -> Optional[str]:
+    for firma, tipo in FIRMAS:
+        if cabecera.startswith(firma):
+            return tipo
+    return None
+
+async def leer_factura(upload: UploadFile, max_bytes: int = FACTURAS_MAX_BYTES) -> FacturaLeida:
+    hasher = hashlib.sha256()
+    tamano = 0
+    content_type = None
+    fd, ruta = tempfile.mkstemp(prefix="factura-", dir=FACTURAS_TMP_DIR)
+    try:
+        with os.fdopen(fd, "wb") as destino:
+            while True:
+                trozo = await upload.read(TAMANO_TROZO)
+                if not trozo:
+                    break
+                if content_type is None:
+                    content_type = detectar_tipo(trozo)
+                    if content_type is None:
+                        raise FacturaInvalida("Formato no permitido. Solo JPG, PNG y PDF.")
+                tamano += len(trozo)
+                if tamano > max_bytes:
+                    raise FacturaDemasiadoGrande(f"La factura supera el máximo de {max_bytes / (1024 * 1024):g} MB")
+                hasher.update(trozo)
+                destino.write(trozo)
+        if content_type is None:
+            raise FacturaInvalida("El archivo está vacío")
+    except BaseException:
+        descartar(ruta)
+        raise
+    return FacturaLeida(archivo=ruta, content_type=content_type, sha256=hasher.hexdigest(), tamano=tamano)
+
+def descartar(ruta: Optional[str]):
+    if ruta:
+        try:
+            os.remove(ruta)
+        except FileNotFoundError:
+            pass
+
+
+# ---------- Miniaturas ----------
+def ruta_miniatura(ruta: str) -> str:
+    return f"miniaturas/{ruta.rsplit('.', 1)[0]}.jpg"
+
+def generar_miniatura(archivo: str, content_type: str) -> Optional[bytes]:
+    # JPEG pequeño para las listas. Requiere Pillow; sin Pillow (o para PDF) no hay miniatura
+    if not content_type.startswith("image/"):
+        return None
+    try:
+        from PIL import Image, ImageOps
+    except ImportError:
+        return None
+    with Image.open(archivo) as img:
+        img = ImageOps.exif_transpose(img)
+        img.thumbnail((MINIATURA_LADO, MINIATURA_LADO))
+        if img.mode not in ("RGB", "L"):
+            img = img.convert("RGB")
+        salida = io.BytesIO()
+        img.save(salida, "JPEG", quality=MINIATURA_CALIDAD, optimize=True)
+    return salida.getvalue()
+
+
+# ---------- Registro por contenido (deduplicación) ----------
+def _limite_pendiente() -> datetime:
+    return datetime.utcnow() - FACTURAS_PENDIENTE_VENCE
+
+def pendientes_vencidas():
+    # SELECT de los sha256 que quedaron en pendiente sin que nadie los esté subiendo
+    return (
+        select(Factura.sha256)
+        .where(Factura.estado == ESTADO_PENDIENTE)
+        .where(func.coalesce(Factura.pendiente_desde, Factura.creada) <= _limite_pendiente())
+    )
+
+def adjuntar(session: Session, tx: Transaccion, leida: FacturaLeida) -> bool:
+    # Enlaza la transacción con la factura de ese contenido y suma una referencia.
+    # Devuelve True si hay que subir el archivo (contenido nuevo, subida anterior fallida
+    # o pendiente vencida)
+    result = session.execute(
+        update(Factura)
+        .where(Factura.sha256 == leida.sha256)
+        .values(referencias=Factura.referencias + 1, huerfana_desde=None)
+    )
+    if result.rowcount == 0:
+        factura = Factura(
+            sha256=leida.sha256, ruta=leida.ruta, content_type=leida.content_type,
+            tamano=leida.tamano, estado=ESTADO_PENDIENTE, referencias=1,
+            pendiente_desde=datetime.utcnow(),
+        )
+        session.add(factura)
+        subir = True
+    else:
+        factura = session.get(Factura, leida.sha256, populate_existing=True)
+        vencida = (
+            factura.estado == ESTADO_PENDIENTE
+            and (factura.pendiente_desde or factura.creada) <= _limite_pendiente()
+        )
+        subir = factura.estado == ESTADO_ERROR or vencida
+        if subir:
+            factura.estado = ESTADO_PENDIENTE
+            factura.pendiente_desde = datetime.utcnow()
+            session.add(factura)
+    tx.factura_hash = factura.sha256
+    tx.factura_estado = factura.estado
+    tx.factura_url = factura.url
+    tx.factura_miniatura_url = factura.miniatura_url
+    return subir
+
+def registrar_subida(session: Session, leida: FacturaLeida, url: str):
+    # Para /uploads/upload-factura: la URL se entrega al cliente y no hay transacción
+    # que la libere, así que cuenta como una referencia permanente
+    result = session.execute(
+        update(Factura)
+        .where(Factura.sha256 == leida.sha256)
+        .values(referencias=Factura.referencias + 1, huerfana_desde=None, estado=ESTADO_SUBIDA, url=url)
+    )
+    if result.rowcount == 0:
+        session.add(Factura(
+            sha256=leida.sha256, ruta=leida.ruta, content_type=leida.content_type,
+            tamano=leida.tamano, estado=ESTADO_SUBIDA, url=url, referencias=1,
+        ))
+
+def liberar(session: Session, tx: Transaccion):
+    # Resta la referencia de la transacción; la factura queda marcada como huérfana al llegar a 0
+    if not tx.factura_hash:
+        return
+    session.execute(
+        update(Factura)
+        .where(Factura.sha256 == tx.factura_hash)
+        .values(
+            referencias=Factura.referencias - 1,
+            huerfana_desde=case((Factura.referencias <= 1, datetime.utcnow()), else_=Factura.huerfana_desde),
+        )
+    )
+
+def liberar_filtro(session: Session, condicion):
+    # Como liberar() para todas las transacciones de `condicion` (borrado masivo): una
+    # sentencia que resta a cada factura cuántas de esas filas la usaban
+    usadas = (
+        select(func.count())
+        .select_from(Transaccion)
+        .where(condicion)
+        .where(Transaccion.factura_hash == Factura.sha256)
+        .scalar_subquery()
+    )
+    session.execute(
+        update(Factura)
+        .where(Factura.sha256.in_(select(Transaccion.factura_hash).where(condicion)))
+        .values(
+            referencias=Factura.referencias - usadas,
+            huerfana_desde=case((Factura.referencias <= usadas, datetime.utcnow()), else_=Factura.huerfana_desde),
+        )
+        .execution_options(synchronize_session=False)
+    )
+
+def recolectar_huerfanas(session: Session, almacenamiento, gracia: timedelta = FACTURAS_GRACIA_GC, lote: int = 100) -> int:
+    # Borra del almacenamiento y de la tabla las facturas sin referencias, un lote por vez
+    limite = datetime.utcnow() - gracia
+    total = 0
+    while True:
+        huerfanas = session.exec(
+            select(Factura)
+            .where(Factura.referencias <= 0)
+            .where(Factura.huerfana_desde <= limite)
+            .limit(lote)
+        ).all()
+        if not huerfanas:
+            break
+        hashes = [f.sha256 for f in huerfanas]
+        # Primero las filas (solo si siguen sin referencias), después los objetos, y recién
+        # entonces el commit: si el almacenamiento falla, las filas vuelven con el rollback
+        session.execute(delete(Factura).where(Factura.sha256.in_(hashes)).where(Factura.referencias <= 0))
+        siguen = set(session.exec(select(Factura.sha256).where(Factura.sha256.in_(hashes))).all())
+        borradas = [f for f in huerfanas if f.sha256 not in siguen]
+        try:
+            almacenamiento.borrar(
+                [f.ruta for f in borradas] + [ruta_miniatura(f.ruta) for f in borradas if f.miniatura_url]
+            )
+        except Exception:
+            session.rollback()
+            raise
+        session.commit()
+        session.expunge_all()
+        total += len(borradas)
+        if len(huerfanas) < lote:
+            break
+    return total
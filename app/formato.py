@@ -0,0 +1,26 @@
+from datetime import datetime
+from decimal import InvalidOperation
+from .dinero import CENTAVOS, a_centavos
+
+# Helpers de fechas y montos compartidos por las rutas, los templates (filtro cop),
+# las exportaciones y la importación.
+
+
+def month_for_date(dt: datetime) -> str:
+    return dt.strftime("%Y-%m")
+
+def current_month_str() -> str:
+    return datetime.utcnow().strftime("%Y-%m")
+
+def cop(value):
+    # Formato colombiano fijo, sin locale: $1.234.567 y los centavos solo si hay ($1.234,50).
+    # Trabaja sobre el entero en centavos, sin pasar por float
+    if value is None:
+        return ""
+    try:
+        centavos = a_centavos(value)
+    except (InvalidOperation, TypeError, ValueError):
+        return value
+    pesos, resto = divmod(abs(centavos), CENTAVOS)
+    texto = f"{'-' if centavos < 0 else ''}${pesos:,}".replace(",", ".")
+    return f"{texto},{resto:02d}" if resto else texto
@@ -0,0 +1,266 @@
+import csv
+import hashlib
+import io
+import os
+import re
+import unicodedata
+from dataclasses import dataclass, field
+from datetime import datetime
+from decimal import Decimal, InvalidOperation
+from typing import Callable, Dict, Iterable, Iterator, List, Optional
+from sqlmodel import Session
+from .dinero import CERO, MONTO_MAXIMO, a_decimal
+from .formato import month_for_date
+from .models import Cuenta
+from . import agregados
+
+# Importación de extractos bancarios (CSV u OFX). Cada fila se convierte en una
+# Transaccion con una huella (sha256 de cuenta, fecha, monto, descripción y número de
+# aparición en el archivo, o del FITID en OFX); el índice único (usuario_id, huella)
+# hace que reimportar el mismo extracto no duplique nada. Las filas entran por lotes
+# con executemany y todo el archivo va en una sola transacción.
+LOTE_IMPORTACION = int(os.getenv("LOTE_IMPORTACION", "1000"))
+
+# Nombres de columna reconocidos en el CSV (sin tildes ni mayúsculas)
+COLUMNAS_CSV = {
+    "fecha": ["fecha", "date", "fecha transaccion", "fecha operacion", "fecha movimiento"],
+    "monto": ["monto", "valor", "importe", "amount"],
+    "debito": ["debito", "cargo", "retiro", "debit"],
+    "credito": ["credito", "abono", "deposito", "credit"],
+    "descripcion": ["descripcion", "concepto", "detalle", "referencia", "memo", "description"],
+    "tipo": ["tipo"],
+    "categoria": ["categoria"],
+    "subcategoria": ["subcategoria"],
+}
+FORMATOS_FECHA = ["%Y-%m-%d", "%d/%m/%Y", "%Y/%m/%d", "%d-%m-%Y", "%m/%d/%Y"]
+TIPOS = ("ingreso", "gasto", "deuda")
+CATEGORIAS = ("fijo", "variable")
+
+_OFX_MOVIMIENTO = re.compile(r"<STMTTRN>(.*?)(?:</STMTTRN>|(?=<STMTTRN>)|(?=</BANKTRANLIST>))", re.S | re.I)
+_OFX_CAMPO = re.compile(r"<(\w+)>([^<\r\n]*)")
+
+
+class ImportacionInvalida(ValueError):
+    pass
+
+
+@dataclass
+class FilaExtracto:
+    fecha: datetime
+    monto: Decimal  # con signo: positivo entra, negativo sale
+    descripcion: str = ""
+    tipo: Optional[str] = None
+    categoria: Optional[str] = None
+    subcategoria: Optional[str] = None
+    fitid: Optional[str] = None  # id del banco (OFX)
+
+
+@dataclass
+class ResultadoImportacion:
+    leidas: int = 0
+    insertadas: int = 0
+    duplicadas: int = 0
+    lotes: List[Dict[str, int]] = field(default_factory=list)
+
+
+# ---------- Lectura ----------
+def _normalizar(nombre: str) -> str:
+    sin_tildes = unicodedata.normalize("NFKD", nombre).encode("ascii", "ignore").decode()
+    return " ".join(sin_tildes.lower().replace("_", " ").split())
+
+def parsear_fecha(valor: str) -> datetime:
+    valor = valor.strip()
+    for formato in FORMATOS_FECHA:
+        try:
+            return datetime.strptime(valor[:10], formato)
+        except ValueError:
+            continue
+    raise ImportacionInvalida(f"Fecha no reconocida: {valor!r}")
+
+def _a_monto(texto: str, original: str) -> Decimal:
+    # Decimal exacto (nunca float) con dos decimales y dentro del rango de la columna
+    try:
+        monto = Decimal(texto)
+    except InvalidOperation:
+        raise ImportacionInvalida(f"Monto no reconocido: {original!r}")
+    if not monto.is_finite() or abs(monto) > MONTO_MAXIMO:
+        raise ImportacionInvalida(f"Monto fuera de rango: {original!r}")
+    return a_decimal(monto)
+
+def parsear_monto(valor: str) -> Optional[Decimal]:
+    # Acepta 1234.56, 1.234,56, 1,234.56, 150.000 (miles), $ y negativos entre paréntesis
+    s = (valor or "").strip().replace("$", "").replace(" ", "").replace("\xa0", "")
+    if not s:
+        return None
+    negativo = s.startswith("(") and s.endswith(")")
+    s = s.strip("()")
+    if "," in s and "." in s:
+        if s.rfind(",") > s.rfind("."):
+            s = s.replace(".", "").replace(",", ".")
+        else:
+            s = s.replace(",", "")
+    elif "," in s or "." in s:
+        sep = "," if "," in s else "."
+        partes = s.split(sep)
+        if len(partes) > 2 or len(partes[-1]) == 3:
+            s = s.replace(sep, "")  # solo separador de miles
+        else:
+            s = s.replace(",", ".")
+    monto = _a_monto(s, valor)
+    return -monto if negativo else monto
+
+def leer_csv(lineas: Iterable[str], mapeo: Optional[Dict[str, str]] = None) -> Iterator[FilaExtracto]:
+    # mapeo: campo → nombre de columna del archivo, para bancos con encabezados propios
+    lineas = iter(lineas)
+    primera = next(lineas, "")
+    try:
+        dialecto = csv.Sniffer().sniff(primera, delimiters=",;\t|")
+    except csv.Error:
+        dialecto = csv.excel
+    lector = csv.reader(_encadenar(primera, lineas), dialecto)
+    encabezado = [_normalizar(c) for c in next(lector, [])]
+    columnas = {}
+    for campo, nombres in COLUMNAS_CSV.items():
+        if mapeo and campo in mapeo:
+            nombres = [_normalizar(mapeo[campo])]
+        for nombre in nombres:
+            if nombre in encabezado:
+                columnas[campo] = encabezado.index(nombre)
+                break
+    if "fecha" not in columnas or not ({"monto", "debito", "credito"} & set(columnas)):
+        raise ImportacionInvalida("El CSV necesita columnas de fecha y de monto (o débito/crédito)")
+
+    def valor(fila, campo):
+        i = columnas.get(campo)
+        return fila[i].strip() if i is not None and i < len(fila) else ""
+
+    for fila in lector:
+        if not any(c.strip() for c in fila):
+            continue
+        if "monto" in columnas:
+            monto = parsear_monto(valor(fila, "monto"))
+        else:
+            credito, debito = parsear_monto(valor(fila, "credito")), parsear_monto(valor(fila, "debito"))
+            monto = None if credito is None and debito is None else (credito or CERO) - abs(debito or CERO)
+        if monto is None:
+            continue  # sin monto (saldos, subtotales): no es un movimiento
+        yield FilaExtracto(
+            fecha=parsear_fecha(valor(fila, "fecha")),
+            monto=monto,
+            descripcion=valor(fila, "descripcion"),
+            tipo=valor(fila, "tipo").lower() or None,
+            categoria=valor(fila, "categoria").lower() or None,
+            subcategoria=valor(fila, "subcategoria") or None,
+        )
+
+def _encadenar(primera: str, resto: Iterator[str]) -> Iterator[str]:
+    yield primera
+    yield from resto
+
+def leer_ofx(texto: str) -> Iterator[FilaExtracto]:
+    # OFX 1.x (SGML, sin cierres) y 2.x (XML): solo hacen falta los <STMTTRN>
+    for bloque in _OFX_MOVIMIENTO.findall(texto):
+        campos = {k.upper(): v.strip() for k, v in _OFX_CAMPO.findall(bloque)}
+        if "DTPOSTED" not in campos or "TRNAMT" not in campos:
+            continue
+        try:
+            fecha = datetime.strptime(campos["DTPOSTED"][:8], "%Y%m%d")
+        except ValueError:
+            raise ImportacionInvalida(f"Fecha no reconocida: {campos['DTPOSTED']!r}")
+        monto = _a_monto(campos["TRNAMT"].replace(",", "."), campos["TRNAMT"])
+        yield FilaExtracto(
+            fecha=fecha,
+            monto=monto,
+            descripcion=campos.get("NAME") or campos.get("MEMO") or "",
+            fitid=campos.get("FITID"),
+        )
+
+def leer_extracto(archivo, nombre: str = "", mapeo: Optional[Dict[str, str]] = None) -> Iterator[FilaExtracto]:
+    # archivo: binario abierto. UTF-8 si decodifica, si no Latin-1 (habitual en bancos)
+    cabecera = archivo.read(64 * 1024)
+    try:
+        cabecera.decode("utf-8")
+        codificacion = "utf-8-sig"
+    except UnicodeDecodeError as e:
+        # Un carácter multibyte cortado al final de la cabecera no cuenta
+        codificacion = "utf-8-sig" if e.start >= len(cabecera) - 3 else "latin-1"
+    archivo.seek(0)
+    texto = io.TextIOWrapper(archivo, encoding=codificacion, newline="")
+    if nombre.lower().endswith((".ofx", ".qfx")) or b"<OFX>" in cabecera.upper():
+        return leer_ofx(texto.read())
+    return leer_csv(texto, mapeo)
+
+
+# ---------- Inserción ----------
+def huella(cuenta_id: int, fila: FilaExtracto, aparicion: int) -> str:
+    if fila.fitid:
+        base = f"{cuenta_id}|ofx|{fila.fitid}"
+    else:
+        base = f"{cuenta_id}|{fila.fecha.isoformat()}|{fila.monto:.2f}|{_normalizar(fila.descripcion)}|{aparicion}"
+    return hashlib.sha256(base.encode()).hexdigest()
+
+def _a_transaccion(fila: FilaExtracto, usuario_id: int, cuenta_id: int, huella_fila: str) -> dict:
+    tipo = fila.tipo if fila.tipo in TIPOS else ("ingreso" if fila.monto >= 0 else "gasto")
+    return {
+        "monto": abs(fila.monto),
+        "tipo": tipo,
+        "categoria": fila.categoria if fila.categoria in CATEGORIAS else "variable",
+        "subcategoria": fila.subcategoria,
+        "fecha": fila.fecha,
+        "mes": month_for_date(fila.fecha),
+        "usuario_id": usuario_id,
+        "cuenta_id": cuenta_id,
+        "huella": huella_fila,
+    }
+
+def importar(
+    session: Session,
+    usuario_id: int,
+    cuenta_id: int,
+    filas: Iterable[FilaExtracto],
+    lote: int = LOTE_IMPORTACION,
+    progreso: Optional[Callable[[Dict[str, int]], None]] = None,
+) -> ResultadoImportacion:
+    # Un solo commit al final: si algo falla no queda el extracto a medias
+    cuenta = session.get(Cuenta, cuenta_id)
+    if not cuenta or cuenta.usuario_id != usuario_id:
+        raise ImportacionInvalida("Cuenta inválida")
+    resultado = ResultadoImportacion()
+    apariciones: Dict[tuple, int] = {}
+    pendientes: Dict[str, dict] = {}
+
+    def vaciar():
+        insertadas = len(agregados.insertar_lote(session, usuario_id, pendientes))
+        avance = {
+            "lote": len(resultado.lotes) + 1,
+            "filas": len(pendientes),
+            "insertadas": insertadas,
+            "duplicadas": len(pendientes) - insertadas,
+        }
+        resultado.insertadas += insertadas
+        resultado.duplicadas += avance["duplicadas"]
+        resultado.lotes.append(avance)
+        pendientes.clear()
+        if progreso:
+            progreso(avance)
+
+    try:
+        for fila in filas:
+            resultado.leidas += 1
+            # Dos movimientos iguales el mismo día son distintos: se numeran por aparición
+            clave = (fila.fecha, fila.monto, _normalizar(fila.descripcion))
+            apariciones[clave] = apariciones.get(clave, 0) + 1
+            h = huella(cuenta_id, fila, apariciones[clave])
+            if h in pendientes:
+                resultado.duplicadas += 1  # FITID repetido dentro del mismo archivo
+                continue
+            pendientes[h] = _a_transaccion(fila, usuario_id, cuenta_id, h)
+            if len(pendientes) >= lote:
+                vaciar()
+        if pendientes:
+            vaciar()
+        session.commit()
+    except BaseException:
+        session.rollback()
+        raise
+    return resultado
@@ -1,71 +1,99 @@
-from http.client import HTTPException
-from fastapi import FastAPI, Request, UploadFile, File, Form, Depends
-from fastapi.responses import RedirectResponse
+from fastapi import FastAPI, Request, UploadFile, File, Form, Depends, HTTPException
+from fastapi.responses import RedirectResponse, PlainTextResponse
 from fastapi.templating import Jinja2Templates
 from fastapi.staticfiles import StaticFiles
-from sqlmodel import select, Session
+from fastapi.concurrency import run_in_threadpool
+from sqlmodel import select
+from sqlmodel.ext.asyncio.session import AsyncSession
+from sqlalchemy import exists, func
+from sqlalchemy.exc import IntegrityError
 from datetime import datetime
+from decimal import Decimal
 from typing import Optional
 import math
-import locale
-import uuid
-from supabase import create_client, Client
 import os
-from .database import crear_db, get_session
-from .models import Usuario, Cuenta, Transaccion, LimiteMensual
-from .routers import uploads
-from .security import get_password_hash, verify_password, crear_token, get_user_from_request
-
-# Prints útiles para debug en logs (puedes borrarlos después)
-print("SUPABASE_URL:", os.getenv("SUPABASE_URL"))
-print("SUPABASE_KEY length:", len(os.getenv("SUPABASE_KEY") or "NONE"))
+from .database import crear_db, get_async_session, get_async_read_session
+from .dinero import MONTO_MAXIMO
+from .models import Usuario, Cuenta, Transaccion, LimiteMensual, SaldoCuenta
+from . import agregados, busqueda, cambios, paginacion, facturas, metricas
+from .routers import uploads, api, exportar
+from .formato import cop, current_month_str
+from .paginas import condicional, cache_paginas
+from .series import cache_series
+from .almacenamiento import crear_almacenamiento, FACTURAS_BACKEND, FACTURAS_DIR, FACTURAS_URL_LOCAL
+from .cola_facturas import ColaFacturas, TrabajoFactura
+from .facturas import leer_factura, descartar, FacturaDemasiadoGrande, FacturaInvalida
+from .security import hashear_password, verificar_password, HashSaturado, crear_token, get_current_user, cache_usuarios, UsuarioSesion, _get_token_from_request, ejecutor_hash
 
 app = FastAPI(title="Finanzas personales - Simplificado")
 app.include_router(uploads.router)
+app.include_router(api.router)
+app.include_router(exportar.router)
+app.add_middleware(metricas.MiddlewareMetricas)
 
-# Crear DB al inicio
-crear_db()
-
-# Templates, static y locale
+# Templates y static
 templates = Jinja2Templates(directory="templates")
+metricas.instrumentar_templates(templates.env)
 app.mount("/static", StaticFiles(directory="static"), name="static")
-
-try:
-    locale.setlocale(locale.LC_ALL, "es_CO.UTF-8")  # Ideal para Colombia
-except locale.Error:
-    try:
-        locale.setlocale(locale.LC_ALL, "es_ES.UTF-8")  # Alternativa común
-    except locale.Error:
-        locale.setlocale(locale.LC_ALL, "")  # Usa el locale por defecto del sistema
+if FACTURAS_BACKEND == "local":
+    os.makedirs(FACTURAS_DIR, exist_ok=True)
+    app.mount(FACTURAS_URL_LOCAL, StaticFiles(directory=FACTURAS_DIR), name="facturas")
 
 
 # ---------- Helpers ----------
-def month_for_date(dt: datetime) -> str:
-    return dt.strftime("%Y-%m")
-
-def current_month_str() -> str:
-    return datetime.utcnow().strftime("%Y-%m")
-
-def cop(value):
-    try:
-        return locale.currency(value, grouping=True)
-    except:
-        return value
-
 templates.env.filters["cop"] = cop
 
 
-# ---------- Inicialización de Supabase ----------
+# ---------- Esquema, almacenamiento y cola de facturas ----------
 @app.on_event("startup")
 async def startup_event():
-    url: str = os.getenv("SUPABASE_URL")
-    key: str = os.getenv("SUPABASE_KEY")
-
-    if not url or not key:
-        raise ValueError("Faltan variables de entorno SUPABASE_URL o SUPABASE_KEY")
-
-    app.state.supabase: Client = create_client(url, key)
-    print("Cliente de Supabase inicializado correctamente")
+    # Al arrancar y no al importar: importar app.main no toca la base
+    await run_in_threadpool(crear_db)
+    app.state.almacenamiento = crear_almacenamiento()
+    app.state.cola_facturas = ColaFacturas(app.state.almacenamiento)
+    await app.state.cola_facturas.iniciar()
+    print(f"Almacenamiento de facturas inicializado ({FACTURAS_BACKEND})")
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    await app.state.cola_facturas.detener()
+
+
+# ---------- Métricas ----------
+_CACHES = {"usuarios": cache_usuarios, "series": cache_series, "paginas": cache_paginas}
+
+metricas.Medidor(
+    "cache_requests_total", "Consultas a las cachés en memoria", ("cache", "resultado"),
+    lambda: {
+        clave: valor
+        for nombre, cache in _CACHES.items()
+        for clave, valor in (((nombre, "acierto"), cache.aciertos), ((nombre, "fallo"), cache.fallos))
+    },
+    tipo="counter",
+)
+metricas.Medidor(
+    "cache_entries", "Entradas en las cachés en memoria", ("cache",),
+    lambda: {(nombre,): len(cache) for nombre, cache in _CACHES.items()},
+)
+metricas.Medidor(
+    "password_hash_jobs", "Trabajos del ejecutor de hashing en este momento", ("estado",),
+    lambda: {(k,): v for k, v in ejecutor_hash.metricas().items() if k in ("en_cola", "en_curso")},
+)
+metricas.Medidor(
+    "password_hash_total", "Trabajos de hashing terminados o rechazados por saturación", ("resultado",),
+    lambda: {(k,): v for k, v in ejecutor_hash.metricas().items() if k in ("completados", "rechazados")},
+    tipo="counter",
+)
+metricas.Medidor(
+    "facturas_cola_pendientes", "Facturas esperando subida al almacenamiento", (),
+    lambda: {(): app.state.cola_facturas.pendientes} if hasattr(app.state, "cola_facturas") else {},
+)
+
+@app.get("/metrics")
+async def metrics(request: Request):
+    if metricas.METRICAS_TOKEN and request.headers.get("authorization") != f"Bearer {metricas.METRICAS_TOKEN}":
+        raise HTTPException(status_code=401, detail="No autorizado")
+    return PlainTextResponse(metricas.exponer(), media_type="text/plain; version=0.0.4")
 
 
 # ---------- Rutas básicas ----------
@@ -78,20 +106,30 @@ def register_get(request: Request):
     return templates.TemplateResponse("register.html", {"request": request, "title": "Crear cuenta", "error": None})
 
 @app.post("/register")
-def register_post(request: Request, email: str = Form(...), password: str = Form(...), session = Depends(get_session)):
+async def register_post(request: Request, email: str = Form(...), password: str = Form(...), session: AsyncSession = Depends(get_async_session)):
     statement = select(Usuario).where(Usuario.email == email)
-    existing = session.exec(statement).first()
+    existing = (await session.exec(statement)).first()
     if existing:
         return templates.TemplateResponse("register.html", {"request": request, "title": "Crear cuenta", "error": "El email ya está registrado"})
-    hashed = get_password_hash(password)
+    # Cerrar la transacción antes del hash: en SQLite (BEGIN IMMEDIATE) tendría tomado
+    # el lock de escritura durante todo el cálculo y frenaría al resto de escrituras
+    await session.commit()
+    try:
+        hashed = await hashear_password(password)
+    except HashSaturado:
+        return templates.TemplateResponse("register.html", {"request": request, "title": "Crear cuenta", "error": "Demasiadas solicitudes, intenta de nuevo en unos segundos"}, status_code=503)
     user = Usuario(email=email, hashed_password=hashed)
     session.add(user)
-    session.commit()
-    session.refresh(user)
+    await session.flush()
     # create a default main account
     main_acc = Cuenta(nombre="Cuenta principal", usuario_id=user.id)
     session.add(main_acc)
-    session.commit()
+    try:
+        await session.commit()
+    except IntegrityError:
+        # Otro registro con el mismo email entró mientras se calculaba el hash
+        await session.rollback()
+        return templates.TemplateResponse("register.html", {"request": request, "title": "Crear cuenta", "error": "El email ya está registrado"})
     return RedirectResponse(url="/login", status_code=302)
 
 @app.get("/login")
@@ -99,18 +137,32 @@ def login_get(request: Request):
     return templates.TemplateResponse("login.html", {"request": request, "title": "Iniciar sesión", "error": None})
 
 @app.post("/login")
-def login_post(request: Request, email: str = Form(...), password: str = Form(...), session=Depends(get_session)):
+async def login_post(request: Request, email: str = Form(...), password: str = Form(...), session: AsyncSession = Depends(get_async_session)):
     statement = select(Usuario).where(Usuario.email == email)
-    user = session.exec(statement).first()
-    if not user or not verify_password(password, user.hashed_password):
+    user = (await session.exec(statement)).first()
+    await session.commit()  # sin transacción abierta durante el hash (ver register_post)
+    try:
+        valida, nuevo_hash = await verificar_password(password, user.hashed_password) if user else (False, None)
+    except HashSaturado:
+        return templates.TemplateResponse("login.html", {"request": request, "title": "Iniciar sesión", "error": "Demasiados intentos, intenta de nuevo en unos segundos"}, status_code=503)
+    if not valida:
         return templates.TemplateResponse("login.html", {"request": request, "title": "Iniciar sesión", "error": "Credenciales inválidas"})
+    if nuevo_hash:
+        # Hash bcrypt o con parámetros viejos: se reemplaza ahora que conocemos la contraseña
+        user.hashed_password = nuevo_hash
+        session.add(user)
+        await session.commit()
     token = crear_token({"sub": str(user.id)})
+    cache_usuarios.guardar(token, user.id, UsuarioSesion(id=user.id, email=user.email))
     response = RedirectResponse(url="/dashboard", status_code=302)
     response.set_cookie("access_token", token, httponly=True, samesite="lax")
     return response
 
 @app.get("/logout")
-def logout():
+def logout(request: Request):
+    token = _get_token_from_request(request)
+    if token:
+        cache_usuarios.invalidar(token)
     response = RedirectResponse(url="/login", status_code=302)
     response.delete_cookie("access_token")
     return response
@@ -118,28 +170,25 @@ def logout():
 
 # ---------- Dashboard ----------
 @app.get("/dashboard")
-def dashboard(request: Request, session=Depends(get_session)):
-    user = get_user_from_request(request, session)
+@condicional
+async def dashboard(request: Request, session=Depends(get_async_read_session), user=Depends(get_current_user)):
     if not user:
         return RedirectResponse(url="/login")
-    # cuentas y balances
-    cuentas = session.exec(select(Cuenta).where(Cuenta.usuario_id == user.id)).all()
-    cuentas_info = []
-    total_balance = 0.0
-
-    for c in cuentas:
-        trans = session.exec(select(Transaccion).where(Transaccion.cuenta_id == c.id)).all()
-        balance = sum(t.monto if t.tipo == "ingreso" else -t.monto for t in trans)
-        cuentas_info.append({"cuenta": c, "balance": balance})
-        total_balance += balance
+    # cuentas y balances (una sola consulta sobre la tabla de saldos)
+    filas = (await session.exec(
+        select(Cuenta, func.coalesce(SaldoCuenta.saldo, 0))
+        .outerjoin(SaldoCuenta, SaldoCuenta.cuenta_id == Cuenta.id)
+        .where(Cuenta.usuario_id == user.id)
+    )).all()
+    cuentas_info = [{"cuenta": c, "balance": saldo} for c, saldo in filas]
+    total_balance = sum(item["balance"] for item in cuentas_info)
 
     # métricas del mes actual
     mes = current_month_str()
-    trans_mes = session.exec(select(Transaccion).where(Transaccion.usuario_id == user.id).where(Transaccion.mes == mes)).all()
-    total_ingresos = sum(t.monto for t in trans_mes if t.tipo == "ingreso")
-    total_gastos = sum(t.monto for t in trans_mes if t.tipo in ("gasto", "deuda"))
-    limite = session.exec(select(LimiteMensual).where(LimiteMensual.usuario_id == user.id).where(LimiteMensual.mes == mes)).first()
-    monto_limite = limite.monto_limite if limite else 0.0
+    totales = await session.run_sync(agregados.totales_mes, user.id, mes)
+    total_ingresos = totales["total_ingresos"]
+    total_gastos = totales["total_gastos"]
+    monto_limite = totales["monto_limite"]
     disponible = (monto_limite - total_gastos) if monto_limite is not None else None
 
     return templates.TemplateResponse("dashboard.html", {
@@ -158,110 +207,115 @@ def dashboard(request: Request, session=Depends(get_session)):
 
 # ---------- Cuentas ----------
 @app.get("/cuentas")
-def cuentas_list(request: Request, session=Depends(get_session)):
-    user = get_user_from_request(request, session)
+@condicional
+async def cuentas_list(request: Request, session=Depends(get_async_read_session), user=Depends(get_current_user)):
     if not user:
         return RedirectResponse(url="/login")
-    cuentas = session.exec(select(Cuenta).where(Cuenta.usuario_id == user.id)).all()
+    cuentas = (await session.exec(select(Cuenta).where(Cuenta.usuario_id == user.id))).all()
     return templates.TemplateResponse("cuentas.html", {"request": request, "cuentas": cuentas, "user": user})
 
 @app.post("/cuentas")
-def cuentas_create(request: Request, nombre: str = Form(...), session=Depends(get_session)):
-    user = get_user_from_request(request, session)
+async def cuentas_create(request: Request, nombre: str = Form(...), session=Depends(get_async_session), user=Depends(get_current_user)):
     if not user:
         return RedirectResponse(url="/login")
     nueva = Cuenta(nombre=nombre, usuario_id=user.id)
     session.add(nueva)
-    session.commit()
+    await session.run_sync(cambios.marcar, user.id)
+    await session.commit()
     return RedirectResponse(url="/cuentas", status_code=302)
 
 @app.post("/cuentas/editar/{cuenta_id}")
-def cuentas_editar(
+async def cuentas_editar(
     request: Request,
     cuenta_id: int,
     nombre: str = Form(...),
-    session=Depends(get_session)
+    session=Depends(get_async_session),
+    user=Depends(get_current_user)
 ):
-    user = get_user_from_request(request, session)
     if not user:
         return RedirectResponse(url="/login")
 
-    cuenta = session.exec(
+    cuenta = (await session.exec(
         select(Cuenta).where(Cuenta.id == cuenta_id, Cuenta.usuario_id == user.id)
-    ).first()
+    )).first()
 
     if not cuenta:
         return RedirectResponse(url="/cuentas")
 
     cuenta.nombre = nombre
     session.add(cuenta)
-    session.commit()
+    await session.run_sync(cambios.marcar, user.id)
+    await session.commit()
 
     return RedirectResponse(url="/cuentas", status_code=302)
 
 @app.post("/cuentas/eliminar/{cuenta_id}")
-def eliminar_cuenta(cuenta_id: int, request: Request, session=Depends(get_session)):
-    user = get_user_from_request(request, session)
+async def eliminar_cuenta(cuenta_id: int, request: Request, session=Depends(get_async_session), user=Depends(get_current_user)):
     if not user:
         return RedirectResponse(url="/login")
 
-    cuenta = session.exec(
+    cuenta = (await session.exec(
         select(Cuenta).where(Cuenta.id == cuenta_id, Cuenta.usuario_id == user.id)
-    ).first()
+    )).first()
 
     if not cuenta:
         raise HTTPException(status_code=404, detail="Cuenta no encontrada")
 
-    # Bloqueo: no permitir eliminar si tiene transacciones
-    trans = session.exec(
-        select(Transaccion).where(Transaccion.cuenta_id == cuenta.id)
-    ).all()
+    # Bloqueo: no permitir eliminar si tiene transacciones (EXISTS, sin traer filas)
+    tiene_transacciones = (await session.exec(
+        select(exists().where(Transaccion.cuenta_id == cuenta.id))
+    )).one()
 
-    if trans:
+    if tiene_transacciones:
         raise HTTPException(status_code=400, detail="No se puede eliminar una cuenta con transacciones")
 
-    session.delete(cuenta)
-    session.commit()
+    saldo = await session.get(SaldoCuenta, cuenta.id)
+    if saldo:
+        await session.delete(saldo)
+    await session.delete(cuenta)
+    await session.run_sync(cambios.marcar, user.id)
+    await session.commit()
 
     return RedirectResponse(url="/cuentas", status_code=302)
 
 
 # ---------- Transacciones ----------
 @app.get("/transacciones")
-def transacciones_list(
+@condicional
+async def transacciones_list(
     request: Request,
-    session=Depends(get_session),
+    session=Depends(get_async_read_session),
     mes: Optional[str] = None,
-    q: Optional[str] = None
+    q: Optional[str] = None,
+    todos: bool = False,  # buscar en todos los meses
+    desde: Optional[str] = None,
+    hasta: Optional[str] = None,
+    monto_min: Optional[str] = None,
+    monto_max: Optional[str] = None,
+    cursor: Optional[str] = None,
+    user=Depends(get_current_user)
 ):
-    user = get_user_from_request(request, session)
     if not user:
         return RedirectResponse(url="/login")
 
     mes_q = mes or current_month_str()
 
-    trans = session.exec(
-        select(Transaccion)
-        .where(Transaccion.usuario_id == user.id)
-        .where(Transaccion.mes == mes_q)
-        .order_by(Transaccion.fecha.desc())
-    ).all()
-
-    # FILTRO DEL BUSCADOR
-    if q:
-        q_lower = q.lower()
-        trans = [
-            t for t in trans
-            if q_lower in t.categoria.lower()
-            or (t.subcategoria and q_lower in t.subcategoria.lower())
-            or q_lower in t.tipo.lower()
-            or q_lower in str(t.monto)
-            or q_lower in t.fecha.strftime("%Y-%m-%d")
-        ]
+    stmt = select(Transaccion).where(Transaccion.usuario_id == user.id)
+    if not todos:
+        stmt = stmt.where(Transaccion.mes == mes_q)
+
+    # FILTRO DEL BUSCADOR (índice FTS + rangos en SQL)
+    desde, hasta = busqueda.fecha_o_none(desde), busqueda.fecha_o_none(hasta)
+    monto_min, monto_max = busqueda.numero_o_none(monto_min), busqueda.numero_o_none(monto_max)
+    stmt = busqueda.filtrar(stmt, session, q, desde, hasta, monto_min, monto_max)
+    try:
+        trans, siguiente = await session.run_sync(paginacion.paginar, stmt, cursor)
+    except ValueError:
+        trans, siguiente = await session.run_sync(paginacion.paginar, stmt)
 
     transacciones_with_factura = [t for t in trans if t.factura_url]
 
-    cuentas = session.exec(select(Cuenta).where(Cuenta.usuario_id == user.id)).all()
+    cuentas = (await session.exec(select(Cuenta).where(Cuenta.usuario_id == user.id))).all()
 
     return templates.TemplateResponse(
         "transacciones.html",
@@ -272,43 +326,42 @@ def transacciones_list(
             "user": user,
             "mes": mes_q,
             "q": q or "",
+            "todos": todos,
+            "desde": desde,
+            "hasta": hasta,
+            "monto_min": monto_min,
+            "monto_max": monto_max,
+            "siguiente_url": paginacion.url_siguiente(request, siguiente),
             "transacciones_with_factura": transacciones_with_factura,
         }
     )
 
 @app.post("/transacciones")
-def agregar_transaccion(
-    request: Request,  # Necesario para acceder a app.state.supabase
-    monto: float = Form(...),
+async def agregar_transaccion(
+    request: Request,  # Necesario para acceder a app.state.cola_facturas
+    monto: Decimal = Form(..., decimal_places=2, gt=0, le=MONTO_MAXIMO),
     tipo: str = Form(...),
     categoria: str = Form(...),
     subcategoria: str = Form(None),
     cuenta_id: int = Form(...),
     factura: UploadFile = File(None),
-    user: Usuario = Depends(get_user_from_request),
-    session: Session = Depends(get_session)
+    session: AsyncSession = Depends(get_async_session),
+    user=Depends(get_current_user)
 ):
     if user is None:
         return RedirectResponse("/login", status_code=303)
 
     mes = datetime.utcnow().strftime("%Y-%m")
-    url_imagen = None
-    supabase_client: Client = request.app.state.supabase
+    leida = None
 
     if factura and factura.filename:
-        extension = factura.filename.split(".")[-1]
-        file_name = f"{user.id}_{uuid.uuid4()}.{extension}"
-
-        # Leer el contenido del archivo
-        contents = factura.file.read()
-
-        supabase_client.storage.from_("facturas").upload(
-            file_name,
-            contents,
-            file_options={"content-type": factura.content_type}
-        )
-
-        url_imagen = supabase_client.storage.from_("facturas").get_public_url(file_name)
+        # Leer por trozos a un temporal (tamaño máximo, tipo real y sha256); la subida la hace la cola
+        try:
+            leida = await leer_factura(factura)
+        except FacturaDemasiadoGrande as e:
+            raise HTTPException(status_code=413, detail=str(e))
+        except FacturaInvalida as e:
+            raise HTTPException(status_code=400, detail=str(e))
 
     nueva = Transaccion(
         monto=monto,
@@ -317,76 +370,92 @@ def agregar_transaccion(
         subcategoria=subcategoria,
         cuenta_id=cuenta_id,
         usuario_id=user.id,
-        mes=mes,
-        factura_url=url_imagen
+        mes=mes
     )
 
     session.add(nueva)
-    session.commit()
-    session.refresh(nueva)
+    subir = False
+    try:
+        if leida:
+            # Misma factura ya guardada: solo se suma una referencia, sin volver a subirla
+            subir = await session.run_sync(facturas.adjuntar, nueva, leida)
+        await session.run_sync(agregados.registrar_transaccion, nueva)
+        await session.commit()
+    except BaseException:
+        descartar(leida.archivo if leida else None)
+        raise
+
+    if subir:
+        await request.app.state.cola_facturas.encolar(
+            TrabajoFactura(leida.sha256, leida.ruta, leida.archivo, leida.content_type)
+        )
+    elif leida:
+        descartar(leida.archivo)
 
     return RedirectResponse("/transacciones", status_code=303)
 
 
 @app.post("/transaccion/eliminar/{tx_id}")
-def eliminar_transaccion(
+async def eliminar_transaccion(
     tx_id: int,
     request: Request,
-    session = Depends(get_session)
+    session = Depends(get_async_session),
+    user=Depends(get_current_user)
 ):
-    user = get_user_from_request(request, session)
     if not user:
         return RedirectResponse(url="/login")
 
-    tx = session.exec(
+    tx = (await session.exec(
         select(Transaccion)
         .where(Transaccion.id == tx_id)
         .where(Transaccion.usuario_id == user.id)
-    ).first()
+    )).first()
 
     if not tx:
         raise HTTPException(404, "Transacción no encontrada")
 
-    session.delete(tx)
-    session.commit()
+    await session.run_sync(agregados.anular_transaccion, tx)
+    await session.delete(tx)
+    await session.commit()
 
     return RedirectResponse(url="/transacciones", status_code=302)
 
 
 # ---------- Límite mensual ----------
 @app.post("/limite")
-def set_limite(request: Request, mes: str = Form(...), monto_limite: float = Form(...), session=Depends(get_session)):
-    user = get_user_from_request(request, session)
+async def set_limite(request: Request, mes: str = Form(...), monto_limite: Decimal = Form(..., decimal_places=2, ge=0, le=MONTO_MAXIMO), session=Depends(get_async_session), user=Depends(get_current_user)):
     if not user:
         return RedirectResponse(url="/login")
-    existing = session.exec(select(LimiteMensual).where(LimiteMensual.usuario_id == user.id).where(LimiteMensual.mes == mes)).first()
+    existing = (await session.exec(select(LimiteMensual).where(LimiteMensual.usuario_id == user.id).where(LimiteMensual.mes == mes))).first()
     if existing:
         existing.monto_limite = monto_limite
         session.add(existing)
     else:
         nuevo = LimiteMensual(usuario_id=user.id, mes=mes, monto_limite=monto_limite)
         session.add(nuevo)
-    session.commit()
+    await session.run_sync(cambios.marcar, user.id)
+    await session.commit()
     return RedirectResponse(url="/dashboard", status_code=302)
 
 
 # ---------- Historial ----------
 @app.get("/historial")
-def historial(request: Request, session=Depends(get_session), mes: Optional[str] = None):
-    user = get_user_from_request(request, session)
+@condicional
+async def historial(request: Request, session=Depends(get_async_read_session), mes: Optional[str] = None, cursor: Optional[str] = None, user=Depends(get_current_user)):
     if not user:
         return RedirectResponse(url="/login")
     mes_q = mes or current_month_str()
-    trans = session.exec(select(Transaccion).where(Transaccion.usuario_id == user.id).where(Transaccion.mes == mes_q).order_by(Transaccion.fecha.desc())).all()
-    total_ingresos = sum(t.monto for t in trans if t.tipo == "ingreso")
-    total_gastos = sum(t.monto for t in trans if t.tipo in ("gasto", "deuda"))
-    limite = session.exec(select(LimiteMensual).where(LimiteMensual.usuario_id == user.id).where(LimiteMensual.mes == mes_q)).first()
+    stmt = select(Transaccion).where(Transaccion.usuario_id == user.id).where(Transaccion.mes == mes_q)
+    try:
+        trans, siguiente = await session.run_sync(paginacion.paginar, stmt, cursor)
+    except ValueError:
+        trans, siguiente = await session.run_sync(paginacion.paginar, stmt)
+    totales = await session.run_sync(agregados.totales_mes, user.id, mes_q)
     return templates.TemplateResponse("historial.html", {
         "request": request,
         "user": user,
         "transacciones": trans,
         "mes": mes_q,
-        "total_ingresos": total_ingresos,
-        "total_gastos": total_gastos,
-        "monto_limite": limite.monto_limite if limite else 0.0
+        "siguiente_url": paginacion.url_siguiente(request, siguiente),
+        **totales
     })
\ No newline at end of file
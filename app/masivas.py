@@ -0,0 +1,148 @@
+from datetime import date, datetime, timedelta
+from typing import List, Optional
+from sqlalchemy import and_, delete, exists, update
+from sqlmodel import Session, select
+from .dinero import CERO
+from .models import Cuenta, SaldoCuenta, Transaccion
+from . import agregados, busqueda, cambios, facturas
+
+# Operaciones masivas sobre transacciones y cuentas (/api/transacciones/eliminar,
+# mover, recategorizar y /api/cuentas/{id}/fusionar). Cada operación es un solo
+# UPDATE o DELETE sobre todas las filas elegidas. Saldos y resumen se ajustan con los
+# totales agrupados en SQL antes de cambiar las filas (agregados.totales_filtro), una
+# sentencia por cuenta o grupo afectado; búsqueda, facturas y registro de cambios
+# también van por filtro. Nada hace commit: la ruta confirma todo junto.
+# Las validaciones fallan con ValueError (400 en la API).
+
+
+def _filtro(
+    usuario_id: int,
+    ids: Optional[List[int]] = None,
+    cuenta_id: Optional[int] = None,
+    mes: Optional[str] = None,
+    tipo: Optional[str] = None,
+    categoria: Optional[str] = None,
+    subcategoria: Optional[str] = None,
+    desde: Optional[date] = None,
+    hasta: Optional[date] = None,
+):
+    condiciones = [Transaccion.usuario_id == usuario_id]
+    if ids is not None:
+        condiciones.append(Transaccion.id.in_(ids))
+    if cuenta_id is not None:
+        condiciones.append(Transaccion.cuenta_id == cuenta_id)
+    if mes:
+        condiciones.append(Transaccion.mes == mes)
+    if tipo:
+        condiciones.append(Transaccion.tipo == tipo)
+    if categoria:
+        condiciones.append(Transaccion.categoria == categoria)
+    if subcategoria is not None:
+        # "" = sin subcategoría
+        condiciones.append(Transaccion.subcategoria == subcategoria if subcategoria else Transaccion.subcategoria.is_(None))
+    if desde:
+        condiciones.append(Transaccion.fecha >= datetime.combine(desde, datetime.min.time()))
+    if hasta:
+        condiciones.append(Transaccion.fecha < datetime.combine(hasta + timedelta(days=1), datetime.min.time()))
+    if len(condiciones) == 1:
+        raise ValueError("Indica al menos un filtro")
+    return and_(*condiciones)
+
+def _cuenta_propia(session: Session, usuario_id: int, cuenta_id: int) -> bool:
+    return session.exec(
+        select(exists().where(Cuenta.id == cuenta_id, Cuenta.usuario_id == usuario_id))
+    ).one()
+
+
+def eliminar_transacciones(session: Session, usuario_id: int, ids: List[int]) -> int:
+    condicion = _filtro(usuario_id, ids=ids)
+    saldos, grupos = agregados.totales_filtro(session, condicion)
+    if not grupos:
+        return 0
+    agregados.aplicar_totales(session, saldos, grupos, -1)
+    busqueda.desindexar_filtro(session, condicion)
+    facturas.liberar_filtro(session, condicion)
+    cambios.registrar_consulta(
+        session, "transaccion", "delete", select(Transaccion.usuario_id, Transaccion.id).where(condicion)
+    )
+    eliminadas = session.execute(
+        delete(Transaccion).where(condicion).execution_options(synchronize_session=False)
+    ).rowcount
+    cambios.marcar(session, usuario_id)
+    return eliminadas
+
+def _mover(session: Session, usuario_id: int, condicion, destino: int) -> int:
+    # El resumen no cambia: no depende de la cuenta
+    condicion = and_(condicion, Transaccion.cuenta_id != destino)
+    saldos, _ = agregados.totales_filtro(session, condicion, resumen=False)
+    if not saldos:
+        return 0
+    agregados.aplicar_totales(session, saldos, {}, -1)
+    agregados.aplicar_totales(session, {(destino, usuario_id): sum(saldos.values())}, {}, 1)
+    cambios.registrar_consulta(
+        session, "transaccion", "update", select(Transaccion.usuario_id, Transaccion.id).where(condicion)
+    )
+    return session.execute(
+        update(Transaccion).where(condicion).values(cuenta_id=destino).execution_options(synchronize_session=False)
+    ).rowcount
+
+def mover_transacciones(session: Session, usuario_id: int, ids: List[int], cuenta_id: int) -> int:
+    if not _cuenta_propia(session, usuario_id, cuenta_id):
+        raise ValueError(f"Cuenta inválida: {cuenta_id}")
+    movidas = _mover(session, usuario_id, _filtro(usuario_id, ids=ids), cuenta_id)
+    if movidas:
+        cambios.marcar(session, usuario_id)
+    return movidas
+
+def recategorizar(
+    session: Session,
+    usuario_id: int,
+    filtro: dict,
+    categoria: Optional[str] = None,
+    subcategoria: Optional[str] = None,
+) -> int:
+    # filtro: argumentos de _filtro. subcategoria "" deja las filas sin subcategoría
+    if categoria is None and subcategoria is None:
+        raise ValueError("Indica la categoría o la subcategoría nueva")
+    condicion = _filtro(usuario_id, **filtro)
+    valores = {}
+    if categoria is not None:
+        valores["categoria"] = categoria
+    if subcategoria is not None:
+        valores["subcategoria"] = subcategoria or None
+
+    # Cada grupo del resumen pasa entero a su clave nueva (misma mes y tipo)
+    _, grupos = agregados.totales_filtro(session, condicion, saldos=False)
+    if not grupos:
+        return 0
+    nuevos = {}
+    for (u, mes, tipo, cat, sub), (total, cantidad) in grupos.items():
+        clave = (u, mes, tipo, valores.get("categoria", cat), (valores["subcategoria"] or "") if "subcategoria" in valores else sub)
+        grupo = nuevos.setdefault(clave, [CERO, 0])
+        grupo[0] += total
+        grupo[1] += cantidad
+    agregados.aplicar_totales(session, {}, grupos, -1)
+    agregados.aplicar_totales(session, {}, nuevos, 1)
+    busqueda.reindexar_filtro(session, condicion, **valores)
+    cambios.registrar_consulta(
+        session, "transaccion", "update", select(Transaccion.usuario_id, Transaccion.id).where(condicion)
+    )
+    cambiadas = session.execute(
+        update(Transaccion).where(condicion).values(**valores).execution_options(synchronize_session=False)
+    ).rowcount
+    cambios.marcar(session, usuario_id)
+    return cambiadas
+
+def fusionar_cuentas(session: Session, usuario_id: int, origen: int, destino: int) -> int:
+    # Pasa todas las transacciones de origen a destino y elimina origen
+    if origen == destino:
+        raise ValueError("La cuenta de destino debe ser otra")
+    for cuenta_id in (origen, destino):
+        if not _cuenta_propia(session, usuario_id, cuenta_id):
+            raise ValueError(f"Cuenta inválida: {cuenta_id}")
+    movidas = _mover(session, usuario_id, _filtro(usuario_id, cuenta_id=origen), destino)
+    session.execute(delete(SaldoCuenta).where(SaldoCuenta.cuenta_id == origen))
+    cambios.registrar(session, "cuenta", "delete", [(usuario_id, origen)])
+    session.execute(delete(Cuenta).where(Cuenta.id == origen).execution_options(synchronize_session=False))
+    cambios.marcar(session, usuario_id)
+    return movidas
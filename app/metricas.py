@@ -0,0 +1,236 @@
+import logging
+import os
+import threading
+import time
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from typing import Callable, Dict, List, Optional, Tuple
+from jinja2 import Template
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# Instrumentación por petición, expuesta en /metrics con el formato de texto de
+# Prometheus (sin dependencias extra). Mide:
+#   - latencia por ruta (plantilla de la ruta, no la URL, para no multiplicar series)
+#   - cantidad de consultas SQL y tiempo de base por petición (eventos del Engine)
+#   - render de templates Jinja y llamadas al almacenamiento de facturas
+#   - posibles N+1: la misma sentencia repetida N_MAS_1_UMBRAL veces en una petición
+# Con PETICION_LENTA_MS > 0 las peticiones más lentas se registran con sus consultas.
+PETICION_LENTA_MS = float(os.getenv("PETICION_LENTA_MS", "0"))  # 0 = desactivado
+N_MAS_1_UMBRAL = int(os.getenv("N_MAS_1_UMBRAL", "10"))
+METRICAS_TOKEN = os.getenv("METRICAS_TOKEN")  # si está, /metrics pide Authorization: Bearer <token>
+
+BUCKETS_SEGUNDOS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+BUCKETS_CONSULTAS = (1, 2, 5, 10, 20, 50, 100)
+
+logger = logging.getLogger(__name__)
+
+
+# ---------- Registro de métricas ----------
+def _escapar(valor) -> str:
+    return str(valor).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def _numero(valor) -> str:
+    # Enteros completos y floats con repr: con :g (6 cifras) un contador que pasa de
+    # 10^6 sale como 1.23457e+06 y rate() se queda plano o salta
+    if isinstance(valor, int) or (isinstance(valor, float) and valor.is_integer() and abs(valor) < 2 ** 53):
+        return str(int(valor))
+    return repr(float(valor))
+
+def _etiquetas(nombres: Tuple[str, ...], valores: Tuple, extra: str = "") -> str:
+    pares = [f'{n}="{_escapar(v)}"' for n, v in zip(nombres, valores)]
+    if extra:
+        pares.append(extra)
+    return "{" + ",".join(pares) + "}" if pares else ""
+
+
+class Contador:
+    def __init__(self, nombre: str, ayuda: str, etiquetas: Tuple[str, ...] = ()):
+        self.nombre, self.ayuda, self.etiquetas = nombre, ayuda, etiquetas
+        self._valores: Dict[Tuple, float] = {}
+        self._lock = threading.Lock()
+        _REGISTRO.append(self)
+
+    def inc(self, *valores, cantidad: float = 1):
+        with self._lock:
+            self._valores[valores] = self._valores.get(valores, 0) + cantidad
+
+    def exponer(self) -> List[str]:
+        lineas = [f"# HELP {self.nombre} {self.ayuda}", f"# TYPE {self.nombre} counter"]
+        with self._lock:
+            for valores, total in sorted(self._valores.items()):
+                lineas.append(f"{self.nombre}{_etiquetas(self.etiquetas, valores)} {_numero(total)}")
+        return lineas
+
+
+class Histograma:
+    def __init__(self, nombre: str, ayuda: str, etiquetas: Tuple[str, ...] = (), limites=BUCKETS_SEGUNDOS):
+        self.nombre, self.ayuda, self.etiquetas, self.limites = nombre, ayuda, etiquetas, limites
+        self._series: Dict[Tuple, List[float]] = {}  # valores → [cuenta por bucket..., suma, total]
+        self._lock = threading.Lock()
+        _REGISTRO.append(self)
+
+    def observar(self, valor: float, *valores):
+        with self._lock:
+            serie = self._series.get(valores)
+            if serie is None:
+                serie = self._series[valores] = [0] * (len(self.limites) + 2)
+            for i, limite in enumerate(self.limites):
+                if valor <= limite:
+                    serie[i] += 1
+            serie[-2] += valor
+            serie[-1] += 1
+
+    def exponer(self) -> List[str]:
+        lineas = [f"# HELP {self.nombre} {self.ayuda}", f"# TYPE {self.nombre} histogram"]
+        with self._lock:
+            for valores, serie in sorted(self._series.items()):
+                for limite, cuenta in zip(self.limites, serie):
+                    le = f'le="{limite:g}"'
+                    lineas.append(f"{self.nombre}_bucket{_etiquetas(self.etiquetas, valores, le)} {cuenta}")
+                le = 'le="+Inf"'
+                lineas.append(f"{self.nombre}_bucket{_etiquetas(self.etiquetas, valores, le)} {serie[-1]}")
+                lineas.append(f"{self.nombre}_sum{_etiquetas(self.etiquetas, valores)} {_numero(serie[-2])}")
+                lineas.append(f"{self.nombre}_count{_etiquetas(self.etiquetas, valores)} {serie[-1]}")
+        return lineas
+
+
+class Medidor:
+    # Valor que ya lleva otro objeto (cola, caché, ejecutor) y se lee al exponer:
+    # leer() devuelve {valores de etiquetas: número}. tipo="counter" si solo crece
+    def __init__(self, nombre: str, ayuda: str, etiquetas: Tuple[str, ...], leer: Callable[[], Dict[Tuple, float]], tipo: str = "gauge"):
+        self.nombre, self.ayuda, self.etiquetas, self.leer, self.tipo = nombre, ayuda, etiquetas, leer, tipo
+        _REGISTRO.append(self)
+
+    def exponer(self) -> List[str]:
+        lineas = [f"# HELP {self.nombre} {self.ayuda}", f"# TYPE {self.nombre} {self.tipo}"]
+        for valores, valor in sorted(self.leer().items()):
+            lineas.append(f"{self.nombre}{_etiquetas(self.etiquetas, valores)} {_numero(valor)}")
+        return lineas
+
+
+_REGISTRO: List = []
+
+def exponer() -> str:
+    lineas = []
+    for metrica in _REGISTRO:
+        lineas.extend(metrica.exponer())
+    return "\n".join(lineas) + "\n"
+
+
+peticiones = Contador("http_requests_total", "Peticiones HTTP atendidas", ("metodo", "ruta", "estado"))
+latencia = Histograma("http_request_duration_seconds", "Latencia de las peticiones HTTP", ("metodo", "ruta"))
+consultas_por_peticion = Histograma(
+    "db_queries_per_request", "Sentencias SQL ejecutadas por petición", ("ruta",), BUCKETS_CONSULTAS
+)
+tiempo_db = Histograma("db_time_per_request_seconds", "Tiempo total de base de datos por petición", ("ruta",))
+consultas = Contador("db_queries_total", "Sentencias SQL ejecutadas (dentro y fuera de peticiones)")
+n_mas_1 = Contador("db_n_plus_one_total", "Peticiones que repitieron la misma sentencia N_MAS_1_UMBRAL veces o más", ("ruta",))
+render = Histograma("template_render_seconds", "Tiempo de render de templates Jinja", ("template",))
+almacenamiento = Histograma("storage_call_seconds", "Llamadas al almacenamiento de facturas", ("operacion", "resultado"))
+
+
+# ---------- Estado de la petición en curso ----------
+@dataclass
+class Peticion:
+    consultas: int = 0
+    tiempo_db: float = 0.0
+    por_sentencia: Dict[str, int] = field(default_factory=dict)
+    detalle: Optional[List[Tuple[str, float]]] = None  # solo con PETICION_LENTA_MS
+
+
+_actual: ContextVar[Optional[Peticion]] = ContextVar("peticion_actual", default=None)
+
+
+@event.listens_for(Engine, "before_cursor_execute")
+def _antes(conn, cursor, sentencia, parametros, contexto, executemany):
+    conn.info.setdefault("metricas_inicio", []).append(time.perf_counter())
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _despues(conn, cursor, sentencia, parametros, contexto, executemany):
+    inicios = conn.info.get("metricas_inicio")
+    duracion = time.perf_counter() - inicios.pop() if inicios else 0.0
+    consultas.inc()
+    peticion = _actual.get()
+    if peticion is None:
+        return
+    peticion.consultas += 1
+    peticion.tiempo_db += duracion
+    peticion.por_sentencia[sentencia] = peticion.por_sentencia.get(sentencia, 0) + 1
+    if peticion.detalle is not None:
+        peticion.detalle.append((sentencia, duracion))
+
+
+def _ruta(scope) -> str:
+    ruta = scope.get("route")
+    return getattr(ruta, "path", None) or "sin_ruta"
+
+
+class MiddlewareMetricas:
+    # ASGI puro (no BaseHTTPMiddleware) para no romper el streaming de las exportaciones
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        peticion = Peticion(detalle=[] if PETICION_LENTA_MS > 0 else None)
+        token = _actual.set(peticion)
+        estado = {"codigo": 500}
+        inicio = time.perf_counter()
+
+        async def enviar(mensaje):
+            if mensaje["type"] == "http.response.start":
+                estado["codigo"] = mensaje["status"]
+            await send(mensaje)
+
+        try:
+            await self.app(scope, receive, enviar)
+        finally:
+            _actual.reset(token)
+            self._registrar(scope, peticion, estado["codigo"], time.perf_counter() - inicio)
+
+    def _registrar(self, scope, peticion: Peticion, codigo: int, duracion: float):
+        ruta = _ruta(scope)
+        if ruta == "/metrics":
+            return
+        metodo = scope["method"]
+        peticiones.inc(metodo, ruta, codigo)
+        latencia.observar(duracion, metodo, ruta)
+        consultas_por_peticion.observar(peticion.consultas, ruta)
+        tiempo_db.observar(peticion.tiempo_db, ruta)
+        repetidas = [(s, n) for s, n in peticion.por_sentencia.items() if n >= N_MAS_1_UMBRAL]
+        if repetidas:
+            n_mas_1.inc(ruta)
+            sentencia, veces = max(repetidas, key=lambda r: r[1])
+            logger.warning("Posible N+1 en %s %s: %d veces %s", metodo, ruta, veces, " ".join(sentencia.split())[:200])
+        if peticion.detalle is not None and duracion * 1000 >= PETICION_LENTA_MS:
+            logger.warning(
+                "Petición lenta %s %s: %.0f ms, %d consultas (%.0f ms en base)\n%s",
+                metodo, scope.get("path"), duracion * 1000, peticion.consultas, peticion.tiempo_db * 1000,
+                "\n".join(f"  {d * 1000:7.1f} ms  {' '.join(s.split())[:300]}" for s, d in peticion.detalle[:50]),
+            )
+
+
+# ---------- Templates y almacenamiento ----------
+class TemplateMedido(Template):
+    def render(self, *args, **kwargs):
+        inicio = time.perf_counter()
+        try:
+            return super().render(*args, **kwargs)
+        finally:
+            render.observar(time.perf_counter() - inicio, self.name or "")
+
+def instrumentar_templates(env):
+    # Los templates se compilan con esta clase desde ahora (Jinja los cachea después)
+    env.template_class = TemplateMedido
+
+def medir_almacenamiento(operacion: str, fn, *args):
+    inicio = time.perf_counter()
+    resultado = "error"
+    try:
+        valor = fn(*args)
+        resultado = "ok"
+        return valor
+    finally:
+        almacenamiento.observar(time.perf_counter() - inicio, operacion, resultado)
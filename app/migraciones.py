@@ -0,0 +1,194 @@
+from typing import Callable, List, Tuple
+from sqlalchemy import Integer, MetaData, Table, inspect, select as sa_select, text
+from sqlalchemy.engine import Connection, Engine
+from sqlalchemy.schema import CreateTable
+from sqlmodel import Session, SQLModel, select
+from .dinero import CENTAVOS, MONEDA_DEFECTO
+from .models import Cambio, LimiteMensual, ResumenMensual, SaldoCuenta, Transaccion, VersionEsquema
+from . import agregados, busqueda
+
+# Migraciones versionadas. Se aplican en orden al arrancar (crear_db) o con
+# `python -m app.cli migrar`; cada una corre en su propia transacción y queda
+# registrada en la tabla versionesquema. Nunca editar una ya publicada: agregar otra.
+
+
+def _m001_indices_transaccion(conn: Connection):
+    conn.execute(text("CREATE INDEX IF NOT EXISTS ix_transaccion_usuario_mes_fecha ON transaccion (usuario_id, mes, fecha, id)"))
+    conn.execute(text("CREATE INDEX IF NOT EXISTS ix_transaccion_usuario_fecha ON transaccion (usuario_id, fecha, id)"))
+    conn.execute(text("CREATE INDEX IF NOT EXISTS ix_transaccion_cuenta_id ON transaccion (cuenta_id)"))
+    conn.execute(text("CREATE INDEX IF NOT EXISTS ix_cuenta_usuario_id ON cuenta (usuario_id)"))
+
+def _m002_limite_unico(conn: Connection):
+    # Dejar solo el último límite de cada (usuario, mes) antes de crear el índice único
+    conn.execute(text(
+        "DELETE FROM limitemensual WHERE id NOT IN "
+        "(SELECT MAX(id) FROM limitemensual GROUP BY usuario_id, mes)"
+    ))
+    conn.execute(text("CREATE UNIQUE INDEX IF NOT EXISTS ux_limitemensual_usuario_mes ON limitemensual (usuario_id, mes)"))
+
+def _m003_rellenar_agregados(conn: Connection):
+    # Bases creadas antes de los saldos, el resumen mensual y el buscador FTS
+    busqueda.crear_indice_busqueda(conn)
+    with Session(bind=conn) as session:
+        agregados.reconstruir_saldos(session)
+        agregados.reconstruir_resumenes(session)
+        busqueda.reconstruir_indice(session)
+
+def _agregar_columna(conn: Connection, tabla: str, columna: str, tipo: str):
+    # Las bases nuevas ya traen la columna por create_all
+    if columna not in {c["name"] for c in inspect(conn).get_columns(tabla)}:
+        conn.execute(text(f"ALTER TABLE {tabla} ADD COLUMN {columna} {tipo}"))
+
+def _m004_estado_factura(conn: Connection):
+    _agregar_columna(conn, "transaccion", "factura_estado", "VARCHAR")
+    conn.execute(text("UPDATE transaccion SET factura_estado = 'subida' WHERE factura_url IS NOT NULL"))
+
+def _m005_miniatura_factura(conn: Connection):
+    _agregar_columna(conn, "transaccion", "factura_miniatura_url", "VARCHAR")
+
+def _m006_factura_por_contenido(conn: Connection):
+    # La tabla factura la crea create_all; las transacciones existentes quedan sin hash
+    _agregar_columna(conn, "transaccion", "factura_hash", "VARCHAR REFERENCES factura (sha256)")
+    conn.execute(text("CREATE INDEX IF NOT EXISTS ix_transaccion_factura_hash ON transaccion (factura_hash)"))
+
+def _m007_huella_importacion(conn: Connection):
+    _agregar_columna(conn, "transaccion", "huella", "VARCHAR")
+    conn.execute(text("CREATE UNIQUE INDEX IF NOT EXISTS ux_transaccion_usuario_huella ON transaccion (usuario_id, huella)"))
+
+def _m008_version_datos(conn: Connection):
+    _agregar_columna(conn, "usuario", "version_datos", "INTEGER NOT NULL DEFAULT 0")
+
+def _m009_registro_cambios(conn: Connection):
+    # La tabla cambio la crea create_all; lo que ya existía entra como alta para que
+    # el primer /api/sync?since=0 lo traiga
+    for tabla in ("transaccion", "cuenta", "limitemensual"):
+        conn.execute(text(
+            "INSERT INTO cambio (usuario_id, entidad, entidad_id, operacion, creado) "
+            f"SELECT usuario_id, '{tabla}', id, 'insert', CURRENT_TIMESTAMP FROM {tabla} ORDER BY id"
+        ))
+
+def _reconstruir_tabla_sqlite(conn: Connection, tabla: Table, expresiones: dict):
+    # SQLite no cambia el tipo de una columna: tabla nueva con el esquema actual del
+    # modelo, copia de las filas (con `expresiones` para las columnas convertidas),
+    # borrar la vieja, renombrar y volver a crear sus índices. Ninguna tabla apunta
+    # con FK a las que se reconstruyen aquí
+    existentes = {c["name"] for c in inspect(conn).get_columns(tabla.name)}
+    metadata = MetaData()
+    for otra in SQLModel.metadata.sorted_tables:
+        otra.to_metadata(metadata)  # para que las FK de la copia se resuelvan
+    nueva = tabla.to_metadata(metadata, name=f"{tabla.name}_nueva")
+    conn.execute(CreateTable(nueva))
+    columnas = [c.name for c in tabla.columns if c.name in existentes]
+    conn.execute(text(
+        f"INSERT INTO {nueva.name} ({', '.join(columnas)}) "
+        f"SELECT {', '.join(expresiones.get(c, c) for c in columnas)} FROM {tabla.name}"
+    ))
+    conn.execute(text(f"DROP TABLE {tabla.name}"))
+    conn.execute(text(f"ALTER TABLE {nueva.name} RENAME TO {tabla.name}"))
+    for indice in tabla.indexes:
+        indice.create(conn)
+
+def _m010_dinero_en_centavos(conn: Connection):
+    # Montos de float (pesos) a entero en centavos, más la moneda de cada monto.
+    # Las columnas que ya son BIGINT (bases nuevas, por create_all) no se convierten
+    for tabla, columna, con_moneda in (
+        (Transaccion.__table__, "monto", True),
+        (LimiteMensual.__table__, "monto_limite", True),
+        (SaldoCuenta.__table__, "saldo", False),
+        (ResumenMensual.__table__, "total", False),
+    ):
+        if con_moneda:
+            _agregar_columna(conn, tabla.name, "moneda", f"VARCHAR(3) NOT NULL DEFAULT '{MONEDA_DEFECTO}'")
+        tipo = {c["name"]: c["type"] for c in inspect(conn).get_columns(tabla.name)}[columna]
+        if isinstance(tipo, Integer):
+            continue
+        centavos = f"CAST(ROUND({columna} * {CENTAVOS}) AS BIGINT)"
+        if conn.dialect.name == "sqlite":
+            _reconstruir_tabla_sqlite(conn, tabla, {columna: centavos})
+        else:
+            conn.execute(text(f"ALTER TABLE {tabla.name} ALTER COLUMN {columna} TYPE BIGINT USING {centavos}"))
+    # Saldos, resumen e índice se rehacen siempre desde las transacciones ya convertidas:
+    # si la migración 3 corrió en esta misma pasada, llenó tablas creadas ya en BIGINT
+    # con sumas en pesos (e indexó los pesos), y el tipo de la columna no lo delata
+    with Session(bind=conn) as session:
+        agregados.reconstruir_saldos(session)
+        agregados.reconstruir_resumenes(session)
+        busqueda.reconstruir_indice(session)
+
+def _m011_pendiente_factura(conn: Connection):
+    # Las pendientes existentes cuentan desde `creada` (ver facturas.pendientes_vencidas)
+    _agregar_columna(conn, "factura", "pendiente_desde", "TIMESTAMP")
+
+
+MIGRACIONES: List[Tuple[int, str, Callable[[Connection], None]]] = [
+    (1, "indices_transaccion", _m001_indices_transaccion),
+    (2, "limite_unico", _m002_limite_unico),
+    (3, "rellenar_agregados", _m003_rellenar_agregados),
+    (4, "estado_factura", _m004_estado_factura),
+    (5, "miniatura_factura", _m005_miniatura_factura),
+    (6, "factura_por_contenido", _m006_factura_por_contenido),
+    (7, "huella_importacion", _m007_huella_importacion),
+    (8, "version_datos", _m008_version_datos),
+    (9, "registro_cambios", _m009_registro_cambios),
+    (10, "dinero_en_centavos", _m010_dinero_en_centavos),
+    (11, "pendiente_factura", _m011_pendiente_factura),
+]
+
+
+def version_actual(engine: Engine) -> int:
+    with engine.connect() as conn:
+        return max(conn.execute(sa_select(VersionEsquema.version)).scalars().all(), default=0)
+
+def aplicar_migraciones(engine: Engine) -> List[int]:
+    # Devuelve las versiones aplicadas en esta llamada
+    actual = version_actual(engine)
+    aplicadas = []
+    for version, nombre, migrar in MIGRACIONES:
+        if version <= actual:
+            continue
+        with engine.begin() as conn:
+            migrar(conn)
+            conn.execute(VersionEsquema.__table__.insert().values(version=version, nombre=nombre))
+        aplicadas.append(version)
+    return aplicadas
+
+
+# ---------- Planes de consulta ----------
+# Consultas calientes de la app y el índice que deben usar (EXPLAIN QUERY PLAN, solo SQLite)
+def _consultas_calientes():
+    return [
+        ("transacciones del mes",
+         select(Transaccion).where(Transaccion.usuario_id == 1).where(Transaccion.mes == "2025-01")
+         .order_by(Transaccion.fecha.desc(), Transaccion.id.desc()),
+         "ix_transaccion_usuario_mes_fecha"),
+        ("transacciones de todos los meses",
+         select(Transaccion).where(Transaccion.usuario_id == 1)
+         .order_by(Transaccion.fecha.desc(), Transaccion.id.desc()),
+         "ix_transaccion_usuario_fecha"),
+        ("transacciones de una cuenta",
+         select(Transaccion.id).where(Transaccion.cuenta_id == 1).limit(1),
+         "ix_transaccion_cuenta_id"),
+        ("límite del mes",
+         select(LimiteMensual).where(LimiteMensual.usuario_id == 1).where(LimiteMensual.mes == "2025-01"),
+         "ux_limitemensual_usuario_mes"),
+        ("huellas ya importadas",
+         select(Transaccion.huella).where(Transaccion.usuario_id == 1).where(Transaccion.huella.in_(["a", "b"])),
+         "ux_transaccion_usuario_huella"),
+        ("cambios desde una seq",
+         select(Cambio.entidad, Cambio.entidad_id, Cambio.seq)
+         .where(Cambio.usuario_id == 1).where(Cambio.seq > 0).order_by(Cambio.seq),
+         "ix_cambio_usuario_seq"),
+    ]
+
+def verificar_planes(engine: Engine) -> List[Tuple[str, str, bool]]:
+    # Devuelve (consulta, plan, usa_el_índice_esperado)
+    if engine.dialect.name != "sqlite":
+        return []
+    resultados = []
+    with engine.connect() as conn:
+        for nombre, stmt, indice in _consultas_calientes():
+            compilado = stmt.compile(dialect=engine.dialect, compile_kwargs={"literal_binds": True})
+            plan = " | ".join(fila[-1] for fila in conn.execute(text(f"EXPLAIN QUERY PLAN {compilado}")))
+            usa_indice = f"INDEX {indice}" in plan and "USE TEMP B-TREE" not in plan
+            resultados.append((nombre, plan, usa_indice))
+    return resultados
@@ -1,11 +1,16 @@
 from sqlmodel import SQLModel, Field, Relationship
+from sqlalchemy import Index
 from typing import Optional, List
 from datetime import datetime
+from decimal import Decimal
+from .dinero import CERO, Dinero, MONEDA_DEFECTO
 
 class Usuario(SQLModel, table=True):
     id: Optional[int] = Field(default=None, primary_key=True)
     email: str = Field(index=True, unique=True)
     hashed_password: str
+    # Sube con cada escritura de sus datos (ver app/cambios.py); las páginas la usan como ETag
+    version_datos: int = Field(default=0, sa_column_kwargs={"server_default": "0"})
 
     cuentas: List["Cuenta"] = Relationship(back_populates="usuario")
     transacciones: List["Transaccion"] = Relationship(back_populates="usuario")
@@ -14,14 +19,23 @@ class Usuario(SQLModel, table=True):
 class Cuenta(SQLModel, table=True):
     id: Optional[int] = Field(default=None, primary_key=True)
     nombre: str
-    usuario_id: int = Field(foreign_key="usuario.id")
+    usuario_id: int = Field(foreign_key="usuario.id", index=True)
 
     usuario: Usuario = Relationship(back_populates="cuentas")
     transacciones: List["Transaccion"] = Relationship(back_populates="cuenta")
 
 class Transaccion(SQLModel, table=True):
+    __table_args__ = (
+        # Listados por mes y paginación por cursor (fecha, id)
+        Index("ix_transaccion_usuario_mes_fecha", "usuario_id", "mes", "fecha", "id"),
+        Index("ix_transaccion_usuario_fecha", "usuario_id", "fecha", "id"),
+        # Importación de extractos: la misma fila nunca entra dos veces
+        Index("ux_transaccion_usuario_huella", "usuario_id", "huella", unique=True),
+    )
+
     id: Optional[int] = Field(default=None, primary_key=True)
-    monto: float
+    monto: Decimal = Field(sa_type=Dinero)  # centavos en la base (ver app/dinero.py)
+    moneda: str = Field(default=MONEDA_DEFECTO, max_length=3, sa_column_kwargs={"server_default": MONEDA_DEFECTO})
     tipo: str  # ingreso / gasto / deuda
     categoria: str  # fijo / variable
     subcategoria: Optional[str] = None
@@ -29,19 +43,89 @@ class Transaccion(SQLModel, table=True):
     mes: str = Field(default="")  # 'YYYY-MM'
 
     usuario_id: int = Field(foreign_key="usuario.id")
-    cuenta_id: int = Field(foreign_key="cuenta.id")
+    cuenta_id: int = Field(foreign_key="cuenta.id", index=True)
 
      #URL a la imagen subida a Supabase
     factura_url: Optional[str] = None
+    # pendiente / subida / error mientras la cola de facturas la sube
+    factura_estado: Optional[str] = None
+    # JPEG reducido para las listas (solo imágenes)
+    factura_miniatura_url: Optional[str] = None
+    # Contenido de la factura (ver Factura); varias transacciones pueden compartirla
+    factura_hash: Optional[str] = Field(default=None, foreign_key="factura.sha256", index=True)
+    # Huella de la fila del extracto bancario de donde salió (ver app/importacion.py); None si se cargó a mano
+    huella: Optional[str] = None
 
     usuario: Usuario = Relationship(back_populates="transacciones")
     cuenta: Cuenta = Relationship(back_populates="transacciones")
 
 
 class LimiteMensual(SQLModel, table=True):
+    __table_args__ = (
+        Index("ux_limitemensual_usuario_mes", "usuario_id", "mes", unique=True),
+    )
+
     id: Optional[int] = Field(default=None, primary_key=True)
     usuario_id: int = Field(foreign_key="usuario.id")
     mes: str  # 'YYYY-MM'
-    monto_limite: float = 0.0
+    monto_limite: Decimal = Field(default=CERO, sa_type=Dinero)
+    moneda: str = Field(default=MONEDA_DEFECTO, max_length=3, sa_column_kwargs={"server_default": MONEDA_DEFECTO})
 
     usuario: Usuario = Relationship(back_populates="limites")
+
+
+class SaldoCuenta(SQLModel, table=True):
+    # Saldo acumulado de cada cuenta; se actualiza en el mismo commit que crea/elimina la transacción
+    cuenta_id: int = Field(foreign_key="cuenta.id", primary_key=True)
+    usuario_id: int = Field(foreign_key="usuario.id", index=True)
+    saldo: Decimal = Field(default=CERO, sa_type=Dinero)
+
+
+class ResumenMensual(SQLModel, table=True):
+    # Totales por (usuario, mes, tipo, categoría, subcategoría) para los KPIs de dashboard e historial
+    usuario_id: int = Field(foreign_key="usuario.id", primary_key=True)
+    mes: str = Field(primary_key=True)  # 'YYYY-MM'
+    tipo: str = Field(primary_key=True)
+    categoria: str = Field(primary_key=True)
+    subcategoria: str = Field(default="", primary_key=True)  # '' cuando no tiene
+    total: Decimal = Field(default=CERO, sa_type=Dinero)
+    cantidad: int = 0
+
+
+class Factura(SQLModel, table=True):
+    # Facturas guardadas por contenido: un objeto en el almacenamiento por sha256,
+    # con el número de transacciones que lo usan. Sin referencias queda huérfana y
+    # `python -m app.cli facturas gc` la borra por lotes.
+    sha256: str = Field(primary_key=True)
+    ruta: str
+    content_type: str
+    tamano: int
+    estado: str = "pendiente"  # pendiente / subida / error
+    url: Optional[str] = None
+    miniatura_url: Optional[str] = None
+    referencias: int = 0
+    creada: datetime = Field(default_factory=datetime.utcnow)
+    pendiente_desde: Optional[datetime] = None  # última vez que pasó a pendiente (subida en curso)
+    huerfana_desde: Optional[datetime] = Field(default=None, index=True)
+
+
+class Cambio(SQLModel, table=True):
+    # Registro de cambios (solo se agregan filas) de Transaccion, Cuenta y LimiteMensual
+    # para /api/sync: el cliente pide lo ocurrido después de la última seq que vio
+    __table_args__ = (
+        Index("ix_cambio_usuario_seq", "usuario_id", "seq"),
+    )
+
+    seq: Optional[int] = Field(default=None, primary_key=True)
+    usuario_id: int = Field(foreign_key="usuario.id")
+    entidad: str  # transaccion / cuenta / limitemensual
+    entidad_id: int
+    operacion: str  # insert / update / delete
+    creado: datetime = Field(default_factory=datetime.utcnow)
+
+
+class VersionEsquema(SQLModel, table=True):
+    # Migraciones aplicadas (ver app/migraciones.py)
+    version: int = Field(primary_key=True)
+    nombre: str
+    aplicada: datetime = Field(default_factory=datetime.utcnow)
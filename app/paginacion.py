@@ -0,0 +1,49 @@
+import base64
+from datetime import datetime
+from typing import List, Optional, Tuple
+from urllib.parse import urlencode
+from sqlalchemy import tuple_
+from sqlmodel import Session
+from .models import Transaccion
+
+# Paginación por cursor (keyset) sobre (fecha, id), siempre en orden descendente.
+# El cursor es la posición de la última fila entregada, así cada página cuesta lo
+# mismo sin importar cuántas transacciones tenga el usuario.
+TAMANO_PAGINA = 50
+LIMITE_MAXIMO = 200
+
+
+def codificar_cursor(tx: Transaccion) -> str:
+    crudo = f"{tx.fecha.isoformat()}|{tx.id}".encode()
+    return base64.urlsafe_b64encode(crudo).decode().rstrip("=")
+
+def decodificar_cursor(cursor: Optional[str]) -> Optional[Tuple[datetime, int]]:
+    # Devuelve None si no hay cursor; lanza ValueError si está mal formado
+    if not cursor:
+        return None
+    try:
+        crudo = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        fecha, tx_id = crudo.rsplit("|", 1)
+        return datetime.fromisoformat(fecha), int(tx_id)
+    except (ValueError, UnicodeDecodeError) as e:
+        raise ValueError("Cursor inválido") from e
+
+def paginar(session: Session, stmt, cursor: Optional[str] = None, limite: int = TAMANO_PAGINA) -> Tuple[List[Transaccion], Optional[str]]:
+    # stmt es un select(Transaccion) ya filtrado; devuelve (página, cursor de la siguiente o None)
+    limite = max(1, min(limite, LIMITE_MAXIMO))
+    posicion = decodificar_cursor(cursor)
+    if posicion:
+        stmt = stmt.where(tuple_(Transaccion.fecha, Transaccion.id) < tuple_(*posicion))
+    stmt = stmt.order_by(Transaccion.fecha.desc(), Transaccion.id.desc()).limit(limite + 1)
+    filas = session.exec(stmt).all()
+    if len(filas) > limite:
+        return filas[:limite], codificar_cursor(filas[limite - 1])
+    return filas, None
+
+def url_siguiente(request, cursor: Optional[str]) -> Optional[str]:
+    # Misma URL con los mismos filtros, apuntando a la siguiente página
+    if not cursor:
+        return None
+    params = dict(request.query_params)
+    params["cursor"] = cursor
+    return f"{request.url.path}?{urlencode(params)}"
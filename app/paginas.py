@@ -0,0 +1,87 @@
+import functools
+import hashlib
+import os
+from fastapi.responses import HTMLResponse, Response
+from sqlmodel import select
+from sqlmodel.ext.asyncio.session import AsyncSession
+from .cache import CachePorUsuario, etag_coincide
+from .database import async_engine_lectura
+from .formato import current_month_str
+from .models import Usuario
+from . import cambios
+
+# GET condicional para las páginas HTML. El ETag sale de Usuario.version_datos (ver
+# app/cambios.py): si el navegador ya tiene esa versión se responde 304 sin consultar
+# la base ni renderizar; si no, el HTML se sirve desde la caché de páginas o se
+# renderiza y se guarda con la misma clave.
+# Con varios procesos (workers) cada uno guarda su copia de la versión por
+# DATOS_VERSION_TTL segundos: en ese caso conviene un valor bajo (0 = leerla siempre).
+DATOS_VERSION_TTL = float(os.getenv("DATOS_VERSION_TTL", "60"))
+PAGINAS_CACHE_TAMANO = int(os.getenv("PAGINAS_CACHE_TAMANO", "256"))
+PAGINAS_CACHE_TTL = float(os.getenv("PAGINAS_CACHE_TTL", "600"))
+
+# Cambia con cada deploy, no con cada proceso: todos los workers (y los que se reciclan)
+# dan el mismo ETag, y templates nuevos no sirven 304 viejos. BUILD_ID si el deploy lo
+# define; si no, un hash del contenido de templates/
+def _version_despliegue(directorio: str = "templates") -> str:
+    if os.getenv("BUILD_ID"):
+        return os.environ["BUILD_ID"]
+    h = hashlib.sha256()
+    for raiz, carpetas, archivos in os.walk(directorio):
+        carpetas.sort()
+        for nombre in sorted(archivos):
+            ruta = os.path.join(raiz, nombre)
+            h.update(os.path.relpath(ruta, directorio).encode())
+            with open(ruta, "rb") as f:
+                h.update(f.read())
+    return h.hexdigest()[:12]
+
+_DESPLIEGUE = _version_despliegue()
+
+cache_versiones = CachePorUsuario(10000, DATOS_VERSION_TTL)
+cache_paginas = CachePorUsuario(PAGINAS_CACHE_TAMANO, PAGINAS_CACHE_TTL)
+
+
+@cambios.suscribir
+def _invalidar(usuarios):
+    for usuario_id in usuarios:
+        cache_versiones.invalidar_usuario(usuario_id)
+        cache_paginas.invalidar_usuario(usuario_id)
+
+
+async def version_datos(usuario_id: int) -> int:
+    version = cache_versiones.obtener(usuario_id)
+    if version is None:
+        # Un commit que invalide durante la consulta deja esta versión vieja: no se guarda
+        generacion = cache_versiones.generacion(usuario_id)
+        async with AsyncSession(async_engine_lectura) as session:
+            version = (await session.exec(
+                select(Usuario.version_datos).where(Usuario.id == usuario_id)
+            )).first() or 0
+        cache_versiones.guardar(usuario_id, usuario_id, version, generacion=generacion)
+    return version
+
+def condicional(ruta):
+    # Decorador para rutas GET que reciben `request` y `user` y devuelven un TemplateResponse.
+    # El mes actual entra en el ETag porque las páginas muestran el mes en curso por defecto
+    @functools.wraps(ruta)
+    async def envoltura(*args, **kwargs):
+        request, user = kwargs["request"], kwargs["user"]
+        if not user:
+            return await ruta(*args, **kwargs)
+        version = await version_datos(user.id)
+        mes = current_month_str()
+        cabeceras = {"ETag": f'W/"{_DESPLIEGUE}-{user.id}-{version}-{mes}"', "Cache-Control": "private, no-cache"}
+        if etag_coincide(request.headers.get("if-none-match"), cabeceras["ETag"]):
+            return Response(status_code=304, headers=cabeceras)
+
+        clave = (user.id, version, mes, request.url.path, str(request.query_params))
+        html = cache_paginas.obtener(clave)
+        if html is None:
+            respuesta = await ruta(*args, **kwargs)
+            if respuesta.status_code != 200 or not isinstance(respuesta, HTMLResponse):
+                return respuesta  # redirecciones y errores no se cachean
+            html = respuesta.body
+            cache_paginas.guardar(clave, user.id, html)
+        return HTMLResponse(html, headers=cabeceras)
+    return envoltura
@@ -0,0 +1,180 @@
+from fastapi import APIRouter, Depends, File, Form, HTTPException, Query, Request, UploadFile
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import JSONResponse, Response
+from sqlmodel import Session, select
+from typing import Optional
+from .. import busqueda, masivas, series, sync
+from ..cache import etag_coincide
+from ..database import engine, get_async_read_session, get_async_session
+from ..importacion import ImportacionInvalida, importar, leer_extracto
+from ..models import Transaccion
+from ..paginacion import TAMANO_PAGINA, LIMITE_MAXIMO, paginar
+from ..schemas import (
+    FusionarCuentas, IdsTransacciones, MoverTransacciones, PaginaCambios, PaginaTransacciones,
+    PushTransacciones, RecategorizarTransacciones, ResultadoMasivo, ResultadoPush,
+)
+from ..security import get_current_user
+
+router = APIRouter(prefix="/api", tags=["api"])
+
+
+@router.get("/transacciones", response_model=PaginaTransacciones)
+async def listar_transacciones(
+    request: Request,
+    mes: Optional[str] = None,
+    cuenta_id: Optional[int] = None,
+    tipo: Optional[str] = None,
+    categoria: Optional[str] = None,
+    cursor: Optional[str] = None,
+    limite: int = Query(TAMANO_PAGINA, ge=1, le=LIMITE_MAXIMO),
+    session=Depends(get_async_read_session),
+    user=Depends(get_current_user)
+):
+    if not user:
+        raise HTTPException(status_code=401, detail="No autenticado")
+
+    stmt = select(Transaccion).where(Transaccion.usuario_id == user.id)
+    if mes:
+        stmt = stmt.where(Transaccion.mes == mes)
+    if cuenta_id is not None:
+        stmt = stmt.where(Transaccion.cuenta_id == cuenta_id)
+    if tipo:
+        stmt = stmt.where(Transaccion.tipo == tipo)
+    if categoria:
+        stmt = stmt.where(Transaccion.categoria == categoria)
+
+    try:
+        items, siguiente = await session.run_sync(paginar, stmt, cursor, limite)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    return {"items": items, "siguiente_cursor": siguiente}
+
+
+@router.get("/series")
+async def obtener_series(
+    request: Request,
+    granularidad: str = Query("mes", pattern="^(dia|semana|mes)$"),
+    desde: Optional[str] = None,
+    hasta: Optional[str] = None,
+    cuenta_id: Optional[int] = None,
+    categoria: Optional[str] = None,
+    ventana: int = Query(3, ge=1, le=52),
+    session=Depends(get_async_read_session),
+    user=Depends(get_current_user)
+):
+    if not user:
+        raise HTTPException(status_code=401, detail="No autenticado")
+
+    inicio, fin = series.rango(granularidad, busqueda.fecha_o_none(desde), busqueda.fecha_o_none(hasta))
+    if inicio > fin:
+        raise HTTPException(status_code=400, detail="Rango de fechas inválido")
+    if len(series.periodos(granularidad, inicio, fin)) > series.SERIES_MAX_PERIODOS:
+        raise HTTPException(status_code=400, detail=f"El rango supera {series.SERIES_MAX_PERIODOS} períodos")
+
+    clave = (user.id, granularidad, inicio, fin, cuenta_id, categoria, ventana)
+    guardado = series.cache_series.obtener(clave)
+    if guardado is None:
+        datos = await session.run_sync(
+            series.calcular_series, user.id, granularidad, inicio, fin, cuenta_id, categoria, ventana
+        )
+        guardado = (series.etag(datos), datos)
+        series.cache_series.guardar(clave, user.id, guardado)
+    etiqueta, datos = guardado
+
+    cabeceras = {"ETag": etiqueta, "Cache-Control": "private, no-cache"}
+    if etag_coincide(request.headers.get("if-none-match"), etiqueta):
+        return Response(status_code=304, headers=cabeceras)
+    return JSONResponse(datos, headers=cabeceras)
+
+
+@router.get("/sync", response_model=PaginaCambios)
+async def sincronizar(
+    since: int = Query(0, ge=0),
+    limite: int = Query(sync.SYNC_PAGINA, ge=1, le=sync.SYNC_PAGINA_MAXIMA),
+    session=Depends(get_async_read_session),
+    user=Depends(get_current_user)
+):
+    # Cambios compactados después de `since`; repetir con `siguiente` mientras `mas` sea true
+    if not user:
+        raise HTTPException(status_code=401, detail="No autenticado")
+    items, siguiente, mas = await session.run_sync(sync.cambios_desde, user.id, since, limite)
+    return {"items": items, "siguiente": siguiente, "mas": mas}
+
+
+@router.post("/sync/push", response_model=ResultadoPush)
+async def sincronizar_push(
+    cuerpo: PushTransacciones,
+    session=Depends(get_async_session),
+    user=Depends(get_current_user)
+):
+    # Transacciones creadas offline, todas en un commit; cada una con su clave de idempotencia
+    if not user:
+        raise HTTPException(status_code=401, detail="No autenticado")
+    if not cuerpo.transacciones:
+        return {"items": []}
+    try:
+        items = await session.run_sync(sync.aplicar_push, user.id, cuerpo.transacciones)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"items": items}
+
+
+# ---------- Operaciones masivas ----------
+async def _masiva(session, user, fn, *args) -> dict:
+    # Una transacción por operación; ValueError (cuenta ajena, filtro vacío) → 400
+    if not user:
+        raise HTTPException(status_code=401, detail="No autenticado")
+    try:
+        afectadas = await session.run_sync(fn, user.id, *args)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    await session.commit()
+    return {"afectadas": afectadas}
+
+@router.post("/transacciones/eliminar", response_model=ResultadoMasivo)
+async def eliminar_transacciones(cuerpo: IdsTransacciones, session=Depends(get_async_session), user=Depends(get_current_user)):
+    # Los ids ajenos o inexistentes se ignoran
+    return await _masiva(session, user, masivas.eliminar_transacciones, cuerpo.ids)
+
+@router.post("/transacciones/mover", response_model=ResultadoMasivo)
+async def mover_transacciones(cuerpo: MoverTransacciones, session=Depends(get_async_session), user=Depends(get_current_user)):
+    return await _masiva(session, user, masivas.mover_transacciones, cuerpo.ids, cuerpo.cuenta_id)
+
+@router.post("/transacciones/recategorizar", response_model=ResultadoMasivo)
+async def recategorizar_transacciones(cuerpo: RecategorizarTransacciones, session=Depends(get_async_session), user=Depends(get_current_user)):
+    filtro = cuerpo.filtro.model_dump(exclude_none=True)
+    return await _masiva(session, user, masivas.recategorizar, filtro, cuerpo.categoria, cuerpo.subcategoria)
+
+@router.post("/cuentas/{cuenta_id}/fusionar", response_model=ResultadoMasivo)
+async def fusionar_cuentas(cuenta_id: int, cuerpo: FusionarCuentas, session=Depends(get_async_session), user=Depends(get_current_user)):
+    # afectadas = transacciones que pasaron a la cuenta de destino
+    return await _masiva(session, user, masivas.fusionar_cuentas, cuenta_id, cuerpo.destino)
+
+
+@router.post("/importar")
+async def importar_extracto(
+    cuenta_id: int = Form(...),
+    archivo: UploadFile = File(...),
+    user=Depends(get_current_user)
+):
+    # Extracto bancario CSV u OFX; reimportar el mismo archivo no duplica filas
+    if not user:
+        raise HTTPException(status_code=401, detail="No autenticado")
+
+    def ejecutar():
+        # Lectura del archivo e inserción por lotes en un hilo: no bloquea el event loop
+        with Session(engine) as session:
+            filas = leer_extracto(archivo.file, archivo.filename or "")
+            return importar(session, user.id, cuenta_id, filas)
+
+    try:
+        resultado = await run_in_threadpool(ejecutar)
+    except ImportacionInvalida as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {
+        "leidas": resultado.leidas,
+        "insertadas": resultado.insertadas,
+        "duplicadas": resultado.duplicadas,
+        "lotes": resultado.lotes,
+    }
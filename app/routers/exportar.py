@@ -0,0 +1,150 @@
+import csv
+import io
+import os
+import tempfile
+from datetime import date
+from typing import Optional
+from fastapi import APIRouter, Depends, HTTPException
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import FileResponse, StreamingResponse
+from sqlmodel import select
+from starlette.background import BackgroundTask
+from .. import busqueda
+from ..database import async_engine_lectura, engine_lectura
+from ..formato import cop
+from ..models import Cuenta, Transaccion
+from ..security import get_current_user
+
+# Exportación de transacciones. Las filas salen de un cursor del lado del servidor por
+# lotes de LOTE_EXPORTACION, así que la memoria no depende de cuántas tenga el usuario.
+LOTE_EXPORTACION = int(os.getenv("LOTE_EXPORTACION", "1000"))
+
+COLUMNAS = ["fecha", "mes", "tipo", "categoria", "subcategoria", "cuenta", "monto", "monto_cop", "factura_url"]
+
+router = APIRouter(prefix="/export", tags=["export"])
+
+
+def _consulta(usuario_id: int, q, desde, hasta, cuenta_id, tipo, mes=None, todos=False, monto_min=None, monto_max=None):
+    # Mismos filtros que la lista de /transacciones (el formulario de búsqueda exporta lo
+    # que se ve). Sin mes, todo el historial
+    stmt = (
+        select(
+            Transaccion.fecha, Transaccion.mes, Transaccion.tipo, Transaccion.categoria,
+            Transaccion.subcategoria, Cuenta.nombre, Transaccion.monto, Transaccion.factura_url,
+        )
+        .join(Cuenta, Cuenta.id == Transaccion.cuenta_id)
+        .where(Transaccion.usuario_id == usuario_id)
+    )
+    if cuenta_id is not None:
+        stmt = stmt.where(Transaccion.cuenta_id == cuenta_id)
+    if tipo:
+        stmt = stmt.where(Transaccion.tipo == tipo)
+    if mes and not todos:
+        stmt = stmt.where(Transaccion.mes == mes)
+    stmt = busqueda.filtrar(
+        stmt, engine_lectura, q=q, desde=busqueda.fecha_o_none(desde), hasta=busqueda.fecha_o_none(hasta),
+        monto_min=busqueda.numero_o_none(monto_min), monto_max=busqueda.numero_o_none(monto_max),
+    )
+    return stmt.order_by(Transaccion.fecha, Transaccion.id).execution_options(yield_per=LOTE_EXPORTACION)
+
+def _fila(r) -> list:
+    fecha, mes, tipo, categoria, subcategoria, cuenta, monto, factura_url = r
+    return [
+        fecha.strftime("%Y-%m-%d %H:%M"), mes, tipo, categoria, subcategoria or "",
+        cuenta, f"{monto:.2f}", cop(monto), factura_url or "",
+    ]
+
+def _nombre(extension: str) -> str:
+    return f"transacciones-{date.today().isoformat()}.{extension}"
+
+
+# ---------- CSV ----------
+async def _filas_csv(stmt):
+    salida = io.StringIO()
+    escritor = csv.writer(salida)
+    # BOM para que Excel abra el archivo como UTF-8 (tildes y ñ)
+    salida.write("\ufeff")
+    escritor.writerow(COLUMNAS)
+    yield salida.getvalue().encode("utf-8")
+    async with async_engine_lectura.connect() as conn:
+        result = await conn.stream(stmt)
+        async for lote in result.partitions(LOTE_EXPORTACION):
+            salida.seek(0)
+            salida.truncate()
+            escritor.writerows(_fila(r) for r in lote)
+            yield salida.getvalue().encode("utf-8")
+
+@router.get("/transacciones.csv")
+async def exportar_csv(
+    q: Optional[str] = None,
+    desde: Optional[str] = None,
+    hasta: Optional[str] = None,
+    cuenta_id: Optional[int] = None,
+    tipo: Optional[str] = None,
+    mes: Optional[str] = None,
+    todos: bool = False,
+    monto_min: Optional[str] = None,
+    monto_max: Optional[str] = None,
+    user=Depends(get_current_user),
+):
+    if not user:
+        raise HTTPException(status_code=401, detail="No autenticado")
+    # La conexión se abre dentro del generador: vive lo que dura la descarga
+    stmt = _consulta(user.id, q, desde, hasta, cuenta_id, tipo, mes, todos, monto_min, monto_max)
+    return StreamingResponse(
+        _filas_csv(stmt),
+        media_type="text/csv; charset=utf-8",
+        headers={"Content-Disposition": f'attachment; filename="{_nombre("csv")}"'},
+    )
+
+
+# ---------- XLSX ----------
+def _escribir_xlsx(stmt, ruta: str):
+    # openpyxl en modo write_only vuelca cada fila a disco; el cursor trae los datos por lotes
+    from openpyxl import Workbook
+
+    libro = Workbook(write_only=True)
+    hoja = libro.create_sheet("Transacciones")
+    hoja.append(COLUMNAS)
+    with engine_lectura.connect() as conn:
+        result = conn.execution_options(stream_results=True).execute(stmt)
+        for lote in result.partitions(LOTE_EXPORTACION):
+            for r in lote:
+                fila = _fila(r)
+                fila[6] = r.monto  # numérico para que Excel pueda sumar
+                hoja.append(fila)
+    libro.save(ruta)
+
+@router.get("/transacciones.xlsx")
+async def exportar_xlsx(
+    q: Optional[str] = None,
+    desde: Optional[str] = None,
+    hasta: Optional[str] = None,
+    cuenta_id: Optional[int] = None,
+    tipo: Optional[str] = None,
+    mes: Optional[str] = None,
+    todos: bool = False,
+    monto_min: Optional[str] = None,
+    monto_max: Optional[str] = None,
+    user=Depends(get_current_user),
+):
+    if not user:
+        raise HTTPException(status_code=401, detail="No autenticado")
+    try:
+        import openpyxl  # noqa: F401
+    except ImportError:
+        raise HTTPException(status_code=501, detail="Exportación a Excel no disponible (falta openpyxl)")
+    stmt = _consulta(user.id, q, desde, hasta, cuenta_id, tipo, mes, todos, monto_min, monto_max)
+    fd, ruta = tempfile.mkstemp(prefix="export-", suffix=".xlsx")
+    os.close(fd)
+    try:
+        await run_in_threadpool(_escribir_xlsx, stmt, ruta)
+    except BaseException:
+        os.remove(ruta)
+        raise
+    return FileResponse(
+        ruta,
+        media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+        filename=_nombre("xlsx"),
+        background=BackgroundTask(os.remove, ruta),
+    )
@@ -1,36 +1,43 @@
-from fastapi import APIRouter, UploadFile, File, HTTPException, Request
-from supabase import Client
+from fastapi import APIRouter, UploadFile, File, HTTPException, Request, Depends
 from datetime import datetime
-import uuid
+from ..cola_facturas import subir_con_reintentos
+from ..database import get_async_session
+from ..models import Factura
+from ..security import get_current_user
+from .. import facturas
+from ..facturas import leer_factura, descartar, FacturaDemasiadoGrande, FacturaInvalida, ESTADO_SUBIDA
 
 router = APIRouter(prefix="/uploads", tags=["uploads"])  # Opcional: buen prefijo
 
 
 @router.post("/upload-factura")
-async def upload_factura(request: Request, file: UploadFile = File(...)):  # ← Agregamos request
-    # Validar tipo
-    if file.content_type not in ["image/png", "image/jpeg", "image/jpg", "application/pdf"]:
-        raise HTTPException(status_code=400, detail="Formato no permitido. Solo JPG, PNG y PDF.")
-
-    # Nombre único
-    unique_name = f"{uuid.uuid4()}-{file.filename}"
-
+async def upload_factura(request: Request, file: UploadFile = File(...), session=Depends(get_async_session), user=Depends(get_current_user)):  # ← Agregamos request
+    # Sube al almacenamiento y deja una referencia permanente: solo usuarios autenticados
+    if not user:
+        raise HTTPException(status_code=401, detail="No autenticado")
+    # Leer por trozos: valida tipo real (JPG, PNG, PDF) y tamaño máximo sin cargarlo en memoria
     try:
-        # Leemos el archivo
-        file_data = await file.read()
-
-        # Accedemos al cliente de Supabase desde app.state
-        supabase_client: Client = request.app.state.supabase
+        leida = await leer_factura(file)
+    except FacturaDemasiadoGrande as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except FacturaInvalida as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
-        # Subir al bucket "facturas"
-        supabase_client.storage.from_("facturas").upload(
-            path=unique_name,
-            file=file_data,
-            file_options={"content-type": file.content_type}
-        )
-
-        # Crear URL pública
-        public_url = supabase_client.storage.from_("facturas").get_public_url(unique_name)
+    try:
+        # Guardada por contenido: si ya estaba subida no se vuelve a enviar
+        existente = await session.get(Factura, leida.sha256)
+        if existente and existente.estado == ESTADO_SUBIDA:
+            public_url = existente.url
+        else:
+            # Subir al almacenamiento de facturas (fuera del event loop, con reintentos)
+            public_url = await subir_con_reintentos(
+                request.app.state.almacenamiento,
+                leida.ruta,
+                leida.archivo,
+                leida.content_type
+            )
+        await session.run_sync(facturas.registrar_subida, leida, public_url)
+        await session.commit()
 
         return {
             "message": "Factura subida exitosamente",
@@ -39,3 +46,5 @@ async def upload_factura(request: Request, file: UploadFile = File(...)):  # ←
 
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error al subir la factura: {str(e)}")
+    finally:
+        descartar(leida.archivo)
@@ -1,6 +1,95 @@
-from pydantic import BaseModel
-from typing import Optional
+from pydantic import BaseModel, ConfigDict, Field
+from typing import Literal, Optional, List
+from datetime import date, datetime
+from decimal import Decimal
+from .dinero import MONTO_MAXIMO
 
 class TokenData(BaseModel):
     sub: Optional[str] = None
 
+
+class TransaccionOut(BaseModel):
+    model_config = ConfigDict(from_attributes=True)
+
+    id: int
+    monto: float  # en JSON como número; en la app es Decimal exacto
+    moneda: str
+    tipo: str
+    categoria: str
+    subcategoria: Optional[str] = None
+    fecha: datetime
+    mes: str
+    cuenta_id: int
+    factura_url: Optional[str] = None
+    factura_estado: Optional[str] = None
+    factura_miniatura_url: Optional[str] = None
+
+class PaginaTransacciones(BaseModel):
+    items: List[TransaccionOut]
+    siguiente_cursor: Optional[str] = None
+
+
+# ---------- Sincronización (/api/sync) ----------
+class CambioOut(BaseModel):
+    seq: int
+    entidad: str  # transaccion / cuenta / limitemensual
+    id: int
+    operacion: str  # upsert / delete
+    datos: Optional[dict] = None  # estado actual de la fila; None si se eliminó
+
+class PaginaCambios(BaseModel):
+    items: List[CambioOut]
+    siguiente: int  # usar como since en la próxima llamada
+    mas: bool
+
+class TransaccionPush(BaseModel):
+    clave: str = Field(min_length=1, max_length=100)  # clave de idempotencia generada por el cliente
+    monto: Decimal = Field(gt=0, le=MONTO_MAXIMO, decimal_places=2)
+    tipo: Literal["ingreso", "gasto", "deuda"]
+    categoria: Literal["fijo", "variable"]
+    subcategoria: Optional[str] = None
+    fecha: Optional[datetime] = None
+    cuenta_id: int
+
+class PushTransacciones(BaseModel):
+    transacciones: List[TransaccionPush] = Field(max_length=1000)
+
+class ResultadoPushItem(BaseModel):
+    clave: str
+    id: int
+    creada: bool  # False si esa clave ya se había aplicado
+
+class ResultadoPush(BaseModel):
+    items: List[ResultadoPushItem]
+
+
+# ---------- Operaciones masivas ----------
+MAXIMO_IDS = 5000
+
+class IdsTransacciones(BaseModel):
+    ids: List[int] = Field(min_length=1, max_length=MAXIMO_IDS)
+
+class MoverTransacciones(IdsTransacciones):
+    cuenta_id: int  # cuenta de destino
+
+class FiltroTransacciones(BaseModel):
+    # Se combinan con AND; al menos uno
+    ids: Optional[List[int]] = Field(default=None, min_length=1, max_length=MAXIMO_IDS)
+    cuenta_id: Optional[int] = None
+    mes: Optional[str] = Field(default=None, pattern=r"^\d{4}-\d{2}$")
+    tipo: Optional[Literal["ingreso", "gasto", "deuda"]] = None
+    categoria: Optional[Literal["fijo", "variable"]] = None
+    subcategoria: Optional[str] = None  # "" = sin subcategoría
+    desde: Optional[date] = None
+    hasta: Optional[date] = None
+
+class RecategorizarTransacciones(BaseModel):
+    filtro: FiltroTransacciones
+    categoria: Optional[Literal["fijo", "variable"]] = None
+    subcategoria: Optional[str] = Field(default=None, max_length=100)  # "" la quita
+
+class FusionarCuentas(BaseModel):
+    destino: int
+
+class ResultadoMasivo(BaseModel):
+    afectadas: int
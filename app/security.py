@@ -1,28 +1,108 @@
+import asyncio
 import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
 from datetime import datetime, timedelta
-from typing import Optional
+from typing import Optional, Tuple
 from jose import jwt, JWTError
 from passlib.context import CryptContext
-from fastapi import Request, Depends
-from sqlmodel import Session, select
+from fastapi import Request
+from sqlalchemy import event
+from sqlmodel.ext.asyncio.session import AsyncSession
+from .cache import CachePorUsuario
 from .models import Usuario
-from .database import get_session
+from .database import async_engine_lectura
 
 SECRET_KEY = os.getenv("SECRET_KEY", "CHANGE_ME_TO_A_VERY_SECURE_RANDOM_KEY_PLEASE")  # ¡Cámbialo en producción!
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 60  # Puedes dejarlo en env si quieres
 
+# Caché de token verificado → usuario, para no decodificar el JWT ni consultar la base en cada página
+AUTH_CACHE_TAMANO = int(os.getenv("AUTH_CACHE_TAMANO", "1024"))
+AUTH_CACHE_TTL = float(os.getenv("AUTH_CACHE_TTL", "60"))  # segundos
+
+# Parámetros de Argon2 (ajustables sin tocar código). Si cambian, los hashes viejos se
+# regeneran con los nuevos en el siguiente login correcto
+ARGON2_TIME_COST = int(os.getenv("ARGON2_TIME_COST", "3"))
+ARGON2_MEMORY_COST = int(os.getenv("ARGON2_MEMORY_COST", "65536"))  # KiB
+ARGON2_PARALLELISM = int(os.getenv("ARGON2_PARALLELISM", "4"))
+
+# Hilos dedicados al hash (argon2 libera el GIL) y cuántos pedidos pueden esperar turno
+# antes de rechazar con 503: una ráfaga de logins no le quita hilos al resto de rutas
+HASH_TRABAJADORES = int(os.getenv("HASH_TRABAJADORES", "2"))
+HASH_MAX_COLA = int(os.getenv("HASH_MAX_COLA", "64"))
+
 # Cambiamos a Argon2 como principal (más seguro), con bcrypt como fallback para hashes antiguos (si tienes usuarios previos)
 pwd_context = CryptContext(
     schemes=["argon2", "bcrypt"],
-    deprecated="auto"  # Automáticamente migrará hashes bcrypt a argon2 al próximo login
+    deprecated="auto",  # Automáticamente migrará hashes bcrypt a argon2 al próximo login
+    argon2__time_cost=ARGON2_TIME_COST,
+    argon2__memory_cost=ARGON2_MEMORY_COST,
+    argon2__parallelism=ARGON2_PARALLELISM,
 )
 
-def get_password_hash(password: str) -> str:
-    return pwd_context.hash(password)
 
-def verify_password(plain: str, hashed: str) -> bool:
-    return pwd_context.verify(plain, hashed)
+# ---------- Hash de contraseñas fuera del event loop ----------
+class HashSaturado(Exception):
+    pass
+
+
+class EjecutorHash:
+    # Pool de hilos propio para argon2/bcrypt con una cola acotada y contadores para /metrics
+    def __init__(self, trabajadores: int = HASH_TRABAJADORES, max_cola: int = HASH_MAX_COLA):
+        self.trabajadores = trabajadores
+        self.max_cola = max_cola
+        self._pool = ThreadPoolExecutor(max_workers=trabajadores, thread_name_prefix="hash")
+        self._lock = threading.Lock()
+        self.en_cola = 0
+        self.en_curso = 0
+        self.completados = 0
+        self.rechazados = 0
+        self.segundos = 0.0
+
+    async def ejecutar(self, fn, *args):
+        with self._lock:
+            if self.en_cola + self.en_curso >= self.trabajadores + self.max_cola:
+                self.rechazados += 1
+                raise HashSaturado()
+            self.en_cola += 1
+        return await asyncio.wrap_future(self._pool.submit(self._medir, fn, *args))
+
+    def _medir(self, fn, *args):
+        with self._lock:
+            self.en_cola -= 1
+            self.en_curso += 1
+        inicio = time.perf_counter()
+        try:
+            return fn(*args)
+        finally:
+            with self._lock:
+                self.en_curso -= 1
+                self.completados += 1
+                self.segundos += time.perf_counter() - inicio
+
+    def metricas(self) -> dict:
+        with self._lock:
+            return {
+                "en_cola": self.en_cola,
+                "en_curso": self.en_curso,
+                "completados": self.completados,
+                "rechazados": self.rechazados,
+                "segundos": self.segundos,
+            }
+
+
+ejecutor_hash = EjecutorHash()
+
+async def hashear_password(password: str) -> str:
+    return await ejecutor_hash.ejecutar(pwd_context.hash, password)
+
+async def verificar_password(plain: str, hashed: str) -> Tuple[bool, Optional[str]]:
+    # Devuelve (válida, hash nuevo); el hash nuevo viene solo si el guardado usa un
+    # esquema o parámetros viejos y hay que reemplazarlo
+    return await ejecutor_hash.ejecutar(pwd_context.verify_and_update, plain, hashed)
 
 def crear_token(data: dict, expires_delta: Optional[timedelta] = None) -> str:
     to_encode = data.copy()
@@ -42,19 +122,52 @@ def _get_token_from_request(request: Request) -> Optional[str]:
         return auth.split(" ", 1)[1].strip()
     return request.cookies.get("access_token")
 
-def get_user_from_request(request: Request, session: Session = Depends(get_session)) -> Optional[Usuario]:
-    token = _get_token_from_request(request)
-    if not token:
-        return None
-    payload = decode_token(token)
+def _user_id_from_payload(payload: Optional[dict]) -> Optional[int]:
     if not payload:
         return None
     user_id = payload.get("sub")
     if not user_id:
         return None
     try:
-        user_id_int = int(user_id)
+        return int(user_id)
     except ValueError:
         return None
-    user = session.exec(select(Usuario).where(Usuario.id == user_id_int)).first()
+
+# ---------- Usuario actual (una vez por petición, con caché) ----------
+@dataclass(frozen=True)
+class UsuarioSesion:
+    # Copia sin sesión de la base de lo que las rutas y templates necesitan del usuario
+    id: int
+    email: str
+
+
+# Token verificado → UsuarioSesion
+cache_usuarios = CachePorUsuario(AUTH_CACHE_TAMANO, AUTH_CACHE_TTL)
+
+@event.listens_for(Usuario, "after_update")
+@event.listens_for(Usuario, "after_delete")
+def _invalidar_usuario_modificado(mapper, connection, target):
+    cache_usuarios.invalidar_usuario(target.id)
+
+async def get_current_user(request: Request) -> Optional[UsuarioSesion]:
+    # Dependencia de todas las rutas autenticadas: resuelve el usuario una sola vez por
+    # petición (queda en request.state.user) y solo va a la base si el token no está en caché
+    if hasattr(request.state, "user"):
+        return request.state.user
+    user = None
+    token = _get_token_from_request(request)
+    if token:
+        user = cache_usuarios.obtener(token)
+        if user is None:
+            payload = decode_token(token)
+            user_id = _user_id_from_payload(payload)
+            if user_id is not None:
+                async with AsyncSession(async_engine_lectura) as session:
+                    usuario = await session.get(Usuario, user_id)
+                if usuario:
+                    user = UsuarioSesion(id=usuario.id, email=usuario.email)
+                    # La entrada nunca dura más que el token
+                    exp = payload.get("exp")
+                    cache_usuarios.guardar(token, user.id, user, exp - time.time() if exp else None)
+    request.state.user = user
     return user
\ No newline at end of file
@@ -0,0 +1,173 @@
+import hashlib
+import json
+import os
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+from itertools import accumulate
+from typing import Dict, List, Optional, Tuple
+from sqlalchemy import case, func
+from sqlmodel import Session, select
+from .cache import CachePorUsuario
+from .dinero import CERO
+from .models import Cuenta, Transaccion
+from . import cambios
+
+# Series para gráficos (/api/series): ingreso/gasto/deuda por día, semana o mes, en
+# total, por cuenta y por categoría, más saldo acumulado y promedio móvil. Una sola
+# consulta agrupada hace el trabajo pesado; el resto son sumas prefijas sobre listas.
+# El resultado se guarda por (usuario, rango, granularidad, filtros) con su ETag y se
+# invalida cuando cambian los datos del usuario (ver app/cambios.py).
+GRANULARIDADES = ("dia", "semana", "mes")
+TIPOS = ("ingreso", "gasto", "deuda")
+RANGO_DEFECTO = {"dia": timedelta(days=89), "semana": timedelta(weeks=25), "mes": timedelta(days=365)}
+SERIES_MAX_PERIODOS = 1000
+SERIES_CACHE_TAMANO = int(os.getenv("SERIES_CACHE_TAMANO", "512"))
+SERIES_CACHE_TTL = float(os.getenv("SERIES_CACHE_TTL", "300"))  # segundos
+
+cache_series = CachePorUsuario(SERIES_CACHE_TAMANO, SERIES_CACHE_TTL)
+
+
+@cambios.suscribir
+def _invalidar(usuarios):
+    for usuario_id in usuarios:
+        cache_series.invalidar_usuario(usuario_id)
+
+
+# ---------- Períodos ----------
+def rango(granularidad: str, desde: Optional[date], hasta: Optional[date]) -> Tuple[date, date]:
+    # Ajusta el rango para que el primer y el último período queden completos
+    hasta = hasta or date.today()
+    desde = desde or hasta - RANGO_DEFECTO[granularidad]
+    if granularidad == "semana":
+        desde -= timedelta(days=desde.weekday())
+        hasta += timedelta(days=6 - hasta.weekday())
+    elif granularidad == "mes":
+        desde = desde.replace(day=1)
+        siguiente = (hasta.replace(day=1) + timedelta(days=32)).replace(day=1)
+        hasta = siguiente - timedelta(days=1)
+    return desde, hasta
+
+def periodos(granularidad: str, desde: date, hasta: date) -> List[str]:
+    if granularidad == "mes":
+        resultado = []
+        anio, mes = desde.year, desde.month
+        while (anio, mes) <= (hasta.year, hasta.month):
+            resultado.append(f"{anio:04d}-{mes:02d}")
+            anio, mes = (anio + 1, 1) if mes == 12 else (anio, mes + 1)
+        return resultado
+    paso = timedelta(weeks=1) if granularidad == "semana" else timedelta(days=1)
+    resultado = []
+    actual = desde
+    while actual <= hasta:
+        resultado.append(actual.isoformat())
+        actual += paso
+    return resultado
+
+def _expresion_periodo(granularidad: str, dialecto: str):
+    # Misma etiqueta que periodos(): 'YYYY-MM' o la fecha ISO del día / lunes de la semana
+    if granularidad == "mes":
+        return Transaccion.mes
+    if dialecto == "sqlite":
+        if granularidad == "semana":
+            return func.date(Transaccion.fecha, "weekday 0", "-6 days")
+        return func.date(Transaccion.fecha)
+    if granularidad == "semana":
+        return func.to_char(func.date_trunc("week", Transaccion.fecha), "YYYY-MM-DD")
+    return func.to_char(Transaccion.fecha, "YYYY-MM-DD")
+
+
+# ---------- Cálculo ----------
+def _filtros(stmt, usuario_id: int, cuenta_id: Optional[int], categoria: Optional[str]):
+    stmt = stmt.where(Transaccion.usuario_id == usuario_id)
+    if cuenta_id is not None:
+        stmt = stmt.where(Transaccion.cuenta_id == cuenta_id)
+    if categoria:
+        stmt = stmt.where(Transaccion.categoria == categoria)
+    return stmt
+
+def promedio_movil(valores: List[Decimal], ventana: int) -> List[Decimal]:
+    # Con sumas prefijas: O(n) sin importar el tamaño de la ventana
+    prefijos = [CERO, *accumulate(valores)]
+    return [
+        (prefijos[i + 1] - prefijos[max(0, i + 1 - ventana)]) / min(i + 1, ventana)
+        for i in range(len(valores))
+    ]
+
+def _redondear(valores: List[Decimal]) -> List[float]:
+    # Las sumas son exactas (Decimal); a float solo para el JSON
+    return [float(round(v, 2)) for v in valores]
+
+def calcular_series(
+    session: Session,
+    usuario_id: int,
+    granularidad: str,
+    desde: date,
+    hasta: date,
+    cuenta_id: Optional[int] = None,
+    categoria: Optional[str] = None,
+    ventana: int = 3,
+) -> dict:
+    etiquetas = periodos(granularidad, desde, hasta)
+    indice = {p: i for i, p in enumerate(etiquetas)}
+    inicio = datetime.combine(desde, datetime.min.time())
+    fin = datetime.combine(hasta + timedelta(days=1), datetime.min.time())
+    periodo = _expresion_periodo(granularidad, session.get_bind().dialect.name)
+
+    filas = session.exec(
+        _filtros(
+            select(periodo, Transaccion.cuenta_id, Transaccion.categoria, Transaccion.tipo, func.sum(Transaccion.monto)),
+            usuario_id, cuenta_id, categoria,
+        )
+        .where(Transaccion.fecha >= inicio)
+        .where(Transaccion.fecha < fin)
+        .group_by(periodo, Transaccion.cuenta_id, Transaccion.categoria, Transaccion.tipo)
+    ).all()
+    # Saldo antes del rango, para que el acumulado arranque donde corresponde
+    saldo_inicial = session.exec(
+        _filtros(
+            select(func.coalesce(func.sum(case((Transaccion.tipo == "ingreso", Transaccion.monto), else_=-Transaccion.monto)), 0)),
+            usuario_id, cuenta_id, categoria,
+        )
+        .where(Transaccion.fecha < inicio)
+    ).one()
+    nombres = dict(session.exec(select(Cuenta.id, Cuenta.nombre).where(Cuenta.usuario_id == usuario_id)).all())
+
+    n = len(etiquetas)
+    vacio = lambda: {t: [CERO] * n for t in TIPOS}
+    totales = vacio()
+    por_cuenta: Dict[int, Dict[str, List[Decimal]]] = {}
+    por_categoria: Dict[str, Dict[str, List[Decimal]]] = {}
+    for etiqueta, cid, cat, tipo, suma in filas:
+        i = indice.get(str(etiqueta))
+        if i is None or tipo not in TIPOS:
+            continue
+        totales[tipo][i] += suma
+        por_cuenta.setdefault(cid, vacio())[tipo][i] += suma
+        por_categoria.setdefault(cat, vacio())[tipo][i] += suma
+
+    neto = [i - g - d for i, g, d in zip(totales["ingreso"], totales["gasto"], totales["deuda"])]
+    saldo = list(accumulate(neto, initial=saldo_inicial))[1:]
+    return {
+        "granularidad": granularidad,
+        "desde": desde.isoformat(),
+        "hasta": hasta.isoformat(),
+        "periodos": etiquetas,
+        "totales": {t: _redondear(v) for t, v in totales.items()},
+        "neto": _redondear(neto),
+        "saldo_acumulado": _redondear(saldo),
+        "promedio_movil": {
+            "ventana": ventana,
+            **{t: _redondear(promedio_movil(v, ventana)) for t, v in totales.items()},
+        },
+        "por_cuenta": [
+            {"cuenta_id": cid, "nombre": nombres.get(cid, ""), **{t: _redondear(v) for t, v in series.items()}}
+            for cid, series in sorted(por_cuenta.items())
+        ],
+        "por_categoria": [
+            {"categoria": cat, **{t: _redondear(v) for t, v in series.items()}}
+            for cat, series in sorted(por_categoria.items())
+        ],
+    }
+
+def etag(datos: dict) -> str:
+    return '"' + hashlib.sha1(json.dumps(datos, sort_keys=True).encode()).hexdigest() + '"'
@@ -0,0 +1,119 @@
+from collections import Counter
+from datetime import datetime
+from typing import Dict, List, Tuple
+from sqlalchemy import func
+from sqlmodel import Session, select
+from .formato import month_for_date
+from .models import Cambio, Cuenta, LimiteMensual, Transaccion
+from .schemas import TransaccionOut, TransaccionPush
+from . import agregados
+
+# Sincronización para clientes offline. /api/sync devuelve lo que cambió después de
+# una seq del registro de cambios, compactado: una entrada por fila (la de su último
+# cambio) con el estado actual o "delete" si ya no existe. El costo depende de cuántos
+# cambios hubo desde esa seq, no del historial completo.
+# En PostgreSQL dos escrituras concurrentes del mismo usuario pueden confirmar sus seq
+# fuera de orden; conviene que el cliente pida desde un poco antes de su última seq
+# (las entradas son idempotentes). En SQLite las escrituras ya van en serie.
+SYNC_PAGINA = 500
+SYNC_PAGINA_MAXIMA = 2000
+
+
+def _datos_transaccion(tx: Transaccion) -> dict:
+    return TransaccionOut.model_validate(tx).model_dump(mode="json")
+
+def _datos_cuenta(cuenta: Cuenta) -> dict:
+    return {"id": cuenta.id, "nombre": cuenta.nombre}
+
+def _datos_limite(limite: LimiteMensual) -> dict:
+    return {"id": limite.id, "mes": limite.mes, "monto_limite": float(limite.monto_limite), "moneda": limite.moneda}
+
+_ENTIDADES = {
+    "transaccion": (Transaccion, _datos_transaccion),
+    "cuenta": (Cuenta, _datos_cuenta),
+    "limitemensual": (LimiteMensual, _datos_limite),
+}
+
+
+def cambios_desde(session: Session, usuario_id: int, since: int, limite: int = SYNC_PAGINA) -> Tuple[List[dict], int, bool]:
+    # Devuelve (items, siguiente since, hay más)
+    ultimo = func.max(Cambio.seq)
+    grupos = session.exec(
+        select(Cambio.entidad, Cambio.entidad_id, ultimo)
+        .where(Cambio.usuario_id == usuario_id)
+        .where(Cambio.seq > since)
+        .group_by(Cambio.entidad, Cambio.entidad_id)
+        .order_by(ultimo)
+        .limit(limite + 1)
+    ).all()
+    mas = len(grupos) > limite
+    grupos = grupos[:limite]
+
+    # Estado actual de las filas de la página, una consulta por entidad
+    actuales: Dict[str, Dict[int, dict]] = {}
+    for entidad, (modelo, serializar) in _ENTIDADES.items():
+        ids = [i for e, i, _ in grupos if e == entidad]
+        if ids:
+            filas = session.exec(
+                select(modelo).where(modelo.usuario_id == usuario_id).where(modelo.id.in_(ids))
+            ).all()
+            actuales[entidad] = {f.id: serializar(f) for f in filas}
+
+    items = []
+    for entidad, entidad_id, seq in grupos:
+        datos = actuales.get(entidad, {}).get(entidad_id)
+        items.append({
+            "seq": seq,
+            "entidad": entidad,
+            "id": entidad_id,
+            "operacion": "upsert" if datos is not None else "delete",
+            "datos": datos,
+        })
+    siguiente = grupos[-1][2] if grupos else since
+    return items, siguiente, mas
+
+
+def aplicar_push(session: Session, usuario_id: int, transacciones: List[TransaccionPush]) -> List[dict]:
+    # Todas en una transacción. La clave del cliente va como huella (ver
+    # agregados.insertar_lote): reenviar el mismo lote no duplica nada. Dentro de un
+    # mismo lote cada clave va una sola vez: dos filas distintas con la misma clave
+    # no se pueden aplicar las dos
+    repetidas = sorted(c for c, n in Counter(t.clave for t in transacciones).items() if n > 1)
+    if repetidas:
+        raise ValueError(f"Clave repetida en el lote: {repetidas[0]}")
+    cuentas = {t.cuenta_id for t in transacciones}
+    propias = set(session.exec(
+        select(Cuenta.id).where(Cuenta.usuario_id == usuario_id).where(Cuenta.id.in_(cuentas))
+    ).all())
+    if cuentas - propias:
+        raise ValueError(f"Cuenta inválida: {min(cuentas - propias)}")
+
+    filas = {}
+    for t in transacciones:
+        fecha = t.fecha or datetime.utcnow()
+        filas[f"cliente:{t.clave}"] = {
+            "monto": t.monto,
+            "tipo": t.tipo,
+            "categoria": t.categoria,
+            "subcategoria": t.subcategoria,
+            "fecha": fecha,
+            "mes": month_for_date(fecha),
+            "usuario_id": usuario_id,
+            "cuenta_id": t.cuenta_id,
+            "huella": f"cliente:{t.clave}",
+        }
+    try:
+        creadas = set(agregados.insertar_lote(session, usuario_id, filas))
+        ids = dict(session.exec(
+            select(Transaccion.huella, Transaccion.id)
+            .where(Transaccion.usuario_id == usuario_id)
+            .where(Transaccion.huella.in_(list(filas)))
+        ).all())
+        session.commit()
+    except BaseException:
+        session.rollback()
+        raise
+    return [
+        {"clave": t.clave, "id": ids[f"cliente:{t.clave}"], "creada": f"cliente:{t.clave}" in creadas}
+        for t in transacciones
+    ]
@@ -0,0 +1,206 @@
+import argparse
+import asyncio
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+# Uso: python -m bench correr [--usuarios 5] [--transacciones 2000] [--peticiones 200] [--concurrencia 5] [--con-cache]
+#      python -m bench comparar resultados/base.json resultados/nuevo.json
+#      python -m bench arranque [--presupuesto-ms 2000]
+#
+# Cada corrida crea una base SQLite nueva con datos sintéticos (misma semilla =
+# mismos datos), corre los escenarios contra la app real y guarda el resultado en JSON.
+# Sin --con-cache la caché de páginas y la de versiones quedan apagadas: dashboard,
+# listado e historial miden el render y las consultas, no una búsqueda en memoria.
+# `arranque` mide cuánto tarda `import app.main` en un proceso limpio y falla si pasa
+# del presupuesto o si el import carga módulos pesados o toca la base.
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+ESCENARIOS = ["login", "dashboard", "listado", "busqueda", "crear_con_factura", "historial"]
+METRICAS = ["p50_ms", "p95_ms", "p99_ms", "por_segundo"]
+# Solo se cargan cuando hacen falta (primera factura, exportación a Excel, miniaturas)
+PEREZOSOS = ["supabase", "openpyxl", "PIL"]
+_IMPORTAR_APP = (
+    "import json, sys, time\n"
+    "inicio = time.perf_counter()\n"
+    "import app.main\n"
+    "print(json.dumps({'ms': (time.perf_counter() - inicio) * 1000, 'modulos': sorted(sys.modules)}))\n"
+)
+
+
+def _commit() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=RAIZ, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "desconocido"
+
+
+def cmd_correr(args) -> int:
+    escenarios = args.escenarios.split(",")
+    desconocidos = set(escenarios) - set(ESCENARIOS)
+    if desconocidos:
+        print(f"Escenarios desconocidos: {', '.join(sorted(desconocidos))}")
+        return 1
+    if args.concurrencia > args.usuarios:
+        print("La concurrencia no puede superar la cantidad de usuarios (un cliente por usuario)")
+        return 1
+
+    # La app lee su configuración al importarse: todo el entorno va antes del import
+    directorio = args.directorio or tempfile.mkdtemp(prefix="finanzas-bench-")
+    base = os.path.join(directorio, "bench.sqlite3")
+    for sufijo in ("", "-wal", "-shm"):
+        if os.path.exists(base + sufijo):
+            os.remove(base + sufijo)
+    os.environ["DATABASE_URL"] = f"sqlite:///{base}"
+    os.environ.pop("DATABASE_URL_LECTURA", None)
+    os.environ["FACTURAS_BACKEND"] = "local"  # el runner lo cambia por el cliente de Supabase falso
+    os.environ["FACTURAS_DIR"] = os.path.join(directorio, "facturas")
+    if not args.con_cache:
+        os.environ["PAGINAS_CACHE_TAMANO"] = "0"
+        os.environ["DATOS_VERSION_TTL"] = "0"
+    os.chdir(RAIZ)  # templates y static son rutas relativas
+
+    from app.database import crear_db, engine
+    from . import carga, datos
+
+    crear_db()
+    inicio = time.perf_counter()
+    usuarios = datos.generar(engine, args.usuarios, args.cuentas, args.transacciones, args.meses, args.semilla)
+    carga_datos = time.perf_counter() - inicio
+    print(f"Datos: {args.usuarios} usuarios × {args.cuentas} cuentas × {args.transacciones} transacciones en {carga_datos:.1f} s")
+
+    def progreso(escenario, r):
+        print(
+            f"{escenario:<18} p50 {r['p50_ms']:8.1f} ms  p95 {r['p95_ms']:8.1f} ms  p99 {r['p99_ms']:8.1f} ms"
+            f"  {r['por_segundo']:7.1f} req/s  errores {r['errores']}"
+        )
+
+    resultados = asyncio.run(carga.correr(
+        usuarios, escenarios, args.peticiones, args.concurrencia,
+        args.calentamiento, args.latencia_storage_ms / 1000, progreso,
+    ))
+
+    salida = args.salida or os.path.join(RAIZ, "bench", "resultados", f"{datetime.now():%Y%m%d-%H%M%S}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(salida)), exist_ok=True)
+    with open(salida, "w", encoding="utf-8") as f:
+        json.dump({
+            "fecha": datetime.now().isoformat(timespec="seconds"),
+            "commit": _commit(),
+            "python": platform.python_version(),
+            "plataforma": platform.platform(),
+            "parametros": {k: v for k, v in vars(args).items() if k != "func"},
+            "carga_datos_s": round(carga_datos, 3),
+            "escenarios": resultados,
+        }, f, indent=2, ensure_ascii=False)
+    print(f"Resultados en {salida}")
+    return 1 if any(r["errores"] for r in resultados.values()) else 0
+
+
+def cmd_comparar(args) -> int:
+    with open(args.base, encoding="utf-8") as f:
+        base = json.load(f)
+    with open(args.nuevo, encoding="utf-8") as f:
+        nuevo = json.load(f)
+    print(f"base {base['commit']} ({base['fecha']})  →  nuevo {nuevo['commit']} ({nuevo['fecha']})")
+    for escenario, n in nuevo["escenarios"].items():
+        b = base["escenarios"].get(escenario)
+        if b is None:
+            continue
+        columnas = []
+        for metrica in METRICAS:
+            cambio = (n[metrica] - b[metrica]) / b[metrica] * 100 if b[metrica] else 0.0
+            columnas.append(f"{metrica} {b[metrica]:.1f} → {n[metrica]:.1f} ({cambio:+.0f}%)")
+        print(f"{escenario:<18} " + "  ".join(columnas))
+    return 0
+
+
+def _importar_app(directorio: str) -> dict:
+    # Proceso nuevo con -X importtime; sin credenciales de Supabase ni base creada
+    base = os.path.join(directorio, "arranque.sqlite3")
+    entorno = {k: v for k, v in os.environ.items() if not k.startswith(("SUPABASE_", "DATABASE_URL"))}
+    entorno.update({"DATABASE_URL": f"sqlite:///{base}", "FACTURAS_DIR": os.path.join(directorio, "facturas")})
+    proceso = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", _IMPORTAR_APP],
+        cwd=RAIZ, env=entorno, capture_output=True, text=True,
+    )
+    if proceso.returncode != 0:
+        raise RuntimeError(proceso.stderr.strip().splitlines()[-1])
+    resultado = json.loads(proceso.stdout.strip().splitlines()[-1])
+    resultado["base_creada"] = os.path.exists(base)
+    # Líneas "import time: propio | acumulado | módulo", con dos espacios de sangría por
+    # nivel; se guardan los de primer y segundo nivel (lo que importa app.main directamente)
+    resultado["modulos_ms"] = []
+    for linea in proceso.stderr.splitlines():
+        partes = linea.split("|")
+        if len(partes) == 3 and partes[1].strip().isdigit():
+            nivel = (len(partes[2]) - len(partes[2].lstrip()) - 1) // 2
+            if nivel <= 1:
+                resultado["modulos_ms"].append((int(partes[1]) / 1000, partes[2].strip()))
+    return resultado
+
+
+def cmd_arranque(args) -> int:
+    with tempfile.TemporaryDirectory(prefix="finanzas-arranque-") as directorio:
+        corridas = [_importar_app(directorio) for _ in range(args.repeticiones)]
+    mediana = statistics.median(c["ms"] for c in corridas)
+    print(f"import app.main: mediana {mediana:.0f} ms en {args.repeticiones} procesos (presupuesto {args.presupuesto_ms:.0f} ms)")
+    for ms, modulo in sorted(corridas[-1]["modulos_ms"], reverse=True)[:args.top]:
+        print(f"  {ms:8.1f} ms  {modulo}")
+
+    fallos = []
+    if mediana > args.presupuesto_ms:
+        fallos.append(f"el import tarda {mediana:.0f} ms (presupuesto {args.presupuesto_ms:.0f} ms)")
+    cargados = [m for m in PEREZOSOS if m in corridas[-1]["modulos"]]
+    if cargados:
+        fallos.append(f"el import carga {', '.join(cargados)}")
+    if any(c["base_creada"] for c in corridas):
+        fallos.append("el import crea la base de datos (debe hacerlo el startup)")
+    for fallo in fallos:
+        print(f"FALLA: {fallo}")
+    return 1 if fallos else 0
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m bench", description="Benchmarks de carga de Finanzas")
+    sub = parser.add_subparsers(dest="comando", required=True)
+
+    p_correr = sub.add_parser("correr", help="Generar datos sintéticos y medir los escenarios")
+    p_correr.add_argument("--usuarios", type=int, default=5)
+    p_correr.add_argument("--cuentas", type=int, default=3, help="Cuentas por usuario")
+    p_correr.add_argument("--transacciones", type=int, default=2000, help="Transacciones por usuario")
+    p_correr.add_argument("--meses", type=int, default=12, help="Meses hacia atrás en que se reparten")
+    p_correr.add_argument("--semilla", type=int, default=1)
+    p_correr.add_argument("--peticiones", type=int, default=200, help="Peticiones medidas por escenario")
+    p_correr.add_argument("--concurrencia", type=int, default=5, help="Clientes simultáneos (uno por usuario)")
+    p_correr.add_argument("--calentamiento", type=int, default=5, help="Peticiones sin medir antes de cada escenario")
+    p_correr.add_argument("--latencia-storage-ms", type=float, default=0.0, help="Latencia simulada del almacenamiento")
+    p_correr.add_argument("--con-cache", action="store_true", help="Dejar activas las cachés de páginas y de versión de datos")
+    p_correr.add_argument("--escenarios", default=",".join(ESCENARIOS), help="Lista separada por comas")
+    p_correr.add_argument("--directorio", default=None, help="Dónde crear la base y las facturas (temporal por defecto)")
+    p_correr.add_argument("--salida", default=None, help="Archivo JSON de resultados")
+    p_correr.set_defaults(func=cmd_correr)
+
+    p_comparar = sub.add_parser("comparar", help="Comparar dos archivos de resultados")
+    p_comparar.add_argument("base")
+    p_comparar.add_argument("nuevo")
+    p_comparar.set_defaults(func=cmd_comparar)
+
+    p_arranque = sub.add_parser("arranque", help="Medir el tiempo de import de la app contra un presupuesto")
+    p_arranque.add_argument("--presupuesto-ms", type=float, default=float(os.getenv("ARRANQUE_PRESUPUESTO_MS", "2000")))
+    p_arranque.add_argument("--repeticiones", type=int, default=5, help="Procesos medidos (se toma la mediana)")
+    p_arranque.add_argument("--top", type=int, default=10, help="Módulos más lentos a mostrar")
+    p_arranque.set_defaults(func=cmd_arranque)
+
+    args = parser.parse_args(argv)
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
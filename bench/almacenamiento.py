@@ -0,0 +1,56 @@
+import os
+import threading
+import time
+from typing import Dict, Iterable, Union
+
+# Reemplazo en memoria del cliente de Supabase para los benchmarks. Imita la parte
+# de storage que usa AlmacenamientoSupabase (from_(bucket).upload / get_public_url /
+# remove), así la app recorre el mismo camino que en producción sin red. `latencia`
+# simula el tiempo de ida y vuelta de cada llamada (en segundos).
+
+
+class ErrorDuplicado(Exception):
+    pass
+
+
+class _BucketFalso:
+    def __init__(self, cliente: "ClienteSupabaseFalso", bucket: str):
+        self.cliente = cliente
+        self.bucket = bucket
+
+    def upload(self, ruta: str, archivo: Union[bytes, str], file_options: dict = None):
+        time.sleep(self.cliente.latencia)
+        tamano = len(archivo) if isinstance(archivo, bytes) else os.path.getsize(archivo)
+        clave = f"{self.bucket}/{ruta}"
+        with self.cliente.lock:
+            # Como Storage: sin x-upsert un objeto existente no se reescribe (409)
+            if clave in self.cliente.objetos and (file_options or {}).get("upsert") != "true":
+                raise ErrorDuplicado(f"409 Duplicate: {clave}")
+            self.cliente.objetos[clave] = tamano
+            self.cliente.subidas += 1
+
+    def get_public_url(self, ruta: str) -> str:
+        return f"https://bench.supabase.local/storage/v1/object/public/{self.bucket}/{ruta}"
+
+    def remove(self, rutas: Iterable[str]):
+        time.sleep(self.cliente.latencia)
+        with self.cliente.lock:
+            for ruta in rutas:
+                self.cliente.objetos.pop(f"{self.bucket}/{ruta}", None)
+
+
+class _StorageFalso:
+    def __init__(self, cliente: "ClienteSupabaseFalso"):
+        self.cliente = cliente
+
+    def from_(self, bucket: str) -> _BucketFalso:
+        return _BucketFalso(self.cliente, bucket)
+
+
+class ClienteSupabaseFalso:
+    def __init__(self, latencia: float = 0.0):
+        self.latencia = latencia
+        self.objetos: Dict[str, int] = {}  # bucket/ruta → bytes
+        self.subidas = 0
+        self.lock = threading.Lock()
+        self.storage = _StorageFalso(self)
@@ -0,0 +1,151 @@
+import asyncio
+import itertools
+import os
+import time
+from dataclasses import dataclass
+from typing import Callable, Dict, List
+import httpx
+from app.almacenamiento import AlmacenamientoMedido, AlmacenamientoSupabase
+from app.formato import current_month_str
+from app.main import app
+from .almacenamiento import ClienteSupabaseFalso
+from .datos import UsuarioBench
+
+# Corre la app ASGI real en el mismo proceso (httpx.ASGITransport, sin red ni
+# servidor) con el ciclo de vida completo (startup/shutdown). Cada cliente es un
+# usuario distinto con su cookie de sesión; `concurrencia` clientes lanzan a la vez
+# las peticiones de un escenario y se mide la latencia de cada una.
+BUSQUEDAS = ["luz", "mercado", "salario", "arriendo", "transporte", "tarjeta", "restaurante"]
+
+
+@dataclass
+class Cliente:
+    http: httpx.AsyncClient
+    usuario: UsuarioBench
+
+
+@dataclass
+class Medicion:
+    escenario: str
+    duraciones: List[float]
+    errores: int
+    segundos: float
+
+    def resumen(self) -> dict:
+        ordenadas = sorted(self.duraciones)
+        return {
+            "peticiones": len(self.duraciones) + self.errores,
+            "errores": self.errores,
+            "p50_ms": _percentil(ordenadas, 50) * 1000,
+            "p95_ms": _percentil(ordenadas, 95) * 1000,
+            "p99_ms": _percentil(ordenadas, 99) * 1000,
+            "media_ms": sum(ordenadas) / len(ordenadas) * 1000 if ordenadas else 0.0,
+            "por_segundo": len(ordenadas) / self.segundos if self.segundos else 0.0,
+        }
+
+
+def _percentil(ordenadas: List[float], p: float) -> float:
+    # Rango más cercano: el valor bajo el que queda el p % de las muestras
+    if not ordenadas:
+        return 0.0
+    indice = max(0, min(len(ordenadas) - 1, -(-len(ordenadas) * p // 100) - 1))
+    return ordenadas[int(indice)]
+
+
+# ---------- Escenarios ----------
+# Cada uno recibe el cliente y el número de la petición, y devuelve la respuesta
+
+async def _login(cliente: Cliente, n: int) -> httpx.Response:
+    return await cliente.http.post("/login", data={"email": cliente.usuario.email, "password": cliente.usuario.password})
+
+async def _dashboard(cliente: Cliente, n: int) -> httpx.Response:
+    return await cliente.http.get("/dashboard")
+
+async def _listado(cliente: Cliente, n: int) -> httpx.Response:
+    return await cliente.http.get("/transacciones", params={"mes": current_month_str()})
+
+async def _busqueda(cliente: Cliente, n: int) -> httpx.Response:
+    return await cliente.http.get("/transacciones", params={"q": BUSQUEDAS[n % len(BUSQUEDAS)], "todos": "true"})
+
+async def _crear_con_factura(cliente: Cliente, n: int) -> httpx.Response:
+    # PDF distinto en cada petición: todas pasan por la cola y el almacenamiento
+    factura = b"%PDF-1.4\n" + os.urandom(16 * 1024)
+    datos = {"monto": "45000", "tipo": "gasto", "categoria": "variable", "subcategoria": "mercado", "cuenta_id": str(cliente.usuario.cuenta_id)}
+    return await cliente.http.post("/transacciones", data=datos, files={"factura": (f"factura-{n}.pdf", factura, "application/pdf")})
+
+async def _historial(cliente: Cliente, n: int) -> httpx.Response:
+    return await cliente.http.get("/historial")
+
+ESCENARIOS: Dict[str, Callable] = {
+    "login": _login,
+    "dashboard": _dashboard,
+    "listado": _listado,
+    "busqueda": _busqueda,
+    "crear_con_factura": _crear_con_factura,
+    "historial": _historial,
+}
+
+
+# ---------- Corrida ----------
+async def _medir(escenario: str, clientes: List[Cliente], peticiones: int) -> Medicion:
+    fn = ESCENARIOS[escenario]
+    contador = itertools.count()
+    duraciones: List[float] = []
+    errores = 0
+
+    async def trabajador(cliente: Cliente):
+        nonlocal errores
+        while (n := next(contador)) < peticiones:
+            inicio = time.perf_counter()
+            try:
+                respuesta = await fn(cliente, n)
+                ok = respuesta.status_code < 400
+            except Exception:
+                ok = False
+            if ok:
+                duraciones.append(time.perf_counter() - inicio)
+            else:
+                errores += 1
+
+    inicio = time.perf_counter()
+    await asyncio.gather(*(trabajador(c) for c in clientes))
+    return Medicion(escenario, duraciones, errores, time.perf_counter() - inicio)
+
+async def _conectar(usuario: UsuarioBench, transporte) -> Cliente:
+    # Las redirecciones no se siguen: se mide solo la petición del escenario
+    cliente = Cliente(httpx.AsyncClient(transport=transporte, base_url="http://bench"), usuario)
+    respuesta = await _login(cliente, 0)
+    if respuesta.status_code != 302:
+        raise RuntimeError(f"No se pudo iniciar sesión como {usuario.email}: {respuesta.status_code}")
+    return cliente
+
+async def correr(
+    usuarios: List[UsuarioBench],
+    escenarios: List[str],
+    peticiones: int,
+    concurrencia: int,
+    calentamiento: int = 5,
+    latencia_storage: float = 0.0,
+    progreso: Callable[[str, dict], None] = None,
+) -> Dict[str, dict]:
+    await app.router.startup()
+    # Mismo camino que con Supabase, contra el cliente en memoria
+    almacenamiento = AlmacenamientoMedido(AlmacenamientoSupabase(ClienteSupabaseFalso(latencia_storage)))
+    app.state.almacenamiento = app.state.cola_facturas.almacenamiento = almacenamiento
+    transporte = httpx.ASGITransport(app=app)
+    clientes = []
+    try:
+        for usuario in usuarios[:concurrencia]:
+            clientes.append(await _conectar(usuario, transporte))
+        resultados = {}
+        for escenario in escenarios:
+            if calentamiento:
+                await _medir(escenario, clientes, calentamiento)
+            resultados[escenario] = (await _medir(escenario, clientes, peticiones)).resumen()
+            if progreso:
+                progreso(escenario, resultados[escenario])
+        return resultados
+    finally:
+        for cliente in clientes:
+            await cliente.http.aclose()
+        await app.router.shutdown()
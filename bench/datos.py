@@ -0,0 +1,98 @@
+import random
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import List
+from sqlmodel import Session
+from app import agregados
+from app.formato import month_for_date
+from app.models import Cuenta, Usuario
+from app.security import pwd_context
+
+# Datos sintéticos para los benchmarks: N usuarios × M cuentas × K transacciones
+# repartidas en los últimos `meses` meses. La semilla fija hace que dos corridas
+# carguen exactamente lo mismo. Las transacciones entran con agregados.insertar_lote,
+# así saldos, resúmenes, índice de búsqueda y registro de cambios quedan al día.
+PASSWORD = "bench-password"
+LOTE = 1000
+
+# (tipo, peso, [(categoria, subcategoria, monto mínimo, monto máximo)])
+MEZCLA = [
+    ("gasto", 70, [
+        ("fijo", "arriendo", 900_000, 2_500_000),
+        ("fijo", "luz", 60_000, 250_000),
+        ("fijo", "agua", 40_000, 150_000),
+        ("fijo", "internet", 70_000, 160_000),
+        ("variable", "mercado", 20_000, 400_000),
+        ("variable", "transporte", 2_800, 60_000),
+        ("variable", "restaurante", 15_000, 180_000),
+        ("variable", "salud", 20_000, 300_000),
+    ]),
+    ("ingreso", 20, [
+        ("fijo", "salario", 2_000_000, 9_000_000),
+        ("variable", "freelance", 200_000, 3_000_000),
+        ("variable", "intereses", 1_000, 80_000),
+    ]),
+    ("deuda", 10, [
+        ("fijo", "tarjeta", 100_000, 1_500_000),
+        ("variable", "prestamo", 200_000, 2_000_000),
+    ]),
+]
+NOMBRES_CUENTA = ["Efectivo", "Ahorros", "Corriente", "Tarjeta", "Nequi", "Daviplata"]
+
+
+@dataclass
+class UsuarioBench:
+    email: str
+    password: str
+    cuenta_id: int  # la primera de sus cuentas, para crear transacciones
+
+
+def email(n: int) -> str:
+    return f"bench{n}@bench.local"
+
+def _transaccion(azar: random.Random, ahora: datetime, dias: int) -> dict:
+    tipo, _, opciones = azar.choices(MEZCLA, weights=[m[1] for m in MEZCLA])[0]
+    categoria, subcategoria, minimo, maximo = azar.choice(opciones)
+    fecha = ahora - timedelta(days=azar.random() * dias)
+    return {
+        "monto": round(azar.uniform(minimo, maximo), -2),
+        "tipo": tipo,
+        "categoria": categoria,
+        "subcategoria": subcategoria,
+        "fecha": fecha,
+        "mes": month_for_date(fecha),
+    }
+
+def generar(engine, usuarios: int, cuentas: int, transacciones: int, meses: int = 12, semilla: int = 1) -> List[UsuarioBench]:
+    # transacciones: por usuario
+    azar = random.Random(semilla)
+    ahora = datetime.utcnow()
+    dias = meses * 30
+    hashed = pwd_context.hash(PASSWORD)  # un solo hash: todos comparten la contraseña
+    creados = []
+    with Session(engine) as session:
+        for n in range(usuarios):
+            usuario = Usuario(email=email(n), hashed_password=hashed)
+            session.add(usuario)
+            session.flush()
+            ids = []
+            for c in range(cuentas):
+                cuenta = Cuenta(nombre=NOMBRES_CUENTA[c % len(NOMBRES_CUENTA)], usuario_id=usuario.id)
+                session.add(cuenta)
+                session.flush()
+                ids.append(cuenta.id)
+            usuario_id = usuario.id
+            for inicio in range(0, transacciones, LOTE):
+                filas = {}
+                for i in range(inicio, min(inicio + LOTE, transacciones)):
+                    huella = f"bench:{i}"
+                    filas[huella] = {
+                        **_transaccion(azar, ahora, dias),
+                        "usuario_id": usuario_id,
+                        "cuenta_id": azar.choice(ids),
+                        "huella": huella,
+                    }
+                agregados.insertar_lote(session, usuario_id, filas)
+            session.commit()
+            creados.append(UsuarioBench(email(n), PASSWORD, ids[0]))
+    return creados